@@ -4,6 +4,7 @@ from django.conf import settings
 from django.test import TestCase
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from qatrack.attachments.utils import to_bytes
 
@@ -21,6 +22,11 @@ class TestToBytes(TestCase):
         p = plt.plot([0, 1], [0, 1])[0]
         assert len(to_bytes(p.figure.canvas, self.fn)) > 0
 
+    def test_figure_without_canvas(self):
+        fig = Figure()
+        fig.add_subplot(111).plot([0, 1], [0, 1])
+        assert len(to_bytes(fig, self.fn)) > 0
+
     def test_bytes(self):
         inp = b'1010'
         assert to_bytes(inp) == inp
@@ -1,6 +1,7 @@
 import io
 import os
 
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 import scipy.misc
 
@@ -23,6 +24,10 @@ def figure_to_bytes(obj, fname):
     if fmt not in ["png", "pdf", "ps", "eps", "svg"]:
         fmt = "png"
 
+    if obj.canvas is None:
+        # figures created without pyplot have no canvas to render with
+        FigureCanvasAgg(obj)
+
     dat = io.BytesIO()
     obj.savefig(dat, format=fmt)
     dat.seek(0)
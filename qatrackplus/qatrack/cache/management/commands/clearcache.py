@@ -1,8 +1,10 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.cache import cache
+from django.core.cache import caches
 
 
 class Command(BaseCommand):
     def handle(self, *args, **kwargs):
-        cache.clear()
+        for alias in settings.CACHES:
+            caches[alias].clear()
         self.stdout.write('Cleared cache\n')
@@ -1,3 +1,5 @@
+import datetime
+
 from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin import widgets, options
@@ -9,7 +11,7 @@ from django.db.models import Count, Q
 import django.forms as forms
 from django.shortcuts import redirect, render, HttpResponseRedirect
 from django.utils import timezone
-from django.utils.html import escape
+from django.utils.html import escape, format_html
 from django.utils.text import Truncator
 from django.utils.translation import ugettext as _
 
@@ -20,6 +22,7 @@ from qatrack.attachments.admin import (
     SaveInlineAttachmentUserMixin,
 )
 import qatrack.qa.models as models
+from qatrack.qa import history, regrade, signals
 from qatrack.qa.utils import qs_extra_for_utc_name
 from qatrack.units.models import Unit
 
@@ -140,6 +143,84 @@ class SetMultipleReferencesAndTolerancesForm(forms.Form):
     reference = forms.CharField(max_length=255)
 
 
+class RegradeForm(forms.Form):
+    _selected_action = forms.CharField(widget=forms.MultipleHiddenInput)
+    date_from = forms.DateField(label=_("Completed on or after"), required=False, help_text=_("YYYY-MM-DD"))
+    date_to = forms.DateField(label=_("Completed on or before"), required=False, help_text=_("YYYY-MM-DD"))
+    use_current = forms.BooleanField(
+        label=_("Replace references and tolerances"), required=False,
+        help_text=_(
+            "Grade against the current reference and tolerance of each unit assignment and permanently "
+            "replace the reference and tolerance recorded with every selected test instance"
+        ),
+    )
+
+    def __init__(self, *args, **kwargs):
+        allow_current = kwargs.pop("allow_current", False)
+        super(RegradeForm, self).__init__(*args, **kwargs)
+        if not allow_current:
+            del self.fields["use_current"]
+
+    def clean(self):
+        cleaned_data = super(RegradeForm, self).clean()
+        if cleaned_data.get("use_current") and not cleaned_data.get("date_from"):
+            self.add_error("date_from", _("A start date is required when replacing references and tolerances"))
+        return cleaned_data
+
+
+class RegradeMixin(object):
+    """Admin action helper for re-grading test instances (see qa.regrade)"""
+
+    def regrade_view(self, request, queryset, action, instance_filter, allow_current=False):
+        """
+        Render a form to select a date range and preview (dry run) or apply
+        a re-grade of the test instances selected by
+        `regrade.affected_instances(date_from=..., date_to=..., **instance_filter)`.
+        Test instances are graded against their own references & tolerances
+        unless `allow_current` is True and the user opts in to replacing them.
+        """
+
+        if "preview" in request.POST or "apply" in request.POST:
+            form = RegradeForm(request.POST, allow_current=allow_current)
+        else:
+            form = RegradeForm(
+                initial={"_selected_action": request.POST.getlist(admin.ACTION_CHECKBOX_NAME)},
+                allow_current=allow_current,
+            )
+
+        stats = None
+        use_current = False
+        if form.is_bound and form.is_valid():
+            use_current = form.cleaned_data.get("use_current", False)
+            tz = timezone.get_current_timezone()
+            date_from = form.cleaned_data["date_from"]
+            date_to = form.cleaned_data["date_to"]
+            if date_from:
+                date_from = timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min), tz)
+            if date_to:
+                date_to = timezone.make_aware(datetime.datetime.combine(date_to, datetime.time.max), tz)
+
+            tis = regrade.affected_instances(date_from=date_from, date_to=date_to, **instance_filter)
+            dry_run = "apply" not in request.POST
+            stats = regrade.regrade(tis, use_current=use_current, dry_run=dry_run)
+
+            if not dry_run:
+                messages.success(request, _("Re-grade complete: %s") % stats)
+                return HttpResponseRedirect(request.get_full_path())
+
+        context = {
+            "queryset": queryset,
+            "form": form,
+            "stats": stats,
+            "action": action,
+            "allow_current": allow_current,
+            "use_current": use_current,
+            "opts": self.model._meta,
+            "action_checkbox_name": admin.ACTION_CHECKBOX_NAME,
+        }
+        return render(request, "admin/qa/regrade.html", context)
+
+
 # see http://stackoverflow.com/questions/851636/default-filter-in-django-admin
 class ActiveUnitTestInfoFilter(admin.SimpleListFilter):
 
@@ -176,7 +257,7 @@ class ActiveUnitTestInfoFilter(admin.SimpleListFilter):
         return qs
 
 
-class UnitTestInfoAdmin(AdminViews, admin.ModelAdmin):
+class UnitTestInfoAdmin(RegradeMixin, AdminViews, admin.ModelAdmin):
 
     admin_views = (
         ('Copy References & Tolerances', 'redirect_to'),
@@ -185,7 +266,7 @@ class UnitTestInfoAdmin(AdminViews, admin.ModelAdmin):
     def redirect_to(self, *args, **kwargs):
         return redirect(reverse_lazy("qa_copy_refs_and_tols"))
 
-    actions = ['set_multiple_references_and_tolerances']
+    actions = ['set_multiple_references_and_tolerances', 'regrade_test_history']
     form = TestInfoForm
     fields = (
         "unit", "test", "test_type",
@@ -301,6 +382,13 @@ class UnitTestInfoAdmin(AdminViews, admin.ModelAdmin):
 
     set_multiple_references_and_tolerances.short_description = "Set multiple references and tolerances"
 
+    def regrade_test_history(self, request, queryset):
+        return self.regrade_view(
+            request, queryset, "regrade_test_history", {"unit_test_infos": queryset}, allow_current=True,
+        )
+
+    regrade_test_history.short_description = _("Re-grade test history")
+
     def save_model(self, request, test_info, form, change):
         """create new reference when user updates value"""
 
@@ -590,6 +678,7 @@ class TestAdmin(SaveUserMixin, SaveInlineAttachmentUserMixin, admin.ModelAdmin):
     list_filter = ["category", "type", TestListMembershipFilter, "testlistmembership__test_list"]
     search_fields = ["name", "slug", "category__name"]
     save_as = True
+    actions = ["profile_calculation_procedures"]
 
     form = TestForm
 
@@ -607,7 +696,7 @@ class TestAdmin(SaveUserMixin, SaveInlineAttachmentUserMixin, admin.ModelAdmin):
             if "pyplot" in cp or "pylab" in cp:
                 warning = (
                     "Warning: Instead of using pyplot or pylab, it is recommended that you use "
-                    "the object oriented interface to matplotlib."
+                    "the object oriented interface to matplotlib (e.g. fig = Figure())."
                 )
                 messages.add_message(request, messages.WARNING, warning)
 
@@ -619,6 +708,20 @@ class TestAdmin(SaveUserMixin, SaveInlineAttachmentUserMixin, admin.ModelAdmin):
 
         super(TestAdmin, self).save_model(request, obj, form, change)
 
+    def profile_calculation_procedures(self, request, queryset):
+        """run the calculation procedures of the selected tests under cProfile (see ProcedureStatsAdmin)"""
+
+        tests = queryset.exclude(calculation_procedure__isnull=True).exclude(calculation_procedure="")
+        for test in tests:
+            stats, created = models.ProcedureStats.objects.get_or_create(test=test, defaults={"profile": True})
+            if not created and not stats.profile:
+                stats.profile = True
+                stats.save()
+
+        self.message_user(request, _("Profiling enabled for %d test(s)") % len(tests))
+
+    profile_calculation_procedures.short_description = _("Profile calculation procedures of selected tests")
+
 
 def unit_name(obj):
     return obj.unit.name
@@ -826,6 +929,19 @@ class TestInstanceAdmin(SaveInlineAttachmentUserMixin, admin.ModelAdmin):
             "created_by"
         )
 
+    def save_model(self, request, obj, form, change):
+        super(TestInstanceAdmin, self).save_model(request, obj, form, change)
+        # test instance saves don't invalidate the history or update the
+        # last valid instance & due date of their collection (see qa.signals)
+        history.invalidate(obj.test_list_instance.unit_test_collection_id)
+        signals.update_last_instances(obj.test_list_instance)
+
+    def delete_model(self, request, obj):
+        tli = obj.test_list_instance
+        super(TestInstanceAdmin, self).delete_model(request, obj)
+        history.invalidate(tli.unit_test_collection_id)
+        signals.update_last_instances(tli)
+
     def test_list_name(self, obj):
         return obj.test_list_instance.test_list.name
     test_list_name.short_description = _("Test List Name")
@@ -856,8 +972,14 @@ class ToleranceForm(forms.ModelForm):
                 self._update_errors({forms.models.NON_FIELD_ERRORS: ["Duplicate Tolerance. A Tolerance with these values already exists"]})
 
 
-class ToleranceAdmin(BasicSaveUserAdmin):
+class ToleranceAdmin(RegradeMixin, BasicSaveUserAdmin):
     form = ToleranceForm
+    actions = ['regrade_test_instances']
+
+    def regrade_test_instances(self, request, queryset):
+        return self.regrade_view(request, queryset, "regrade_test_instances", {"tolerances": queryset})
+
+    regrade_test_instances.short_description = _("Re-grade test instances using these tolerances")
 
 
 class AutoReviewAdmin(admin.ModelAdmin):
@@ -865,6 +987,34 @@ class AutoReviewAdmin(admin.ModelAdmin):
     list_editable = ["pass_fail", "status"]
 
 
+class ProcedureStatsAdmin(admin.ModelAdmin):
+    """Slowest calculation procedures (see qa.telemetry)"""
+
+    list_display = (
+        "test", "wall_p50", "wall_p95", "wall_max", "cpu_p50", "cpu_p95",
+        "memory_p95", "executions", "errors", "last_executed", "profile",
+    )
+    list_editable = ("profile",)
+    list_select_related = ("test",)
+    search_fields = ("test__name", "test__slug",)
+    fields = (
+        "test", "profile", "executions", "errors", "wall_p50", "wall_p95", "wall_max",
+        "cpu_p50", "cpu_p95", "memory_p95", "last_executed", "profile_date", "profile_output",
+    )
+    readonly_fields = (
+        "test", "executions", "errors", "wall_p50", "wall_p95", "wall_max",
+        "cpu_p50", "cpu_p95", "memory_p95", "last_executed", "profile_date", "profile_output",
+    )
+
+    def profile_output(self, obj):
+        return format_html("<pre>{}</pre>", obj.profile_report)
+    profile_output.short_description = _("cProfile report")
+
+    def has_add_permission(self, request):
+        """procedure stats are created automatically"""
+        return False
+
+
 admin.site.register([models.Tolerance], ToleranceAdmin)
 admin.site.register([models.AutoReviewRule], AutoReviewAdmin)
 admin.site.register([models.Category], CategoryAdmin)
@@ -878,3 +1028,4 @@ admin.site.register([models.Frequency], FrequencyAdmin)
 admin.site.register([models.TestInstanceStatus], StatusAdmin)
 admin.site.register([models.TestInstance], TestInstanceAdmin)
 admin.site.register([models.TestListInstance], TestListInstanceAdmin)
+admin.site.register([models.ProcedureStats], ProcedureStatsAdmin)
@@ -8,7 +8,10 @@ import tastypie
 from tastypie.resources import Resource, ModelResource, ALL, ALL_WITH_RELATIONS
 from tastypie.authentication import BasicAuthentication
 from tastypie.authorization import DjangoAuthorization
+from tastypie import http
+from tastypie.exceptions import ImmediateHttpResponse
 from tastypie.utils import timezone
+from qatrack.qa import ingest
 import qatrack.qa.models as models
 from qatrack.units.models import Unit, Modality, UnitType
 
@@ -377,3 +380,31 @@ class TestListInstanceResource(ModelResource):
         else:
             review = ()
         return review
+
+
+class BulkTestListInstanceResource(Resource):
+    """
+    Create many test list instances (and their test instance values) in a
+    single request. See qa.ingest for the format of submitted objects.
+    """
+
+    class Meta:
+        resource_name = "bulk_testlistinstances"
+        list_allowed_methods = ["post"]
+        detail_allowed_methods = []
+        authentication = BasicAuthentication()
+        object_class = object
+        include_resource_uri = False
+
+    def post_list(self, request, **kwargs):
+
+        if not request.user.has_perm("qa.add_testlistinstance"):
+            raise ImmediateHttpResponse(response=http.HttpForbidden())
+
+        data = self.deserialize(request, request.body, format=request.META.get("CONTENT_TYPE", "application/json"))
+        objects = data.get("objects") if isinstance(data, dict) else None
+
+        results = ingest.ingest(objects, request.user, sender=self)
+
+        response_class = http.HttpCreated if results["success"] else http.HttpBadRequest
+        return self.create_response(request, results, response_class=response_class)
@@ -0,0 +1,635 @@
+"""
+Helpers for compiling and executing the calculation procedures of
+composite, string composite & upload :model:`qa.Test`s.
+"""
+
+import collections
+import cProfile
+import hashlib
+import io
+import json
+import math
+import mmap
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from functools import reduce
+
+try:
+    import resource
+except ImportError:  # pragma: nocover
+    resource = None
+
+import dicom
+import matplotlib
+import numpy
+import scipy
+from django.conf import settings
+from django.core.cache import caches
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from qatrack.attachments.utils import to_bytes, imsave
+
+# cpu time of the current thread where supported
+cpu_time = getattr(time, "thread_time", time.process_time)
+
+DEFAULT_CALCULATION_CONTEXT = {
+    "dicom": dicom,
+    "math": math,
+    "numpy": numpy,
+    "matplotlib": matplotlib,
+    "scipy": scipy,
+}
+
+
+def process_procedure(procedure):
+    """
+    Cleans and sets new style division for calculations procedures. Used by
+    both the :view:`qa.perform.Upload` &
+    :view:`qa.perform.CompositeCalculation` views.
+
+    """
+
+    return "\n".join(["from __future__ import division", procedure, "\n"]).replace('\r', '\n')
+
+
+def procedure_hash(procedure):
+    """return a hash identifying the contents of a calculation procedure"""
+    return hashlib.sha1((procedure or "").encode("UTF-8")).hexdigest()
+
+
+class ProcedureCache(object):
+    """
+    Process wide cache of compiled calculation procedures.
+
+    Code objects are keyed on the (test id, procedure hash) pair so
+    that an edited procedure is never executed from a stale entry even
+    if an invalidation is missed (e.g. a Test edited by another process).
+    Entries for a test are dropped when the :model:`qa.Test` is saved
+    or deleted (see qa.signals).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._code = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, test_id, procedure):
+        """return compiled code object for the input test/procedure"""
+
+        key = (test_id, procedure_hash(procedure))
+
+        with self._lock:
+            code = self._code.get(key)
+            if code is not None:
+                self.hits += 1
+                return code
+
+        # compile outside of lock.  SyntaxErrors etc are propagated to caller
+        code = compile(process_procedure(procedure or ""), "<string>", "exec")
+
+        with self._lock:
+            self.misses += 1
+            self._code[key] = code
+
+        return code
+
+    def invalidate(self, test_id):
+        """remove all compiled procedures for the input test"""
+        with self._lock:
+            for key in [k for k in self._code if k[0] == test_id]:
+                del self._code[key]
+
+    def clear(self):
+        with self._lock:
+            self._code.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """return dict of cache hits, misses & current size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._code)}
+
+    def __len__(self):
+        return len(self._code)
+
+
+procedure_cache = ProcedureCache()
+
+
+def compile_procedure(test_id, procedure):
+    """return (possibly cached) compiled code for a tests calculation procedure"""
+    return procedure_cache.get(test_id, procedure)
+
+
+def dependency_layers(dependencies):
+    """
+    Topologically sort a dict of slug -> set of slugs it depends on.
+
+    Returns a list of layers (each a sorted list of slugs depending only
+    on slugs in earlier layers) and a list of slugs involved in cyclic
+    dependencies.
+
+    See http://code.activestate.com/recipes/577413-topological-sort/
+    """
+
+    data = dict((k, set(v) - set([k])) for k, v in dependencies.items())  # Ignore self dependencies
+    if not data:
+        return [], []
+
+    extra_items_in_deps = reduce(set.union, list(data.values())) - set(data.keys())
+    data.update(dict((item, set()) for item in extra_items_in_deps))
+    layers = []
+    while True:
+        ordered = set(item for item, dep in list(data.items()) if not dep)
+        if not ordered:
+            break
+        layers.append(list(sorted(ordered)))
+        data = dict((item, (dep - ordered)) for item, dep in list(data.items()) if item not in ordered)
+
+    return layers, list(data.keys())
+
+
+def affected_slugs(dependencies, changed):
+    """
+    Return the set of slugs in `dependencies` (a dict of slug -> set of
+    names read by its procedure) which depend directly or indirectly on
+    any of the `changed` slugs (including any changed slugs themselves).
+    """
+
+    dependents = collections.defaultdict(set)
+    for slug, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].add(slug)
+
+    affected = set(s for s in changed if s in dependencies)
+    to_visit = list(changed)
+    while to_visit:
+        for dependent in dependents[to_visit.pop()]:
+            if dependent not in affected:
+                affected.add(dependent)
+                to_visit.append(dependent)
+
+    return affected
+
+
+class CalculationResult(object):
+    """
+    Outcome of executing a single calculation procedure.
+
+    `files` is a list of (file name, bytes) pairs written by the procedure
+    via `write_file`. `fatal` is set when the procedure could not be run
+    to completion for reasons other than an exception in the procedure
+    itself (e.g. it exceeded its time or memory limit).
+    """
+
+    def __init__(self, slug, value=None, error=None, files=None, fatal=False, test_id=None, stats=None, profile=None):
+        self.slug = slug
+        self.value = value
+        self.error = error
+        self.files = files or []
+        self.fatal = fatal
+        self.test_id = test_id
+        # dict of wall & cpu time (s) and peak memory (MB) for the execution
+        self.stats = stats
+        # cProfile report text when profiling was requested for the test
+        self.profile = profile
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "CalculationResult(%s, value=%r, error=%r)" % (self.slug, self.value, self.error)
+
+
+def file_data(obj, fname):
+    """convert an object passed to `write_file` to bytes"""
+    data = imsave(obj, fname)
+    if data is None:
+        data = to_bytes(obj, fname)
+    return data
+
+
+class FigureFactory(object):
+    """
+    Creates matplotlib Figures for a single procedure execution.
+
+    Figures are created with their own Agg canvas rather than via pyplot so
+    they are never registered with pyplot's global figure manager, and
+    procedures running concurrently in different threads can't draw on
+    (or close) each other's figures.  Available to procedures as `Figure`:
+
+        fig = Figure(figsize=(4, 3))
+        fig.add_subplot(111).plot(x, y)
+        write_file("plot.png", fig)
+    """
+
+    def __init__(self):
+        self.figures = []
+
+    def __call__(self, *args, **kwargs):
+        fig = Figure(*args, **kwargs)
+        FigureCanvasAgg(fig)
+        self.figures.append(fig)
+        return fig
+
+    @property
+    def current(self):
+        """the most recently created figure (or None)"""
+        return self.figures[-1] if self.figures else None
+
+    def close(self):
+        """release the figures created by this factory"""
+        for fig in self.figures:
+            fig.clear()
+        self.figures = []
+
+
+def get_file_writer(files, figures=None):
+    """
+    return a `write_file` function which collects written files in
+    `files`.  If no object is passed to `write_file` the most recent figure
+    created by the FigureFactory `figures` is written.
+    """
+
+    def write(fname, obj=None):
+        fname = os.path.basename(fname)
+        if obj is None:
+            obj = figures.current if figures is not None else None
+            if obj is None:
+                raise ValueError("write_file requires an object to write when no Figure has been created")
+        files.append((fname, file_data(obj, fname)))
+
+    return write
+
+
+class ParsedFileCache(object):
+    """
+    Short lived, size bounded, per process cache of objects parsed from
+    uploaded files (e.g. DICOM datasets) so that several upload tests
+    analysing the same file don't each have to re-parse it.
+
+    Entries are keyed on the file (path, size & modification time) and the
+    parser used and are evicted least recently used first once more than
+    `max_entries` entries or `max_size` MB of source files are cached, or
+    when older than `timeout` seconds.
+    """
+
+    def __init__(self, max_entries=8, max_size=512, timeout=300):
+        self.max_entries = max_entries
+        self.max_size = max_size * 1024 * 1024
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def file_key(self, path):
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime), st.st_size
+
+    def get(self, path, parser, *args, **kwargs):
+        """return parser(path, *args, **kwargs), cached if possible"""
+
+        fkey, size = self.file_key(path)
+        parser_key = (getattr(parser, "__module__", None), getattr(parser, "__qualname__", repr(parser)))
+        key = (fkey, parser_key, args, tuple(sorted(kwargs.items())))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now - entry[0] < self.timeout:
+                self._entries[key] = entry
+                return entry[2]
+
+        obj = parser(path, *args, **kwargs)
+
+        if size > self.max_size:
+            return obj
+
+        with self._lock:
+            self._entries[key] = (now, size, obj)
+            self._cull(now)
+
+        return obj
+
+    def _cull(self, now):
+        for key in [k for k, e in self._entries.items() if now - e[0] >= self.timeout]:
+            del self._entries[key]
+
+        total = sum(e[1] for e in self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total > self.max_size):
+            key, entry = self._entries.popitem(last=False)
+            total -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_parsed_file_cache = None
+
+
+def get_parsed_file_cache():
+
+    global _parsed_file_cache
+
+    if _parsed_file_cache is None:
+        _parsed_file_cache = ParsedFileCache(
+            max_entries=getattr(settings, "CALCULATION_FILE_CACHE_ENTRIES", 8),
+            max_size=getattr(settings, "CALCULATION_FILE_CACHE_SIZE", 512),
+            timeout=getattr(settings, "CALCULATION_FILE_CACHE_TIMEOUT", 300),
+        )
+    return _parsed_file_cache
+
+
+class UploadedFile(object):
+    """
+    Lazy access to an uploaded file for calculation procedures (available
+    as `UPLOAD` in the calculation context).  Nothing is read or mapped
+    until requested, so procedures can inspect e.g. just a DICOM header or
+    a region of a large image without reading the whole file into memory:
+
+        header = UPLOAD.read_dicom(stop_before_pixels=True)
+        roi = UPLOAD.memmap(dtype="uint16", offset=1024, shape=(1024, 1024))[500:524, 500:524]
+        magic = UPLOAD.mmap[:4]
+
+    `UPLOAD.dicom` and `UPLOAD.parse(parser, ...)` results are shared
+    between procedures (and requests) analysing the same file, so must be
+    treated as read only:
+
+        image = UPLOAD.parse(scipy.misc.imread, flatten=True)
+
+    `FILE` and `BIN_FILE` are `UPLOAD.file` and `UPLOAD.bin_file`, which
+    only open the file when first used. All handles are closed by `close`.
+    """
+
+    # DICOM elements larger than this many bytes (e.g. pixel data) are not
+    # read until accessed
+    DICOM_DEFER_SIZE = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap_file = None
+        self._mmap = None
+        self._files = {}
+        self.file = LazyFile(self, "r")
+        self.bin_file = LazyFile(self, "rb")
+
+    def open(self, mode="r"):
+        """return a handle to the file opened in `mode`, shared until `close` is called"""
+
+        if mode not in self._files:
+            self._files[mode] = open(self.path, mode)
+        return self._files[mode]
+
+    @property
+    def mmap(self):
+        """read only mmap.mmap of the file contents"""
+
+        if self._mmap is None:
+            self._mmap_file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._mmap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def memmap(self, dtype="uint8", offset=0, shape=None, order="C"):
+        """return a read only numpy.memmap of the file contents"""
+        return numpy.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+
+    def read_dicom(self, stop_before_pixels=False, defer_size=DICOM_DEFER_SIZE):
+        """parse the file as DICOM deferring the reading of large elements until accessed"""
+        return dicom.read_file(self.path, defer_size=defer_size, stop_before_pixels=stop_before_pixels)
+
+    def parse(self, parser, *args, **kwargs):
+        """return (cached) result of parser(path, *args, **kwargs)"""
+        return get_parsed_file_cache().get(self.path, parser, *args, **kwargs)
+
+    @property
+    def dicom(self):
+        """lazily parsed (and cached) DICOM dataset"""
+        return self.parse(dicom.read_file, defer_size=self.DICOM_DEFER_SIZE)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap_file.close()
+        self._mmap = self._mmap_file = None
+
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class LazyFile(object):
+    """
+    File like proxy for an :class:`UploadedFile` opened in `mode`. The file
+    is opened on first use so procedures which never read it (e.g. those
+    using `UPLOAD.parse`) don't pay for opening it.
+    """
+
+    def __init__(self, upload, mode):
+        self._upload = upload
+        self._mode = mode
+
+    def __getattr__(self, name):
+        return getattr(self._upload.open(self._mode), name)
+
+    def __iter__(self):
+        return iter(self._upload.open(self._mode))
+
+    def __next__(self):
+        return next(self._upload.open(self._mode))
+
+    def __enter__(self):
+        return self._upload.open(self._mode).__enter__()
+
+    def __exit__(self, *exc):
+        return self._upload.open(self._mode).__exit__(*exc)
+
+
+def file_context(path):
+    """return calculation context entries for an uploaded file"""
+
+    upload = UploadedFile(path)
+    return {
+        "FILE": upload.file,
+        "BIN_FILE": upload.bin_file,
+        "FILE_PATH": path,
+        "UPLOAD": upload,
+    }
+
+
+def max_rss():
+    """return the peak resident memory of the current process in MB"""
+    if resource is None:  # pragma: nocover
+        return None
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class ExecutionMonitor(object):
+    """
+    Measures wall time, cpu time & peak memory of a single procedure
+    execution, optionally recording a cProfile report.
+
+    When `rss` is set (in sandbox worker processes, see qa.sandbox) peak
+    memory is the growth of the process's peak RSS during the execution.
+    If CALCULATION_TRACE_MEMORY is set, the peak Python allocation during
+    the execution is traced with tracemalloc instead (slow, and allocations
+    by other threads of the process are included). Otherwise memory is not
+    recorded.
+    """
+
+    def __init__(self, profile=False, rss=False):
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = getattr(settings, "CALCULATION_TRACE_MEMORY", False) and not tracemalloc.is_tracing()
+        self.rss = rss and resource is not None
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        elif self.rss:
+            self.rss_start = max_rss()
+        self.wall_start = time.time()
+        self.cpu_start = cpu_time()
+        if self.profiler:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler:
+            self.profiler.disable()
+
+        self.stats = {
+            "wall": time.time() - self.wall_start,
+            "cpu": cpu_time() - self.cpu_start,
+            "memory": None,
+        }
+
+        if self.trace_memory:
+            self.stats["memory"] = tracemalloc.get_traced_memory()[1] / (1024. * 1024.)
+            tracemalloc.stop()
+        elif self.rss:
+            self.stats["memory"] = max_rss() - self.rss_start
+
+        return False
+
+    def profile_report(self, limit=40):
+        if not self.profiler or not hasattr(self, "stats"):
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+def execute_procedures(procedures, context, file_path=None, profile=(), measure_rss=False):
+    """
+    Execute an iterable of (slug, test id, procedure) triples in order
+    in the input context, yielding a :class:`CalculationResult` for each.
+
+    Successful results are stored in the context under the tests slug so
+    that later procedures may depend on them.  Procedures for test ids in
+    `profile` are run under cProfile. Set `measure_rss` to record the peak
+    RSS growth of each execution (see `ExecutionMonitor`).
+    """
+
+    for name, module in DEFAULT_CALCULATION_CONTEXT.items():
+        context.setdefault(name, module)
+
+    opened = file_context(file_path) if file_path else {}
+    context.update(opened)
+
+    try:
+        for slug, test_id, procedure in procedures:
+            files = []
+            figures = FigureFactory()
+            context["Figure"] = figures
+            context["write_file"] = get_file_writer(files, figures)
+            monitor = ExecutionMonitor(profile=test_id in profile, rss=measure_rss)
+            try:
+                code = compile_procedure(test_id, procedure)
+                with monitor:
+                    exec(code, context)
+                key = "result" if "result" in context else slug
+                result = CalculationResult(slug, value=context[key], files=files)
+                context[slug] = result.value
+            except MemoryError:
+                result = CalculationResult(slug, error="Calculation exceeded memory limit", fatal=True)
+            except Exception as e:
+                result = CalculationResult(slug, error=str(e))
+            finally:
+                # clean up calculation context for next test
+                context.pop("result", None)
+                figures.close()
+
+            result.test_id = test_id
+            result.stats = getattr(monitor, "stats", None)
+            result.profile = monitor.profile_report()
+
+            yield result
+    finally:
+        context.pop("write_file", None)
+        context.pop("Figure", None)
+        if "UPLOAD" in opened:
+            opened["UPLOAD"].close()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """return sha1 hash of the contents of the file at `path`"""
+
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def result_cache_key(test_id, procedure, file_path, context, file_digest=None):
+    """
+    Return a cache key for the result of running an upload procedure on a
+    file. The key depends on the file contents, the procedure and the
+    META/REFS/TOLS data available to the procedure.  `file_digest` may be
+    passed to avoid rehashing the file.
+    """
+
+    context_data = json.dumps(
+        dict((k, context.get(k)) for k in ("META", "REFS", "TOLS")),
+        sort_keys=True,
+        default=str,
+    )
+
+    h = hashlib.sha1()
+    file_digest = file_digest or file_hash(file_path)
+    for part in (str(test_id), procedure_hash(procedure), file_digest, context_data):
+        h.update(part.encode("UTF-8"))
+
+    return "upload-result-%s" % h.hexdigest()
+
+
+def get_result_cache():
+    return caches[settings.CALCULATION_RESULT_CACHE]
+
+
+def get_cached_result(key):
+    """return cached :class:`CalculationResult` for `key` or None"""
+    return get_result_cache().get(key)
+
+
+def cache_result(key, result):
+    """cache a successful :class:`CalculationResult`"""
+
+    if not result.success:
+        return
+
+    try:
+        get_result_cache().set(key, result)
+    except Exception:
+        # unpicklable result values are simply not cached
+        pass
@@ -0,0 +1,156 @@
+"""
+Maintenance of :model:`qa.TestCollectionClosure`, the materialized list of
+all tests (in performance order) contained in each :model:`qa.TestList`
+and :model:`qa.TestListCycle`, including tests from sublists and cycle
+members.
+
+The closure rows of a collection are rebuilt whenever its memberships,
+sublists or cycle members change (see qa.signals) so that "all tests in
+this collection in order" and "which collections contain this test" are
+single indexed queries rather than recursive walks of the collection tree.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+
+def list_rows(test_list, seen=None):
+    """
+    Return the (test list id, test id) pairs for `test_list` and its
+    sublists in the order the tests are performed.
+    """
+
+    from qatrack.qa import models
+
+    if seen is None:
+        seen = set()
+    seen.add(test_list.pk)
+
+    test_ids = models.TestListMembership.objects.filter(
+        test_list=test_list,
+    ).order_by("order").values_list("test_id", flat=True)
+
+    rows = [(test_list.pk, test_id) for test_id in test_ids]
+
+    for sublist in test_list.sublists.order_by("name"):
+        if sublist.pk not in seen:
+            rows.extend(list_rows(sublist, seen))
+
+    return rows
+
+
+def collection_rows(collection):
+    """Return the ordered (test list id, test id) pairs for a test list or cycle"""
+
+    from qatrack.qa import models
+
+    if isinstance(collection, models.TestListCycle):
+        memberships = collection.testlistcyclemembership_set.order_by("order").select_related("test_list")
+        test_lists = [m.test_list for m in memberships]
+    else:
+        test_lists = [collection]
+
+    rows = []
+    for test_list in test_lists:
+        rows.extend(list_rows(test_list))
+
+    return rows
+
+
+def for_collection(collection):
+    """return queryset of closure rows for `collection`"""
+
+    from qatrack.qa import models
+
+    return models.TestCollectionClosure.objects.filter(
+        content_type=ContentType.objects.get_for_model(collection),
+        object_id=collection.pk,
+    )
+
+
+@transaction.atomic
+def rebuild(collection):
+    """Recreate the closure rows for a single test list or cycle"""
+
+    from qatrack.qa import models
+
+    ct = ContentType.objects.get_for_model(collection)
+    for_collection(collection).delete()
+
+    models.TestCollectionClosure.objects.bulk_create([
+        models.TestCollectionClosure(
+            content_type=ct,
+            object_id=collection.pk,
+            test_list_id=test_list_id,
+            test_id=test_id,
+            order=order,
+        ) for order, (test_list_id, test_id) in enumerate(collection_rows(collection))
+    ])
+
+
+def affected_collections(test_list):
+    """
+    Return `test_list`, the lists that it is a sublist of and any cycles
+    containing either.
+    """
+
+    from qatrack.qa import models
+
+    test_lists = [test_list] + list(models.TestList.objects.filter(sublists=test_list))
+    cycles = models.TestListCycle.objects.filter(test_lists__in=test_lists).distinct()
+
+    return test_lists + list(cycles)
+
+
+def rebuild_for_list(test_list):
+    """Recreate closure rows for every collection which contains `test_list`"""
+    for collection in affected_collections(test_list):
+        rebuild(collection)
+
+
+def remove(collection):
+    """Delete the closure rows of a deleted test list or cycle"""
+    for_collection(collection).delete()
+
+
+def remove_membership(test_list_id, test_id):
+    """
+    Delete closure rows for a deleted :model:`qa.TestListMembership`.  Rows
+    are only deleted (leaving gaps in the order of the containing
+    collections) since this may be called while the test or test list itself
+    is being deleted.
+    """
+
+    from qatrack.qa import models
+
+    models.TestCollectionClosure.objects.filter(test_list_id=test_list_id, test_id=test_id).delete()
+
+
+def remove_cycle_membership(cycle_id, test_list_id):
+    """Delete closure rows for a deleted :model:`qa.TestListCycleMembership`"""
+
+    from qatrack.qa import models
+
+    models.TestCollectionClosure.objects.filter(
+        content_type=ContentType.objects.get_for_model(models.TestListCycle),
+        object_id=cycle_id,
+        test_list_id=test_list_id,
+    ).delete()
+
+    remaining = models.TestListCycleMembership.objects.filter(
+        cycle_id=cycle_id,
+        test_list_id=test_list_id,
+    ).select_related("cycle").first()
+
+    if remaining:
+        # list is included in the cycle more than once
+        rebuild(remaining.cycle)
+
+
+def rebuild_all():
+    """Recreate closure rows for every test list & cycle"""
+
+    from qatrack.qa import models
+
+    for collection in list(models.TestList.objects.all()) + list(models.TestListCycle.objects.all()):
+        rebuild(collection)
@@ -0,0 +1,100 @@
+"""
+Cache of the test history tables shown when performing, editing and
+reviewing test lists (see `UnitTestCollection.history` and
+`TestListInstance.history`).
+
+Snapshots are stored per :model:`qa.UnitTestCollection`, history cutoff
+and depth.  Rather than tracking every cached key, each unit test
+collection has a version number which is included in its keys and bumped
+(see qa.signals) whenever one of its test list instances is saved or
+deleted.  Test instance saves don't bump the version (a test list instance
+may have many test instances) so code changing test instances on their own
+must call `invalidate` once for the collection.  A global version is bumped for changes that may affect any
+history table (e.g. editing a status or tolerance, or bulk re-grading).
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GLOBAL_VERSION_KEY = "qa-history-version"
+
+
+def get_cache():
+    return caches[settings.HISTORY_CACHE]
+
+
+def version_key(utc_id):
+    return "qa-history-version-%s" % utc_id
+
+
+def new_version():
+    """
+    Initial version for a missing (e.g. culled) version key.  Based on the
+    current time so that it is newer than any version the key had before
+    and snapshots cached under the old version are never reused.
+    """
+    return int(time.time() * 1000)
+
+
+def get_versions(utc_id):
+    cache = get_cache()
+    keys = [GLOBAL_VERSION_KEY, version_key(utc_id)]
+    versions = cache.get_many(keys)
+
+    missing = dict((k, new_version()) for k in keys if k not in versions)
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    return versions[GLOBAL_VERSION_KEY], versions[version_key(utc_id)]
+
+
+def get_lookup(utc_id, cutoff, number, load):
+    """
+    Return the cached history snapshot for unit test collection `utc_id`
+    (test list instances completed before `cutoff`, `number` deep),
+    calling `load` to create it if it is not cached.  `cutoff` is either a
+    datetime or a string describing the cutoff (e.g. "now").
+    """
+
+    cache = get_cache()
+    global_version, utc_version = get_versions(utc_id)
+    cutoff = cutoff.isoformat() if hasattr(cutoff, "isoformat") else cutoff
+    key = "qa-history-%s-%s-%s-%s-%s" % (utc_id, cutoff, number, utc_version, global_version)
+
+    data = cache.get(key)
+    if data is None:
+        data = load()
+        cache.set(key, data)
+
+    return data
+
+
+def bump(key, cache=None):
+    """increment the version stored at `key` (in the history cache by default)"""
+    if cache is None:
+        cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), None)
+
+
+def invalidate(utc_id):
+    """
+    Invalidate the cached history of unit test collection `utc_id`. The
+    version is also bumped when the current transaction commits so that
+    snapshots created from uncommitted data are discarded.
+    """
+    key = version_key(utc_id)
+    bump(key)
+    transaction.on_commit(lambda: bump(key))
+
+
+def invalidate_all():
+    """invalidate the cached history of all unit test collections"""
+    bump(GLOBAL_VERSION_KEY)
+    transaction.on_commit(lambda: bump(GLOBAL_VERSION_KEY))
@@ -0,0 +1,441 @@
+"""
+Bulk creation of :model:`qa.TestListInstance`s (and their
+:model:`qa.TestInstance`s) from JSON data submitted by automated QA devices
+(see api.BulkTestListInstanceResource).
+
+Each submitted instance looks like::
+
+    {
+        "unit_test_collection": 1,
+        "day": 0,  # optional, for cycles (defaults to the next day)
+        "work_started": "2017-01-01T10:00:00",
+        "work_completed": "2017-01-01T10:30:00",  # optional (defaults to now)
+        "comment": "",  # optional
+        "in_progress": false,  # optional
+        "status": "unreviewed",  # optional status slug
+        "tests": {
+            "test_slug": 1.0,
+            "other_test": {"value": 2.0, "comment": "..."},
+            "string_test": {"string_value": "abc"},
+            "skipped_test": {"skipped": true, "comment": "..."},
+        },
+    }
+
+All instances are validated against the :model:`qa.UnitTestInfo`s of their
+unit test collections before anything is written. If any of them is invalid
+nothing is created, otherwise all instances are graded in bulk and created
+in a single transaction.
+
+Composite tests are calculated server side from the submitted values (as
+they are when performing a test list in the browser) and may not be
+submitted. Composites whose calculation fails are skipped.
+"""
+
+import functools
+
+from django.db import transaction
+from django.utils import dateparse, timezone
+
+from qatrack.qa import history, models, passfail, payload, recalculate, refdata, signals
+
+
+class Submission(object):
+    """A validated (but unsaved) test list instance and its test instances"""
+
+    def __init__(self, test_list_instance, test_instances, status, user_set_status):
+        self.test_list_instance = test_list_instance
+        self.test_instances = test_instances
+        self.status = status
+        self.user_set_status = user_set_status
+
+    def valid(self):
+        """return True if all test instances have valid statuses"""
+        return all(ti.status.valid for ti in self.test_instances)
+
+
+def parse_datetime(value):
+    """return an aware datetime for an ISO formatted string (raises ValueError if invalid)"""
+
+    dt = dateparse.parse_datetime(value) if isinstance(value, str) else None
+    if dt is None:
+        raise ValueError("Invalid date/time '%s'. Please use ISO 8601 format" % (value,))
+
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone.get_current_timezone())
+
+    return dt
+
+
+def parse_status(slug, data):
+    """return the :model:`qa.TestInstanceStatus` with slug `slug` (or the default status)"""
+
+    if slug is None:
+        return data.default_status(), False
+
+    for status in data.statuses().values():
+        if status.slug == slug:
+            return status, True
+
+    raise ValueError("Unknown status '%s'" % slug)
+
+
+def parse_value(test, value):
+    """return (value, string_value) for `value` submitted for `test`"""
+
+    if value is None:
+        return None, ""
+
+    if test.is_upload():
+        raise ValueError("Upload tests can not be submitted in bulk")
+
+    if test.is_string_type():
+        value = str(value)
+        choices = test.get_choices()
+        if choices and value not in [c for c, __ in choices]:
+            raise ValueError("'%s' is not one of the available choices" % value)
+        return None, value
+
+    if isinstance(value, bool):
+        return float(value), ""
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("'%s' is not a number" % (value,))
+
+    if test.is_boolean() and value not in (0., 1.):
+        raise ValueError("Boolean values must be 0 or 1")
+
+    return value, ""
+
+
+def parse_test(uti, data, user, in_progress):
+    """
+    Return the value, string value, skipped & comment of a single test from
+    the submitted `data` (a value or dict), mirroring the validation done
+    when a test list is performed in the browser.
+    """
+
+    test = uti.test
+
+    if not isinstance(data, dict):
+        data = {"string_value" if test.is_string_type() else "value": data}
+
+    comment = str(data.get("comment") or "")
+
+    if test.type in recalculate.COMPOSITE_TYPES:
+        if data.get("value") is not None or data.get("string_value") is not None:
+            raise ValueError("Composite values are calculated and can not be submitted")
+        # value & skipped are set once calculated (see `calculate`)
+        return None, "", False, comment
+
+    skipped = bool(data.get("skipped", False))
+    raw = data.get("string_value", data.get("value")) if test.is_string_type() else data.get("value")
+    if raw is None and test.type == models.CONSTANT:
+        raw = test.constant_value
+
+    value, string_value = parse_value(test, raw)
+    has_value = value is not None or bool(string_value)
+
+    if not in_progress:
+        if not test.skip_required():
+            skipped = not has_value
+        elif not has_value and not skipped:
+            raise ValueError("Value required if not skipping")
+        elif has_value and skipped:
+            raise ValueError("Clear value if skipping")
+        elif skipped and not comment:
+            no_comment_required = user.has_perm("qa.can_skip_without_comment") or test.skip_without_comment
+            if not no_comment_required:
+                raise ValueError("Please add comment when skipping")
+
+    return value, string_value, skipped, comment
+
+
+def validate(data, utc, user, ref_data):
+    """
+    Validate a single submitted test list instance. Returns a `Submission`
+    and a dict of errors (keyed by field or test slug).
+    """
+
+    errors = {}
+
+    if not isinstance(data, dict):
+        return None, {"__all__": ["Test list instances must be JSON objects"]}
+
+    if utc is None:
+        return None, {"unit_test_collection": ["Unknown unit test collection '%s'" % data.get("unit_test_collection")]}
+
+    day = data.get("day")
+    try:
+        day = None if day is None else int(day)
+    except (TypeError, ValueError):
+        return None, {"day": ["Invalid day '%s'" % day]}
+
+    perform = payload.get_payload(utc, day)
+    if perform is None:
+        return None, {"day": ["No test list to perform for day '%s'" % day]}
+
+    now = timezone.now()
+    work_started, work_completed = None, now
+    try:
+        work_started = parse_datetime(data.get("work_started"))
+    except ValueError as e:
+        errors["work_started"] = ["This field is required" if data.get("work_started") is None else str(e)]
+
+    if data.get("work_completed") is not None:
+        try:
+            work_completed = parse_datetime(data["work_completed"])
+        except ValueError as e:
+            errors["work_completed"] = [str(e)]
+
+    if "work_started" not in errors:
+        if work_started >= now:
+            errors["work_started"] = ["Work started date/time can not be in the future"]
+        elif "work_completed" not in errors and work_completed < work_started:
+            errors["work_started"] = ["Work started date/time can not be after work completed date/time"]
+
+    try:
+        status, user_set_status = parse_status(data.get("status"), ref_data)
+    except ValueError as e:
+        errors["status"] = [str(e)]
+        status, user_set_status = None, False
+    else:
+        if status is None:
+            errors["status"] = ["No default test instance status has been configured"]
+
+    in_progress = bool(data.get("in_progress", False))
+    comment = data.get("comment") or ""
+
+    tli = models.TestListInstance(
+        test_list=perform["test_list"],
+        unit_test_collection=utc,
+        work_started=work_started,
+        work_completed=work_completed,
+        comment=comment,
+        in_progress=in_progress,
+        day=perform["actual_day"],
+        created_by=user,
+        modified_by=user,
+        modified=now,
+    )
+
+    tests = data.get("tests") or {}
+    if not isinstance(tests, dict):
+        errors["tests"] = ["Tests must be an object mapping test slugs to values"]
+        tests = {}
+
+    utis = dict((uti.test.slug, uti) for uti in perform["unit_test_infos"])
+    unknown = sorted(set(tests) - set(utis))
+    if unknown:
+        errors["tests"] = ["Unknown tests for this test list: %s" % ", ".join(unknown)]
+
+    test_instances = []
+    for slug, uti in utis.items():
+        try:
+            value, string_value, skipped, ti_comment = parse_test(uti, tests.get(slug), user, in_progress)
+        except ValueError as e:
+            errors[slug] = [str(e)]
+            continue
+
+        test_instances.append(models.TestInstance(
+            value=value,
+            string_value=string_value,
+            skipped=skipped,
+            comment=ti_comment,
+            unit_test_info=uti,
+            reference=uti.reference,
+            tolerance=uti.tolerance,
+            status=status,
+            created_by=user,
+            modified_by=user,
+            test_list_instance=tli,
+            work_started=work_started,
+            work_completed=work_completed,
+        ))
+
+    if errors:
+        return None, errors
+
+    # keep test instances in performance order
+    order = dict((uti.pk, idx) for idx, uti in enumerate(perform["unit_test_infos"]))
+    test_instances.sort(key=lambda ti: order[ti.unit_test_info.pk])
+
+    return Submission(tli, test_instances, status, user_set_status), {}
+
+
+def get_unit_test_collections(objects, user):
+    """return dict of the active unit test collections referenced by `objects` that are visible to `user`"""
+
+    pks = set()
+    for data in objects:
+        try:
+            pks.add(int(data["unit_test_collection"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    utcs = models.UnitTestCollection.objects.filter(
+        pk__in=pks,
+        active=True,
+        visible_to__in=user.groups.all(),
+    ).select_related(
+        "unit", "frequency", "last_instance", "last_valid_instance"
+    ).distinct()
+
+    return dict((utc.pk, utc) for utc in utcs)
+
+
+def calculate(submissions):
+    """calculate the composite tests of all submissions from their submitted values"""
+
+    for sub in submissions:
+        tli = sub.test_list_instance
+        composites = [ti for ti in sub.test_instances if ti.unit_test_info.test.type in recalculate.COMPOSITE_TYPES]
+        if not composites:
+            continue
+
+        recalculate.calculate_composites(tli, sub.test_instances)
+
+        for ti in composites:
+            # as when performing in the browser, composites that couldn't be
+            # calculated are skipped
+            has_value = ti.value is not None or bool(ti.string_value)
+            ti.skipped = not has_value and not tli.in_progress
+
+
+def grade(submissions):
+    """
+    Calculate pass/fail, differences & review status of all submitted test
+    instances. Returns a list with a dict of errors (keyed by test slug) for
+    each submission.
+    """
+
+    test_instances = [ti for sub in submissions for ti in sub.test_instances]
+    sub_idx = dict((id(ti), idx) for idx, sub in enumerate(submissions) for ti in sub.test_instances)
+
+    errors = [{} for sub in submissions]
+    for ti, e in passfail.calculate_pass_fail(test_instances):
+        msg = "Unable to calculate pass/fail: %s" % (e or e.__class__.__name__)
+        errors[sub_idx[id(ti)]][ti.unit_test_info.test.slug] = [msg]
+
+    for ti in test_instances:
+        ti.set_differences()
+
+    for sub in submissions:
+        if not sub.user_set_status:
+            for ti in sub.test_instances:
+                ti.auto_review()
+
+        tli = sub.test_list_instance
+        tli.reviewed = None if sub.status.requires_review else tli.modified
+        tli.reviewed_by = None if sub.status.requires_review else tli.created_by
+        tli.all_reviewed = not any(ti.status.requires_review for ti in sub.test_instances)
+
+    return errors
+
+
+def create(submissions):
+    """
+    Save all submissions & their test instances and update the last instance
+    & due dates of the unit test collections they were performed on.
+    """
+
+    # last instances & due dates are updated once per unit test collection below
+    with signals.last_instance_updates_deferred():
+        for sub in submissions:
+            sub.test_list_instance.save()
+
+    test_instances = []
+    for sub in submissions:
+        tli = sub.test_list_instance
+        for delta, ti in enumerate(sub.test_instances):
+            # reassign now that test list instance has a pk
+            ti.test_list_instance = tli
+            ti.created = tli.created + timezone.timedelta(milliseconds=delta)
+        test_instances.extend(sub.test_instances)
+
+    models.TestInstance.objects.bulk_create(test_instances, batch_size=500)
+
+    def newer(sub, current):
+        return current is None or current.test_list_instance.work_completed <= sub.test_list_instance.work_completed
+
+    # the newest submission for each collection sets its last instance, but
+    # the newest valid, complete submission may be an earlier one
+    latest = {}
+    latest_valid = {}
+    for sub in submissions:
+        tli = sub.test_list_instance
+        utc_id = tli.unit_test_collection_id
+        if newer(sub, latest.get(utc_id)):
+            latest[utc_id] = sub
+        if not tli.in_progress and sub.valid() and newer(sub, latest_valid.get(utc_id)):
+            latest_valid[utc_id] = sub
+
+    to_update = set(latest.values()) | set(latest_valid.values())
+    for sub in sorted(to_update, key=lambda s: s.test_list_instance.work_completed):
+        signals.update_last_instances(sub.test_list_instance, created=True, valid=sub.valid())
+
+    for utc_id in latest:
+        history.invalidate(utc_id)
+
+
+def notify(test_list_instances, sender=None):
+    """fire the testlist_complete signal for all completed test list instances"""
+    for tli in test_list_instances:
+        if not tli.in_progress:
+            signals.testlist_complete.send(sender=sender, instance=tli, created=False)
+
+
+@refdata.scoped
+def ingest(objects, user, sender=None):
+    """
+    Validate & create the test list instances described by `objects` (a
+    list of dicts, see module docstring) for `user`. Returns a dict with
+    an overall `success` flag and a list of per instance results.
+    """
+
+    if not isinstance(objects, list):
+        return {
+            "success": False,
+            "objects": [],
+            "errors": {"objects": ["A list of test list instances is required"]},
+        }
+
+    utcs = get_unit_test_collections([o for o in objects if isinstance(o, dict)], user)
+    ref_data = refdata.current()
+
+    submissions = []
+    results = []
+    for idx, data in enumerate(objects):
+        utc = None
+        if isinstance(data, dict):
+            try:
+                utc = utcs.get(int(data.get("unit_test_collection")))
+            except (TypeError, ValueError):
+                pass
+
+        submission, errors = validate(data, utc, user, ref_data)
+        submissions.append(submission)
+        results.append({"index": idx, "success": not errors, "id": None, "errors": errors})
+
+    success = all(r["success"] for r in results)
+
+    if success and submissions:
+        calculate(submissions)
+
+        for result, errors in zip(results, grade(submissions)):
+            if errors:
+                result.update(success=False, errors=errors)
+
+        success = all(r["success"] for r in results)
+
+    if success and submissions:
+        with transaction.atomic():
+            create(submissions)
+            tlis = [sub.test_list_instance for sub in submissions]
+            transaction.on_commit(functools.partial(notify, tlis, sender=sender))
+
+        for sub, result in zip(submissions, results):
+            result["id"] = sub.test_list_instance.pk
+
+    return {"success": success, "objects": results}
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from qatrack.qa import scheduling
 from qatrack.qa.models import UnitTestCollection
 
 
@@ -9,6 +10,12 @@ class Command(BaseCommand):
 
     help = 'commands to enable/disable auto scheduling and set due dates'
 
+    def add_arguments(self, parser):
+        parser.add_argument("args", metavar="action", nargs="*")
+        parser.add_argument("--unit", dest="units", type=int, action="append", help="Unit number to schedule (may be repeated)")
+        parser.add_argument("--frequency", dest="frequencies", action="append", help="Frequency slug to schedule (may be repeated)")
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=500)
+
     def handle(self, *args, **kwargs):
         handlers = {
             "enable-all": self.enable_all,
@@ -21,6 +28,7 @@ class Command(BaseCommand):
             valid = ', '.join(["'%s'" % x for x in list(handlers.keys())])
             raise CommandError("Valid arguments are %s" % (valid))
 
+        self.options = kwargs
         handlers[args[0]]()
 
     def enable_all(self):
@@ -34,12 +42,11 @@ class Command(BaseCommand):
         self.stdout.write("Successfully disabled auto scheduling for all test lists")
 
     def schedule_all(self):
-        """Sets due date for all UnitTestCollections with assigned frequencies"""
-        utcs = UnitTestCollection.objects.exclude(frequency=None)
-        for utc in utcs:
-            utc.set_due_date()
+        """Sets due date for all auto scheduled UnitTestCollections with assigned frequencies"""
+        utcs = scheduling.schedulable(units=self.options["units"], frequencies=self.options["frequencies"])
+        stats = scheduling.schedule(utcs, batch_size=self.options["batch_size"])
 
-        self.stdout.write("Successfully set all due dates")
+        self.stdout.write("Successfully set all due dates: %s" % stats)
 
     def unschedule_all(self):
         """Sets due_date=None on all UnitTestCollections"""
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from qatrack.qa import history, utils
+from qatrack.qa.models import TestInstance
+
+
+class Command(BaseCommand):
+    """A management command to populate the denormalized diff & percent_diff
+    columns of test instances created before they were added.
+    """
+
+    help = 'set difference & percent difference from reference for existing test instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", dest="all", action="store_true", default=False,
+            help="Recalculate all test instances rather than only those without differences set",
+        )
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=500)
+
+    def handle(self, *args, **options):
+
+        if options["all"]:
+            no_diff = Q(skipped=True) | Q(reference=None) | Q(value=None)
+            TestInstance.objects.filter(no_diff).exclude(diff=None, percent_diff=None).update(diff=None, percent_diff=None)
+
+        tis = TestInstance.objects.filter(skipped=False, reference__isnull=False, value__isnull=False)
+        if not options["all"]:
+            tis = tis.filter(diff=None)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                tis.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "value", "reference__value")[:options["batch_size"]]
+            )
+            if not batch:
+                break
+
+            to_update = []
+            for pk, value, reference in batch:
+                diff, percent_diff = utils.differences(value, reference)
+                to_update.append(TestInstance(pk=pk, diff=diff, percent_diff=percent_diff))
+
+            with transaction.atomic():
+                updated += utils.bulk_update(to_update, ["diff", "percent_diff"])
+
+            last_pk = batch[-1][0]
+
+        history.invalidate_all()
+
+        self.stdout.write("Set differences for %d test instances" % updated)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from qatrack.qa import closure, payload
+from qatrack.qa.models import TestCollectionClosure
+
+
+class Command(BaseCommand):
+    """A management command to recreate the materialized list of tests
+    contained in every test list & test list cycle (e.g. after memberships
+    have been modified directly in the database).
+    """
+
+    help = 'rebuild the list of tests contained in each test list and cycle'
+
+    def handle(self, *args, **options):
+        closure.rebuild_all()
+        payload.invalidate()
+        self.stdout.write("Rebuilt %d test collection entries" % TestCollectionClosure.objects.count())
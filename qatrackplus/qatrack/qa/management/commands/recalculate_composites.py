@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.qa import recalculate, utils
+from qatrack.qa.models import Test, TestListInstance
+
+
+class Command(BaseCommand):
+    """A management command to recalculate composite test results of
+    previously performed test lists (e.g. after a calculation procedure
+    has been corrected).
+    """
+
+    help = 'recalculate composite test values & pass/fail states for existing test list instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--test-list", dest="test_lists", type=int, action="append", help="TestList id (may be repeated)")
+        parser.add_argument("--unit", dest="units", type=int, action="append", help="Unit number (may be repeated)")
+        parser.add_argument("--test", dest="tests", action="append", help="Only recalculate composites depending on this test slug (may be repeated)")
+        parser.add_argument("--from", dest="date_from", help="Only test lists completed on or after this date")
+        parser.add_argument("--to", dest="date_to", help="Only test lists completed on or before this date")
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=200)
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", default=False, help="Calculate but don't save changes")
+
+    def handle(self, *args, **options):
+
+        tlis = TestListInstance.objects.filter(in_progress=False)
+
+        if options["test_lists"]:
+            tlis = tlis.filter(test_list_id__in=options["test_lists"])
+
+        if options["units"]:
+            tlis = tlis.filter(unit_test_collection__unit__number__in=options["units"])
+
+        try:
+            date_from = utils.parse_date(options["date_from"])
+            date_to = utils.parse_date(options["date_to"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if date_from:
+            tlis = tlis.filter(work_completed__gte=date_from)
+
+        if date_to:
+            tlis = tlis.filter(work_completed__lte=date_to)
+
+        tests = None
+        if options["tests"]:
+            tests = list(Test.objects.filter(slug__in=options["tests"]).values_list("pk", flat=True))
+            if not tests:
+                raise CommandError("No tests found with slugs %s" % ", ".join(options["tests"]))
+            tlis = tlis.filter(testinstance__unit_test_info__test_id__in=tests).distinct()
+
+        stats = recalculate.recalculate(tlis, tests=tests, batch_size=options["batch_size"], dry_run=options["dry_run"])
+
+        for tli_id, slug, error in stats.errors:
+            self.stderr.write("TestListInstance %s: %s: %s" % (tli_id, slug, error))
+
+        prefix = "Dry run: " if options["dry_run"] else ""
+        self.stdout.write("%s%s" % (prefix, stats))
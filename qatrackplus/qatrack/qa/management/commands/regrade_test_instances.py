@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.qa import regrade, utils
+
+
+class Command(BaseCommand):
+    """A management command to re-evaluate the pass/fail state of existing
+    test instances (e.g. after a tolerance has been edited).
+    """
+
+    help = 're-calculate pass/fail states of existing test instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tolerance", dest="tolerances", type=int, action="append", help="Tolerance id (may be repeated)")
+        parser.add_argument("--reference", dest="references", type=int, action="append", help="Reference id (may be repeated)")
+        parser.add_argument("--unit", dest="units", type=int, action="append", help="Unit number (may be repeated)")
+        parser.add_argument("--test", dest="tests", action="append", help="Test slug (may be repeated)")
+        parser.add_argument("--from", dest="date_from", help="Only test instances completed on or after this date")
+        parser.add_argument("--to", dest="date_to", help="Only test instances completed on or before this date")
+        parser.add_argument(
+            "--current", dest="use_current", action="store_true", default=False,
+            help=(
+                "Grade against the current reference & tolerance of each test's unit assignment and replace "
+                "the historical reference & tolerance of every selected test instance (requires --from)"
+            ),
+        )
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=500)
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", default=False, help="Calculate but don't save changes")
+
+    def handle(self, *args, **options):
+
+        criteria = ("tolerances", "references", "units", "tests", "date_from", "date_to")
+        if not any(options[c] for c in criteria):
+            raise CommandError("At least one of --tolerance, --reference, --unit, --test, --from or --to is required")
+
+        if options["use_current"] and not options["date_from"]:
+            raise CommandError("--from is required with --current since historical references & tolerances are replaced")
+
+        try:
+            date_from = utils.parse_date(options["date_from"])
+            date_to = utils.parse_date(options["date_to"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        tis = regrade.affected_instances(
+            tolerances=options["tolerances"],
+            references=options["references"],
+            units=options["units"],
+            tests=options["tests"],
+            date_from=date_from,
+            date_to=date_to,
+        )
+
+        stats = regrade.regrade(
+            tis, use_current=options["use_current"], batch_size=options["batch_size"], dry_run=options["dry_run"],
+        )
+
+        for ti_id, error in stats.errors:
+            self.stderr.write("TestInstance %s: %s" % (ti_id, error))
+
+        for old, new, count in stats.summary():
+            self.stdout.write("%s -> %s: %d" % (old, new, count))
+
+        prefix = "Dry run: " if options["dry_run"] else ""
+        self.stdout.write("%s%s" % (prefix, stats))
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from qatrack.qa import uploads
+
+
+class Command(BaseCommand):
+    """A management command which processes queued upload test calculations
+    (used when settings.UPLOAD_ASYNC = True).
+    """
+
+    help = 'process queued upload test calculations'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", dest="once", action="store_true", default=False, help="Process all pending jobs then exit")
+        parser.add_argument("--sleep", dest="sleep", type=float, default=0.5, help="Seconds to wait between checks for new jobs")
+        parser.add_argument(
+            "--requeue", dest="requeue", action="store_true", default=False,
+            help="Return jobs left running by a previous runner to the queue before starting",
+        )
+
+    def handle(self, *args, **options):
+
+        if options["requeue"]:
+            n = uploads.requeue_running()
+            self.stdout.write("Requeued %d jobs" % n)
+
+        while True:
+            job = uploads.claim_job()
+            if job is not None:
+                uploads.run_job(job)
+                self.stdout.write("Processed %s" % job)
+                continue
+
+            uploads.purge_jobs(settings.UPLOAD_JOB_MAX_AGE)
+
+            if options["once"]:
+                return
+
+            time.sleep(options["sleep"])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ast
+import io
+import tokenize
+
+from django.db import migrations, models
+
+
+# Frozen copy of qatrack.qa.utils.calculation_dependencies as it was when
+# this migration was written, so that later changes to it don't change
+# what this migration does.
+def calculation_dependencies(calc_procedure):
+
+    if not calc_procedure:
+        return []
+
+    try:
+        tree = ast.parse(calc_procedure.replace("\r\n", "\n"))
+    except (SyntaxError, ValueError, TypeError):
+        try:
+            tokens = tokenize.generate_tokens(io.StringIO(calc_procedure).readline)
+            return sorted(set(t[1] for t in tokens if t[1] and t[1].isidentifier()))
+        except tokenize.TokenError:
+            return []
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+
+    return sorted(names)
+
+
+def set_calculation_dependencies(apps, schema_editor):
+
+    Test = apps.get_model("qa", "Test")
+    tests = Test.objects.exclude(calculation_procedure=None).exclude(calculation_procedure="")
+    for test in tests.only("pk", "calculation_procedure"):
+        deps = " ".join(calculation_dependencies(test.calculation_procedure))
+        Test.objects.filter(pk=test.pk).update(calculation_dependencies=deps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0002_auto_20161218_1851'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='calculation_dependencies',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(set_calculation_dependencies, migrations.RunPython.noop),
+    ]
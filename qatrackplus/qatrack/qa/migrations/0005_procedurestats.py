@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0004_uploadjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcedureStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('samples', models.TextField(default='[]', editable=False)),
+                ('executions', models.PositiveIntegerField(default=0, editable=False)),
+                ('errors', models.PositiveIntegerField(default=0, editable=False)),
+                ('wall_p50', models.FloatField(editable=False, null=True, verbose_name='Median time (s)')),
+                ('wall_p95', models.FloatField(db_index=True, editable=False, null=True, verbose_name='95th percentile time (s)')),
+                ('wall_max', models.FloatField(editable=False, null=True, verbose_name='Max time (s)')),
+                ('cpu_p50', models.FloatField(editable=False, null=True, verbose_name='Median CPU time (s)')),
+                ('cpu_p95', models.FloatField(editable=False, null=True, verbose_name='95th percentile CPU time (s)')),
+                ('memory_p95', models.FloatField(editable=False, null=True, verbose_name='95th percentile peak memory (MB)')),
+                ('last_executed', models.DateTimeField(editable=False, null=True)),
+                ('profile', models.BooleanField(default=False, help_text="Run this test's calculation procedure under cProfile and store the report below", verbose_name='Profile')),
+                ('profile_report', models.TextField(blank=True, default='', editable=False)),
+                ('profile_date', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('test', models.OneToOneField(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='procedure_stats', to='qa.Test')),
+            ],
+            options={
+                'verbose_name': 'procedure timing',
+                'verbose_name_plural': 'slowest procedures',
+                'ordering': ('-wall_p95',),
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# diff & percent_diff of existing test instances are populated by the
+# backfill_differences management command rather than here since that can
+# take a long time on large databases.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0005_procedurestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testinstance',
+            name='diff',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='testinstance',
+            name='percent_diff',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def list_rows(TestListMembership, test_list, seen):
+    seen.add(test_list.pk)
+    test_ids = TestListMembership.objects.filter(test_list=test_list).order_by("order").values_list("test_id", flat=True)
+    rows = [(test_list.pk, test_id) for test_id in test_ids]
+    for sublist in test_list.sublists.order_by("name"):
+        if sublist.pk not in seen:
+            rows.extend(list_rows(TestListMembership, sublist, seen))
+    return rows
+
+
+def populate_closure(apps, schema_editor):
+
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    TestList = apps.get_model("qa", "TestList")
+    TestListCycle = apps.get_model("qa", "TestListCycle")
+    TestListCycleMembership = apps.get_model("qa", "TestListCycleMembership")
+    TestListMembership = apps.get_model("qa", "TestListMembership")
+    TestCollectionClosure = apps.get_model("qa", "TestCollectionClosure")
+
+    tlct, __ = ContentType.objects.get_or_create(app_label="qa", model="testlist")
+    tlcct, __ = ContentType.objects.get_or_create(app_label="qa", model="testlistcycle")
+
+    closures = []
+
+    for test_list in TestList.objects.all():
+        rows = list_rows(TestListMembership, test_list, set())
+        closures.extend(
+            TestCollectionClosure(content_type=tlct, object_id=test_list.pk, test_list_id=tl_id, test_id=t_id, order=order)
+            for order, (tl_id, t_id) in enumerate(rows)
+        )
+
+    for cycle in TestListCycle.objects.all():
+        rows = []
+        memberships = TestListCycleMembership.objects.filter(cycle=cycle).order_by("order").select_related("test_list")
+        for membership in memberships:
+            rows.extend(list_rows(TestListMembership, membership.test_list, set()))
+        closures.extend(
+            TestCollectionClosure(content_type=tlcct, object_id=cycle.pk, test_list_id=tl_id, test_id=t_id, order=order)
+            for order, (tl_id, t_id) in enumerate(rows)
+        )
+
+    TestCollectionClosure.objects.bulk_create(closures, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('qa', '0006_testinstance_diff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestCollectionClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('order', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='qa.Test')),
+                ('test_list', models.ForeignKey(help_text='Test list the test is a direct member of', on_delete=django.db.models.deletion.CASCADE, to='qa.TestList')),
+            ],
+            options={
+                'ordering': ('order',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='testcollectionclosure',
+            index_together=set([('content_type', 'object_id', 'order')]),
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
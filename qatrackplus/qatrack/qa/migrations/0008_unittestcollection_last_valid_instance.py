@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_last_valid_instances(apps, schema_editor):
+
+    UnitTestCollection = apps.get_model("qa", "UnitTestCollection")
+    TestListInstance = apps.get_model("qa", "TestListInstance")
+
+    for utc in UnitTestCollection.objects.all():
+        last_valid = TestListInstance.objects.filter(
+            unit_test_collection=utc,
+            in_progress=False,
+        ).exclude(
+            testinstance__status__valid=False,
+        ).order_by("-work_completed").first()
+
+        if last_valid is not None:
+            UnitTestCollection.objects.filter(pk=utc.pk).update(last_valid_instance=last_valid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0007_testcollectionclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unittestcollection',
+            name='last_valid_instance',
+            field=models.ForeignKey(editable=False, help_text='Last completed test list instance with no invalid test instances (used for scheduling)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='qa.TestListInstance'),
+        ),
+        migrations.RunPython(set_last_valid_instances, migrations.RunPython.noop),
+    ]
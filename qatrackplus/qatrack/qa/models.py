@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.db import models
-from django.db.models import Q, Count
+from django.db.models import Case, CharField, Count, Q, Value, When
 from django.contrib.auth.models import User, Group
 from django.utils.translation import ugettext as _
 from django.core import urlresolvers
@@ -10,7 +10,8 @@ from django.contrib.contenttypes.fields import GenericRelation, GenericForeignKe
 from django.utils import timezone
 
 from qatrack.units.models import Unit
-from qatrack.qa import utils
+from qatrack.qa import history as history_cache
+from qatrack.qa import closure, payload, refdata, utils
 
 import re
 
@@ -97,6 +98,13 @@ DUE = TOLERANCE
 OVERDUE = ACTION
 NEWLIST = NOT_DONE
 
+DUE_STATUS_CHOICES = (
+    (NOT_DUE, _("Not Due")),
+    (DUE, _("Due")),
+    (OVERDUE, _("Overdue")),
+    (NO_DUE_DATE, _("No Due Date")),
+)
+
 EPSILON = 1E-10
 
 #  A collection of the permissions most relevant to QATrack+
@@ -177,6 +185,11 @@ class StatusManager(models.Manager):
 
     def default(self):
         """return the default TestInstanceStatus"""
+
+        data = refdata.current()
+        if data is not None:
+            return data.default_status()
+
         try:
             return self.get_queryset().get(is_default=True)
         except TestInstanceStatus.DoesNotExist:
@@ -458,6 +471,9 @@ class Test(models.Model):
         "For Composite Tests Only: Enter a Python snippet for evaluation of this test."
     ))
 
+    # space separated names read by calculation_procedure. Set on save
+    calculation_dependencies = models.TextField(editable=False, blank=True, default="")
+
     # for keeping a very basic history
     created = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, editable=False, related_name="test_creator")
@@ -577,6 +593,14 @@ class Test(models.Model):
         self.clean_slug()
         self.clean_choices()
 
+    def save(self, *args, **kwargs):
+        self.calculation_dependencies = " ".join(utils.calculation_dependencies(self.calculation_procedure))
+        super(Test, self).save(*args, **kwargs)
+
+    def get_dependencies(self):
+        """return set of names read by this tests calculation procedure"""
+        return set(self.calculation_dependencies.split())
+
     def get_choices(self):
         """return choices for multiple choice tests"""
         if self.type == MULTIPLE_CHOICE:
@@ -615,16 +639,18 @@ def get_utc_tlc_ids(active=None, units=None, frequencies=None):
 
 
 def get_utc_tl_ids(active=None, units=None, frequencies=None):
+    """
+    Return ids of :model:`qa.TestList`s which are assigned to a unit either
+    directly or as a member of a :model:`qa.TestListCycle`
+    """
 
-    tlct = ContentType.objects.get_for_model(TestList)
-
-    tls = UnitTestCollection.objects.filter(content_type=tlct)
+    utcs = UnitTestCollection.objects.all()
 
     if active is not None:
-        tls = tls.filter(active=active)
+        utcs = utcs.filter(active=active)
 
     if units is not None:
-        tls = tls.filter(unit__in=units)
+        utcs = utcs.filter(unit__in=units)
 
     if frequencies is not None:
         if None in frequencies:
@@ -634,22 +660,17 @@ def get_utc_tl_ids(active=None, units=None, frequencies=None):
                 q |= Q(frequency__in=frequencies)
         else:
             q = Q(frequency__in=frequencies)
-        tls = tls.filter(q)
+        utcs = utcs.filter(q)
 
-    tls = tls.values(
-        'object_id'
-    ).annotate(
-        Count('object_id')
-    ).filter(
-        object_id__count__gt=0
-    ).values_list("object_id", flat=True)
+    tlct = ContentType.objects.get_for_model(TestList)
+    tlcct = ContentType.objects.get_for_model(TestListCycle)
 
-    tlcs = get_utc_tlc_ids(active=active, units=units, frequencies=frequencies)
-    tls_from_tlcs = TestListCycleMembership.objects.filter(
-        cycle_id__in=tlcs
-    ).values_list("test_list_id", flat=True)
+    tl_ids = utcs.filter(content_type=tlct).values("object_id")
+    tlc_ids = utcs.filter(content_type=tlcct).values("object_id")
 
-    return list(tls) + list(tls_from_tlcs)
+    return list(TestList.objects.filter(
+        Q(pk__in=tl_ids) | Q(testlistcyclemembership__cycle__in=tlc_ids)
+    ).distinct().values_list("pk", flat=True))
 
 
 class UnitTestInfoManager(models.Manager):
@@ -781,9 +802,15 @@ class TestCollectionInterface(models.Model):
     def all_tests(self):
         """returns all tests from this list and sublists"""
         return Test.objects.filter(
-            testlistmembership__test_list__in=self.all_lists()
+            testcollectionclosure__content_type=self.content_type(),
+            testcollectionclosure__object_id=self.pk,
         ).distinct().prefetch_related("category")
 
+    def ordered_tests(self):
+        """return list of all tests/sublist tests in order"""
+        rows = closure.for_collection(self).select_related("test__category").order_by("order")
+        return [row.test for row in rows]
+
     def test_list_members(self):
         """return all days from this collection"""
         raise NotImplementedError
@@ -817,13 +844,6 @@ class TestList(TestCollectionInterface):
         """return query for self and all sublists"""
         return TestList.objects.filter(pk=self.pk) | self.sublists.order_by("name")
 
-    def ordered_tests(self):
-        """return list of all tests/sublist tests in order"""
-        tests = list(self.tests.all().order_by("testlistmembership__order").select_related("category"))
-        for sublist in self.sublists.order_by("name"):
-            tests.extend(sublist.ordered_tests())
-        return tests
-
     def __len__(self):
         return 1
 
@@ -832,6 +852,40 @@ class TestList(TestCollectionInterface):
         return "(%s) %s" % (self.pk, self.name)
 
 
+def due_status_case(now=None):
+    """
+    Return a database expression for the due status of a
+    :model:`qa.UnitTestCollection` (see `UnitTestCollection.due_status`).
+    Due dates are compared with the start of days in the current time zone
+    and the overdue offset of each frequency, so the expression includes one
+    condition per distinct (overdue interval - due interval) of the
+    frequencies.
+    """
+
+    tz = timezone.get_current_timezone()
+    today = timezone.localtime(now or timezone.now(), tz).date()
+
+    def day_start(days):
+        day = today + timezone.timedelta(days=days)
+        return timezone.make_aware(timezone.datetime(day.year, day.month, day.day), tz, is_dst=False)
+
+    offsets = {}
+    for pk, due, overdue in Frequency.objects.values_list("pk", "due_interval", "overdue_interval"):
+        offsets.setdefault(overdue - due, []).append(pk)
+
+    # due_date < start of tomorrow => today >= due date, and due is still
+    # before the overdue date if due date >= start of (today + 1 - offset)
+    whens = [
+        When(due_date=None, then=Value(NO_DUE_DATE)),
+        When(due_date__gte=day_start(1), then=Value(NOT_DUE)),
+        When(frequency=None, due_date__gte=day_start(0), then=Value(DUE)),
+    ]
+    for offset, pks in sorted(offsets.items()):
+        whens.append(When(frequency__in=pks, due_date__gte=day_start(1 - offset), then=Value(DUE)))
+
+    return Case(*whens, default=Value(OVERDUE), output_field=CharField())
+
+
 class UnitTestListManager(models.Manager):
     def by_unit(self, unit):
         return self.get_queryset().filter(unit=unit)
@@ -850,6 +904,52 @@ class UnitTestListManager(models.Manager):
     def by_visibility(self, groups):
         return self.get_queryset().filter(visible_to__in=groups)
 
+    def with_due_status(self, now=None):
+        """annotate unit test collections with their due status (see `due_status_case`)"""
+        return self.get_queryset().annotate(annotated_due_status=due_status_case(now))
+
+    def due_status_counts(self, queryset=None, now=None):
+        """return dict mapping due status to number of unit test collections in `queryset`"""
+
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        counts = dict((status, 0) for status, __ in DUE_STATUS_CHOICES)
+        rows = queryset.annotate(
+            annotated_due_status=due_status_case(now),
+        ).values("annotated_due_status").annotate(n=Count("pk", distinct=True)).order_by()
+        for row in rows:
+            counts[row["annotated_due_status"]] = row["n"]
+
+        return counts
+
+    def containing(self, test=None, test_list=None):
+        """
+        Return unit test collections whose test list or cycle contains
+        `test` or `test_list` (directly, as a sublist or as a cycle member)
+        """
+
+        rows = TestCollectionClosure.objects.all()
+        if test is not None:
+            rows = rows.filter(test=test)
+        if test_list is not None:
+            rows = rows.filter(test_list=test_list)
+
+        tlct = ContentType.objects.get_for_model(TestList)
+        tlcct = ContentType.objects.get_for_model(TestListCycle)
+
+        q = (
+            Q(content_type=tlct, object_id__in=rows.filter(content_type=tlct).values("object_id")) |
+            Q(content_type=tlcct, object_id__in=rows.filter(content_type=tlcct).values("object_id"))
+        )
+
+        if test_list is not None:
+            # lists without any tests of their own
+            cycle_ids = TestListCycleMembership.objects.filter(test_list=test_list).values("cycle_id")
+            q |= Q(content_type=tlct, object_id=test_list.pk) | Q(content_type=tlcct, object_id__in=cycle_ids)
+
+        return self.get_queryset().filter(q)
+
 
 class UnitTestCollection(models.Model):
     """keeps track of which units should perform which test lists at a given frequency"""
@@ -872,6 +972,10 @@ class UnitTestCollection(models.Model):
     objects = UnitTestListManager()
 
     last_instance = models.ForeignKey("TestListInstance", null=True, editable=False, on_delete=models.SET_NULL)
+    last_valid_instance = models.ForeignKey(
+        "TestListInstance", null=True, editable=False, on_delete=models.SET_NULL, related_name="+",
+        help_text=_("Last completed test list instance with no invalid test instances (used for scheduling)"),
+    )
 
     class Meta:
         unique_together = ("unit", "frequency", "content_type", "object_id",)
@@ -882,12 +986,15 @@ class UnitTestCollection(models.Model):
             ("can_review_non_visible_tli", "Can view tli and utc not visible to user's groups")
         )
 
-    def calc_due_date(self):
-        """return the next due date of this Unit/TestList pair """
+    def calc_due_date(self, last_valid=None):
+        """
+        return the next due date of this Unit/TestList pair. `last_valid`
+        may be passed when the last valid instance is already known.
+        """
 
         if self.auto_schedule and self.frequency is not None:
-            last_valid = self.last_valid_instance()
-            if last_valid is None and self.last_instance is not None:
+            last_valid = last_valid or self.last_valid_instance
+            if last_valid is None and self.last_instance_id is not None:
                 # Done before but no valid lists
                 return timezone.now()
             elif last_valid is not None and last_valid.work_completed:
@@ -896,19 +1003,30 @@ class UnitTestCollection(models.Model):
         #return existing due date (could be None)
         return self.due_date
 
-    def set_due_date(self, due_date=None):
-        """Set due date field for this UTC. Note model is not saved to db.
+    def set_due_date(self, due_date=None, test_list_instance=None):
+        """Update the last valid instance (see `calc_last_valid_instance`) and
+        set due date field for this UTC. Note model is not saved to db.
         Saving be done manually"""
+
+        self.last_valid_instance = self.calc_last_valid_instance(test_list_instance)
+        updates = {"last_valid_instance": self.last_valid_instance}
+
         if self.auto_schedule and due_date is None and self.frequency is not None:
             due_date = self.calc_due_date()
 
         if due_date is not None:
-            # use update here instead of save so post_save and pre_save signals are not
-            # triggered
             self.due_date = due_date
-            UnitTestCollection.objects.filter(pk=self.pk).update(due_date=due_date)
+            updates["due_date"] = due_date
+
+        # use update here instead of save so post_save and pre_save signals are not
+        # triggered
+        UnitTestCollection.objects.filter(pk=self.pk).update(**updates)
 
     def due_status(self):
+        if hasattr(self, "annotated_due_status"):
+            # already calculated by the database (see UnitTestListManager.with_due_status)
+            return self.annotated_due_status
+
         if not self.due_date:
             return NO_DUE_DATE
 
@@ -926,7 +1044,7 @@ class UnitTestCollection(models.Model):
             return DUE
         return OVERDUE
 
-    def last_valid_instance(self):
+    def find_last_valid_instance(self):
         """ return last test_list_instance with all valid tests """
 
         try:
@@ -934,6 +1052,37 @@ class UnitTestCollection(models.Model):
         except TestListInstance.DoesNotExist:
             pass
 
+    def calc_last_valid_instance(self, test_list_instance=None, valid=None, deleted=False):
+        """
+        Return the last valid instance of this collection after
+        `test_list_instance` has been saved, re-statused or `deleted`.  The
+        instances of the collection are only searched (see
+        `find_last_valid_instance`) when the current last valid instance may
+        no longer be valid or no `test_list_instance` is given. `valid` may
+        be passed when it is already known whether all test instances of
+        `test_list_instance` have valid statuses.
+        """
+
+        tli = test_list_instance
+        current_id = self.last_valid_instance_id
+
+        if tli is None or current_id == tli.pk or (deleted and current_id is None):
+            # note deleting the current last valid instance sets
+            # last_valid_instance to null before signals are sent
+            return self.find_last_valid_instance()
+
+        if deleted or tli.in_progress or tli.work_completed is None:
+            return self.last_valid_instance
+
+        current = self.last_valid_instance
+        if current is not None and current.work_completed > tli.work_completed:
+            return current
+
+        if valid is None:
+            valid = not tli.testinstance_set.filter(status__valid=False).exists()
+
+        return tli if valid else current
+
     def last_done_date(self):
         """return date this test list was last performed"""
 
@@ -953,36 +1102,33 @@ class UnitTestCollection(models.Model):
             unit_test_info__test__in=self.tests_object.all_tests()
         )
 
-    def history(self, before=None):
-
-        before = before or timezone.now()
+    def history(self, before=None, number=None):
+        """
+        Return a list of (test, [test instances]) and the completion dates
+        of the last `number` (default settings.NHIST) test list instances
+        completed before `before`.  History up to the current time is cached.
+        """
 
-        tlis = TestListInstance.objects.filter(unit_test_collection=self)
+        number = number or settings.NHIST
 
-        if before is not None:
-            tlis = tlis.filter(work_completed__lt=before)
+        def load():
+            tlis = TestListInstance.objects.filter(
+                unit_test_collection=self,
+                work_completed__lt=before or timezone.now(),
+            ).order_by("-work_completed")[:number]
+            return TestInstance.objects.history_lookup(tlis)
 
-        tlis = tlis.order_by(
-            "-work_completed"
-        ).prefetch_related(
-            "testinstance_set__status",
-            "testinstance_set__reference",
-            "testinstance_set__tolerance",
-            "testinstance_set__unit_test_info",
-            "testinstance_set__unit_test_info__unit",
-            "testinstance_set__unit_test_info__test",
-            "testinstance_set__created_by",
-        )[:settings.NHIST]
+        if before is None:
+            tli_dates, lookup = history_cache.get_lookup(self.pk, "now", number, load)
+        else:
+            tli_dates, lookup = load()
 
-        dates = tlis.values_list("work_completed", flat=True)
+        dates = [wc for pk, wc in tli_dates]
+        by_test = dict(((tli_pk, ti.unit_test_info.test_id), ti) for (tli_pk, uti_pk), ti in lookup.items())
 
         instances = []
         for test in self.tests_object.ordered_tests():
-            test_history = []
-            for tli in tlis:
-                match = [x for x in tli.testinstance_set.all() if x.unit_test_info.test == test]
-                test_history.append(match[0] if match else None)
-
+            test_history = [by_test.get((tli_pk, test.pk)) for tli_pk, wc in tli_dates]
             instances.append((test, test_history))
 
         return instances, dates
@@ -1032,6 +1178,9 @@ class UnitTestCollection(models.Model):
                 tolerance=source_uti.tolerance
             )
 
+        # queryset updates don't send signals
+        payload.invalidate()
+
     def __str__(self):
         return "UnitTestCollection(%s)" % self.pk
 
@@ -1044,6 +1193,35 @@ class TestInstanceManager(models.Manager):
     def complete(self):
         return models.Manager.get_queryset(self).filter(test_list_instance__in_progress=False)
 
+    def history_lookup(self, test_list_instances):
+        """
+        Return a list of (pk, work_completed) pairs for an (ordered & sliced)
+        queryset of :model:`qa.TestListInstance`s and a dict mapping
+        (test list instance id, unit test info id) to the :model:`qa.TestInstance`s
+        performed as part of them, for building history tables without
+        searching each test list instance for every test.
+        """
+
+        tli_dates = list(test_list_instances.values_list("pk", "work_completed"))
+
+        tis = self.get_queryset().filter(
+            test_list_instance_id__in=[pk for pk, wc in tli_dates],
+        ).select_related(
+            "status",
+            "reference",
+            "tolerance",
+            "unit_test_info__test",
+            "unit_test_info__unit",
+            "created_by",
+            "test_list_instance",
+        ).order_by("pk")
+
+        lookup = {}
+        for ti in tis:
+            lookup.setdefault((ti.test_list_instance_id, ti.unit_test_info_id), ti)
+
+        return tli_dates, lookup
+
 
 class TestInstance(models.Model):
     """
@@ -1064,6 +1242,10 @@ class TestInstance(models.Model):
     value = models.FloatField(help_text=_("For boolean Tests a value of 0 equals False and any non zero equals True"), null=True)
     string_value = models.CharField(max_length=MAX_STRING_VAL_LEN, null=True, blank=True)
 
+    # difference & percent difference of value from reference (see set_differences)
+    diff = models.FloatField(null=True, editable=False, db_index=True)
+    percent_diff = models.FloatField(null=True, editable=False, db_index=True)
+
     skipped = models.BooleanField(help_text=_("Was this test skipped for some reason (add comment)"), default=False)
     comment = models.TextField(help_text=_("Add a comment to this test"), null=True, blank=True)
 
@@ -1104,8 +1286,16 @@ class TestInstance(models.Model):
 
     def save(self, *args, **kwargs):
         self.calculate_pass_fail()
+        self.set_differences()
         super(TestInstance, self).save(*args, **kwargs)
 
+    def set_differences(self):
+        """set the denormalized diff & percent_diff of value from reference"""
+        if self.skipped or self.reference is None:
+            self.diff, self.percent_diff = None, None
+        else:
+            self.diff, self.percent_diff = utils.differences(self.value, self.reference.value)
+
     def difference(self):
         """return difference between instance and reference"""
         return self.value - self.reference.value
@@ -1127,9 +1317,15 @@ class TestInstance(models.Model):
 
         choice = self.string_value.lower()
 
-        if choice in [x.lower() for x in self.tolerance.pass_choices()]:
+        data = refdata.current()
+        if data is not None:
+            pass_choices, tol_choices = data.choice_sets(self.tolerance)
+        else:
+            pass_choices, tol_choices = refdata.tolerance_choice_sets(self.tolerance)
+
+        if choice in pass_choices:
             self.pass_fail = OK
-        elif choice in [x.lower() for x in self.tolerance.tol_choices()]:
+        elif choice in tol_choices:
             self.pass_fail = TOLERANCE
         else:
             self.pass_fail = ACTION
@@ -1188,6 +1384,14 @@ class TestInstance(models.Model):
             return
 
         if self.unit_test_info.test.auto_review:
+            data = refdata.current()
+            if data is not None:
+                status = data.auto_review_status(self.pass_fail)
+                if status is not None:
+                    self.status = status
+                    self.review_date = timezone.now()
+                return
+
             try:
                 self.status = AutoReviewRule.objects.get(pass_fail=self.pass_fail).status
                 self.review_date = timezone.now()
@@ -1340,7 +1544,7 @@ class TestListInstance(models.Model):
     def failing_tests(self):
         return self.testinstance_set.filter(pass_fail=ACTION)
 
-    def history(self):
+    def history(self, number=None):
         # note when using, your view should likely prefetch and select related
         # as follows
         # prefetch_related = [
@@ -1351,29 +1555,25 @@ class TestListInstance(models.Model):
         # ]
         # select_related = ["unittestcollection__unit"]
 
-        # grab NHIST number of previous results
-        tlis = TestListInstance.objects.filter(
-            unit_test_collection=self.unit_test_collection,
-        )
+        # grab `number` (default NHIST) previous results
+        number = number or settings.NHIST
 
-        if self.work_completed:
-            tlis = tlis.filter(
-                work_completed__lt=self.work_completed,
+        def load():
+            tlis = TestListInstance.objects.filter(
+                unit_test_collection_id=self.unit_test_collection_id,
             )
 
-        tlis = tlis.order_by(
-            "-work_completed"
-        ).prefetch_related(
-            "testinstance_set__status",
-            "testinstance_set__reference",
-            "testinstance_set__tolerance",
-            "testinstance_set__unit_test_info__test",
-            "testinstance_set__unit_test_info__unit",
-            "testinstance_set__created_by",
-            "testinstance_set__test_list_instance"
-        )[:settings.NHIST]
+            if self.work_completed:
+                tlis = tlis.filter(
+                    work_completed__lt=self.work_completed,
+                )
 
-        dates = tlis.values_list("work_completed", flat=True)
+            tlis = tlis.order_by("-work_completed")[:number]
+            return TestInstance.objects.history_lookup(tlis)
+
+        cutoff = self.work_completed or "all"
+        tli_dates, lookup = history_cache.get_lookup(self.unit_test_collection_id, cutoff, number, load)
+        dates = [wc for pk, wc in tli_dates]
 
         instances = []
         # note sort  here rather than using self.testinstance_set.order_by(("created")
@@ -1382,13 +1582,7 @@ class TestListInstance(models.Model):
 
         test_instances = sorted(self.testinstance_set.all(), key=lambda x: x.created)
         for ti in test_instances:
-
-            test_history = []
-            for tli in tlis:
-                q = tli.testinstance_set.all()
-                match = [x for x in q if x.unit_test_info_id == ti.unit_test_info_id]
-                test_history.append(match[0] if match else None)
-
+            test_history = [lookup.get((tli_pk, ti.unit_test_info_id)) for tli_pk, wc in tli_dates]
             instances.append((ti, test_history))
 
         return instances, dates
@@ -1440,14 +1634,15 @@ class TestListCycle(TestCollectionInterface):
 
         return query.distinct()
 
-    def all_tests(self):
-        """return all test members of cycle members"""
-        query = Test.objects.none()
-        for test_list in self.test_lists.all():
-            query |= test_list.all_tests()
-        return query.distinct()
-
-    ordered_tests = all_tests
+    def ordered_tests(self):
+        """return list of distinct tests from all cycle members in order"""
+        tests = []
+        seen = set()
+        for test in super(TestListCycle, self).ordered_tests():
+            if test.pk not in seen:
+                seen.add(test.pk)
+                tests.append(test)
+        return tests
 
     def get_list(self, day=0):
         """get actual day and test list for given input day"""
@@ -1496,3 +1691,106 @@ class TestListCycleMembership(models.Model):
 
     def __str__(self):
         return "TestListCycleMembership(pk=%s)" % self.pk
+
+
+class TestCollectionClosure(models.Model):
+    """
+    Materialized list of every :model:`qa.Test` contained in a test
+    collection (:model:`qa.TestList` or :model:`qa.TestListCycle`) either
+    directly or via sublists & cycle members, along with the effective order
+    the tests are performed in and the :model:`qa.TestList` the test is a
+    direct member of.  Maintained by qa.signals (see qa.closure).
+    """
+
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    collection = GenericForeignKey("content_type", "object_id")
+
+    test = models.ForeignKey(Test)
+    test_list = models.ForeignKey(TestList, help_text=_("Test list the test is a direct member of"))
+    order = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ("order",)
+        index_together = (("content_type", "object_id", "order"),)
+
+    def __str__(self):
+        return "TestCollectionClosure(pk=%s)" % self.pk
+
+
+class UploadJob(models.Model):
+    """
+    An upload test calculation queued for processing outside of the web
+    request (see qa.uploads & the run_upload_jobs management command).
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETE = "complete"
+
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (COMPLETE, _("Complete")),
+    )
+
+    test = models.ForeignKey(Test)
+    attachment = models.ForeignKey("attachments.Attachment")
+
+    # JSON encoded meta, refs & tols data posted with the upload
+    context = models.TextField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+
+    # JSON encoded response returned to the client once complete
+    results = models.TextField(blank=True, default="")
+
+    created = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(User, editable=False, related_name="upload_jobs")
+    started = models.DateTimeField(null=True, blank=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("created",)
+
+    def __str__(self):
+        return "UploadJob(pk=%s)" % self.pk
+
+
+class ProcedureStats(models.Model):
+    """
+    Rolling execution statistics for the calculation procedure of a
+    :model:`qa.Test` (see qa.telemetry).
+    """
+
+    test = models.OneToOneField(Test, related_name="procedure_stats", editable=False)
+
+    # JSON list of the most recent [wall time, cpu time, peak memory] samples
+    samples = models.TextField(default="[]", editable=False)
+
+    executions = models.PositiveIntegerField(default=0, editable=False)
+    errors = models.PositiveIntegerField(default=0, editable=False)
+
+    wall_p50 = models.FloatField(_("Median time (s)"), null=True, editable=False)
+    wall_p95 = models.FloatField(_("95th percentile time (s)"), null=True, editable=False, db_index=True)
+    wall_max = models.FloatField(_("Max time (s)"), null=True, editable=False)
+    cpu_p50 = models.FloatField(_("Median CPU time (s)"), null=True, editable=False)
+    cpu_p95 = models.FloatField(_("95th percentile CPU time (s)"), null=True, editable=False)
+    memory_p95 = models.FloatField(_("95th percentile peak memory (MB)"), null=True, editable=False)
+
+    last_executed = models.DateTimeField(null=True, editable=False)
+
+    profile = models.BooleanField(
+        _("Profile"), default=False,
+        help_text=_("Run this test's calculation procedure under cProfile and store the report below"),
+    )
+    profile_report = models.TextField(blank=True, default="", editable=False)
+    profile_date = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = _("procedure timing")
+        verbose_name_plural = _("slowest procedures")
+        ordering = ("-wall_p95",)
+
+    def __str__(self):
+        return "ProcedureStats(%s)" % self.test_id
@@ -0,0 +1,174 @@
+"""
+Vectorized pass/fail evaluation for :model:`qa.TestInstance`s.
+
+The functions here evaluate arrays of values, references & tolerances in
+one call using numpy and give exactly the same results as the scalar
+`TestInstance.calculate_pass_fail` / `utils.almost_equal` path (including
+the almost equal rules used for values on a tolerance or action border).
+"""
+
+import math
+
+import numpy
+
+from qatrack.qa import models
+
+# default bounds used for tolerance levels which are not set
+NO_LOW_BOUND = -1E99
+NO_HIGH_BOUND = 1E99
+
+
+def as_array(values):
+    """return values as a float array with None converted to NaN"""
+    return numpy.array([numpy.nan if v is None else v for v in values], dtype=numpy.float64)
+
+
+def almost_equal(a, b, significant=7):
+    """
+    Vectorized equivalent of `utils.almost_equal`. `a` and `b` are float
+    arrays (or scalars); NaN (missing) values are never almost equal.
+    """
+
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+
+    with numpy.errstate(all="ignore"):
+        scale = 0.5 * (numpy.abs(b) + numpy.abs(a))
+
+        # the scalar version leaves the scale unchanged when its exponent
+        # can't be calculated (zero, infinite or NaN scales)
+        exponent = numpy.floor(numpy.log10(scale))
+        scale = numpy.where(numpy.isfinite(exponent), numpy.power(10., exponent), scale)
+
+        sc_b = numpy.where(scale == 0, 0., b / scale)
+        sc_a = numpy.where(scale == 0, 0., a / scale)
+
+        return numpy.abs(sc_b - sc_a) <= math.pow(10., -(significant - 1))
+
+
+def differences(values, references, percent):
+    """
+    Return the difference (or percent difference where `percent` is True)
+    between arrays of values and references.  Percent differences for zero
+    references are not defined (the scalar path raises ZeroDivisionError)
+    and must be excluded by the caller.
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    references = numpy.asarray(references, dtype=numpy.float64)
+
+    with numpy.errstate(all="ignore"):
+        absolute = values - references
+        percentage = 100. * (values - references) / references
+
+    return numpy.where(percent, percentage, absolute)
+
+
+def float_pass_fail(values, references, percent, act_low, tol_low, tol_high, act_high):
+    """
+    Return an array of pass/fail codes (OK, TOLERANCE or ACTION) for arrays
+    of numerical values & references. `percent` is a boolean array
+    indicating which rows have percent (rather than absolute) tolerances and
+    the tolerance bounds are float arrays with NaN for unset levels.
+    """
+
+    diff = differences(values, references, percent)
+
+    al = numpy.asarray(act_low, dtype=numpy.float64)
+    tl = numpy.asarray(tol_low, dtype=numpy.float64)
+    th = numpy.asarray(tol_high, dtype=numpy.float64)
+    ah = numpy.asarray(act_high, dtype=numpy.float64)
+
+    al = numpy.where(numpy.isnan(al), NO_LOW_BOUND, al)
+    tl = numpy.where(numpy.isnan(tl), NO_LOW_BOUND, tl)
+    th = numpy.where(numpy.isnan(th), NO_HIGH_BOUND, th)
+    ah = numpy.where(numpy.isnan(ah), NO_HIGH_BOUND, ah)
+
+    on_action_border = almost_equal(diff, al) | almost_equal(diff, ah)
+    on_tolerance_border = almost_equal(diff, tl) | almost_equal(diff, th)
+
+    with numpy.errstate(invalid="ignore"):
+        inside_action = ((al <= diff) & (diff <= ah)) | on_action_border
+        inside_tolerance = ((tl <= diff) & (diff <= th)) | on_tolerance_border
+
+    return numpy.where(
+        ~inside_action, models.ACTION,
+        numpy.where(~inside_tolerance, models.TOLERANCE, models.OK),
+    )
+
+
+def bool_pass_fail(values, references):
+    """return an array of pass/fail codes (OK or ACTION) for boolean values"""
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    references = numpy.asarray(references, dtype=numpy.float64)
+
+    return numpy.where(numpy.abs(references - values) > models.EPSILON, models.ACTION, models.OK)
+
+
+def calculate_pass_fail(test_instances):
+    """
+    Set the pass_fail attribute of a list of (unsaved or modified)
+    :model:`qa.TestInstance`s. Numerical & boolean tests are evaluated
+    together with numpy, while string tests and any instances the scalar
+    path would raise an error for (e.g. a percent tolerance with a zero
+    reference) are evaluated individually by `calculate_pass_fail`.
+
+    Returns a list of (test instance, exception) pairs for instances whose
+    pass/fail state could not be calculated.
+    """
+
+    floats = []
+    bools = []
+    scalar = []
+
+    for ti in test_instances:
+        test = ti.unit_test_info.test
+        if ti.skipped or (ti.value is None and ti.test_list_instance.in_progress):
+            ti.pass_fail = models.NOT_DONE
+        elif test.is_boolean() and ti.reference:
+            if ti.value is None or ti.reference.value is None:
+                scalar.append(ti)
+            else:
+                bools.append(ti)
+        elif test.is_string_type() and ti.tolerance:
+            scalar.append(ti)
+        elif ti.reference and ti.tolerance:
+            percent = ti.tolerance.type != models.ABSOLUTE
+            if ti.value is None or ti.reference.value is None or (percent and ti.reference.value == 0):
+                scalar.append(ti)
+            else:
+                floats.append(ti)
+        else:
+            ti.pass_fail = models.NO_TOL
+
+    if bools:
+        codes = bool_pass_fail(
+            as_array(ti.value for ti in bools),
+            as_array(ti.reference.value for ti in bools),
+        )
+        for ti, code in zip(bools, codes):
+            ti.pass_fail = str(code)
+
+    if floats:
+        tols = [ti.tolerance for ti in floats]
+        codes = float_pass_fail(
+            as_array(ti.value for ti in floats),
+            as_array(ti.reference.value for ti in floats),
+            numpy.array([t.type != models.ABSOLUTE for t in tols], dtype=bool),
+            as_array(t.act_low for t in tols),
+            as_array(t.tol_low for t in tols),
+            as_array(t.tol_high for t in tols),
+            as_array(t.act_high for t in tols),
+        )
+        for ti, code in zip(floats, codes):
+            ti.pass_fail = str(code)
+
+    errors = []
+    for ti in scalar:
+        try:
+            ti.calculate_pass_fail()
+        except Exception as e:
+            errors.append((ti, e))
+
+    return errors
@@ -0,0 +1,134 @@
+"""
+Cache of the data needed to render the perform test list page for a
+:model:`qa.UnitTestCollection` (see `PerformQA`): the test list & sublists
+to perform, their tests, the ordered :model:`qa.UnitTestInfo`s (with
+references & tolerances) and the serialized unit test infos used by the
+page's javascript.
+
+Snapshots are keyed by unit test collection and day and include a version
+number which is bumped (see qa.signals) whenever tests, categories, test
+lists, cycles, memberships, unit test collections, unit test infos,
+references or tolerances change. Note last instances & due dates of unit
+test collections are updated with queryset updates and don't invalidate
+payloads.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.forms.models import model_to_dict
+
+from qatrack.qa import history
+
+VERSION_KEY = "qa-perform-payload-version"
+
+
+def get_cache():
+    return caches[settings.PERFORM_PAYLOAD_CACHE]
+
+
+def get_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = history.new_version()
+        cache.set(VERSION_KEY, version, None)
+    return version
+
+
+def day_key(utc, requested_day):
+    """
+    Return a description of the day to be performed which doesn't require
+    querying the database. When no day is requested, the next list depends
+    only on the day of the collection's last instance.
+    """
+
+    if requested_day is not None:
+        return "day%s" % requested_day
+
+    last_instance = getattr(utc, "last_instance", None)
+    return "next%s" % (last_instance.day if last_instance else "")
+
+
+def build(utc, requested_day):
+    """
+    Create the perform payload for `utc` and `requested_day`. Returns None
+    if there is no test list to perform.
+    """
+
+    from qatrack.qa import models
+
+    actual_day, test_list = utc.get_list(requested_day)
+    if test_list is None:
+        return None
+
+    all_lists = [test_list] + list(test_list.sublists.order_by("name"))
+
+    all_tests = test_list.ordered_tests()
+
+    utis = models.UnitTestInfo.objects.filter(
+        unit=utc.unit_id,
+        test__in=all_tests,
+        active=True,
+    ).select_related(
+        "reference",
+        "test__category",
+        "tolerance",
+        "unit",
+    )
+    utis_by_test = dict((uti.test_id, uti) for uti in utis)
+
+    unit_test_infos = []
+    missing = []
+    for test in all_tests:
+        if test.pk in utis_by_test:
+            unit_test_infos.append(utis_by_test[test.pk])
+        else:
+            missing.append((test.pk, test.name))
+
+    template_utis = []
+    for uti in unit_test_infos:
+        template_utis.append({
+            "id": uti.pk,
+            "test": model_to_dict(uti.test),
+            "reference": model_to_dict(uti.reference) if uti.reference else None,
+            "tolerance": model_to_dict(uti.tolerance) if uti.tolerance else None,
+        })
+
+    tests_object = utc.tests_object
+    ndays = len(tests_object)
+
+    return {
+        "actual_day": actual_day,
+        "test_list": test_list,
+        "all_lists": all_lists,
+        "all_tests": all_tests,
+        "unit_test_infos": unit_test_infos,
+        "missing_tests": missing,
+        "categories": set(uti.test.category for uti in unit_test_infos),
+        "template_unit_test_infos": json.dumps(template_utis),
+        "days": tests_object.days_display() if ndays > 1 else None,
+    }
+
+
+def get_payload(utc, requested_day=None):
+    """return the (possibly cached) perform payload for `utc` and `requested_day`"""
+
+    cache = get_cache()
+    key = "qa-perform-payload-%s-%s-%s" % (utc.pk, day_key(utc, requested_day), get_version())
+
+    data = cache.get(key)
+    if data is None:
+        data = build(utc, requested_day)
+        if data is not None:
+            cache.set(key, data)
+
+    return data
+
+
+def invalidate():
+    """invalidate all cached perform payloads (immediately and again on commit)"""
+    history.bump(VERSION_KEY, get_cache())
+    transaction.on_commit(lambda: history.bump(VERSION_KEY, get_cache()))
@@ -0,0 +1,233 @@
+"""
+Batch recalculation of composite tests for existing
+:model:`qa.TestListInstance`s.
+
+When a calculation procedure is corrected the historical results of the
+composite test (and any composites depending on it) can be reprocessed
+here rather than by re-performing each test list.  Each test list instance
+is evaluated with the same META/REFS/TOLS context the perform page would
+have provided and any changed :model:`qa.TestInstance` values & pass/fail
+states are written back in batches.
+
+Files written by procedures via `write_file` are discarded.
+"""
+
+import json
+
+from django.db import transaction
+
+from qatrack.qa import calculation, history, models, passfail, refdata, sandbox, utils
+
+COMPOSITE_TYPES = (models.COMPOSITE, models.STRING_COMPOSITE)
+
+TOL_PROPERTIES = ("act_high", "act_low", "tol_high", "tol_low", "mc_pass_choices", "mc_tol_choices", "type")
+
+
+class RecalculationStats(object):
+    """Running totals for a recalculation"""
+
+    def __init__(self):
+        self.test_list_instances = 0
+        self.calculated = 0
+        self.changed = 0
+        self.errors = []
+
+    def __str__(self):
+        return "%d test list instances processed, %d composites calculated, %d changed, %d errors" % (
+            self.test_list_instances, self.calculated, self.changed, len(self.errors),
+        )
+
+
+def context_value(ti):
+    """return the value of a TestInstance as seen by calculation procedures"""
+
+    test = ti.unit_test_info.test
+
+    if ti.skipped:
+        return None
+    elif test.is_upload():
+        try:
+            return json.loads(ti.string_value)
+        except (TypeError, ValueError):
+            return ti.string_value
+    elif test.is_string_type():
+        return ti.string_value
+
+    return ti.value
+
+
+def meta_data(tli):
+    return {
+        "test_list_name": tli.test_list.name,
+        "unit_number": tli.unit_test_collection.unit.number,
+        "cycle_day": tli.day + 1,
+        "work_completed": tli.work_completed,
+        "work_started": tli.work_started,
+        "username": tli.created_by.username,
+    }
+
+
+def tolerance_data(tol):
+    if tol is None:
+        return None
+    return dict((p, getattr(tol, p)) for p in TOL_PROPERTIES)
+
+
+def set_result(ti, value):
+    """
+    Set the value of a composite TestInstance from a calculation result.
+    Returns True if the value changed.
+    """
+
+    if ti.unit_test_info.test.is_string_composite():
+        value = None if value is None else str(value)[:models.MAX_STRING_VAL_LEN]
+        changed = value != ti.string_value
+        ti.string_value = value
+    else:
+        value = None if value is None else float(value)
+        changed = value != ti.value
+        ti.value = value
+
+    return changed
+
+
+def calculate_composites(tli, tis, tests=None, stats=None):
+    """
+    Calculate the (not skipped) composite test instances of `tli` from the
+    values of its test instances `tis` and return a list of TestInstances
+    whose values were changed (unsaved, with differences set). If `tests`
+    (a collection of Test ids) is given, only composites for those tests
+    and composites which depend on them are calculated.
+    """
+
+    stats = stats or RecalculationStats()
+
+    by_slug = dict((ti.unit_test_info.test.slug, ti) for ti in tis)
+
+    composites = dict(
+        (slug, ti) for slug, ti in by_slug.items()
+        if ti.unit_test_info.test.type in COMPOSITE_TYPES and not ti.skipped
+    )
+    if not composites:
+        return []
+
+    all_deps = dict((slug, ti.unit_test_info.test.get_dependencies()) for slug, ti in composites.items())
+    if tests is None:
+        affected = set(composites)
+    else:
+        # non-composite tests can be selected too (e.g. after correcting a
+        # value); affected_slugs only returns the composites depending on them
+        changed = [slug for slug, ti in by_slug.items() if ti.unit_test_info.test_id in tests]
+        affected = calculation.affected_slugs(all_deps, changed)
+
+    if not affected:
+        return []
+
+    slugs = set(composites)
+    dependencies = dict((slug, deps & slugs) for slug, deps in all_deps.items())
+    layers, cyclic = calculation.dependency_layers(dependencies)
+
+    context = {
+        "META": meta_data(tli),
+        "REFS": dict((slug, ti.reference.value if ti.reference else None) for slug, ti in by_slug.items()),
+        "TOLS": dict((slug, tolerance_data(ti.tolerance)) for slug, ti in by_slug.items()),
+    }
+    for slug, ti in by_slug.items():
+        if slug not in affected:
+            context[slug] = context_value(ti)
+
+    procedure_layers = []
+    for layer in layers:
+        procs = []
+        for slug in layer:
+            if slug in affected:
+                test = composites[slug].unit_test_info.test
+                procs.append((slug, test.pk, test.calculation_procedure))
+        if procs:
+            procedure_layers.append(procs)
+
+    for slug in cyclic:
+        if slug in affected:
+            stats.errors.append((tli.pk, slug, "Cyclic test dependency"))
+
+    changed = []
+    for res in sandbox.run_layers(procedure_layers, context):
+        ti = composites[res.slug]
+        stats.calculated += 1
+
+        if not res.success:
+            stats.errors.append((tli.pk, res.slug, res.error))
+            continue
+
+        try:
+            if set_result(ti, res.value):
+                ti.test_list_instance = tli
+                ti.set_differences()
+                changed.append(ti)
+        except (TypeError, ValueError) as e:
+            stats.errors.append((tli.pk, res.slug, str(e)))
+
+    return changed
+
+
+def recalculate_test_list_instance(tli, tests=None, stats=None):
+    """
+    Recalculate the composite test instances of `tli` and return a list of
+    TestInstances whose values were changed (unsaved). If `tests` (a
+    collection of Test ids) is given, only composites for those tests and
+    composites which depend on them are recalculated.
+    """
+
+    stats = stats or RecalculationStats()
+    stats.test_list_instances += 1
+
+    to_update = calculate_composites(tli, list(tli.testinstance_set.all()), tests=tests, stats=stats)
+
+    failed = set()
+    for ti, e in passfail.calculate_pass_fail(to_update):
+        stats.errors.append((tli.pk, ti.unit_test_info.test.slug, str(e)))
+        failed.add(ti.pk)
+    to_update = [ti for ti in to_update if ti.pk not in failed]
+
+    stats.changed += len(to_update)
+    return to_update
+
+
+@refdata.scoped
+def recalculate(test_list_instances, tests=None, batch_size=200, dry_run=False, stats=None):
+    """
+    Recalculate composite tests for a queryset of :model:`qa.TestListInstance`s
+    and write changed values back to the database in batches of
+    `batch_size` test list instances. Returns a :class:`RecalculationStats`.
+    """
+
+    stats = stats or RecalculationStats()
+    tests = set(tests) if tests is not None else None
+
+    pks = list(test_list_instances.order_by("pk").values_list("pk", flat=True))
+
+    for start in range(0, len(pks), batch_size):
+        tlis = models.TestListInstance.objects.filter(
+            pk__in=pks[start:start + batch_size],
+        ).select_related(
+            "test_list",
+            "unit_test_collection__unit",
+            "created_by",
+        ).prefetch_related(
+            "testinstance_set__unit_test_info__test",
+            "testinstance_set__reference",
+            "testinstance_set__tolerance",
+        )
+
+        to_update = []
+        for tli in tlis:
+            to_update.extend(recalculate_test_list_instance(tli, tests=tests, stats=stats))
+
+        if to_update and not dry_run:
+            with transaction.atomic():
+                utils.bulk_update(to_update, ["value", "string_value", "pass_fail", "diff", "percent_diff"])
+
+    if stats.changed and not dry_run:
+        history.invalidate_all()
+
+    return stats
@@ -0,0 +1,116 @@
+"""
+Scoped cache of small, rarely changing lookup tables used while grading
+:model:`qa.TestInstance`s: :model:`qa.TestInstanceStatus`es (including the
+default status), :model:`qa.AutoReviewRule`s and the lower cased multiple
+choice sets of :model:`qa.Tolerance`s.
+
+The cache is only active inside a `scope()` (e.g. while processing a single
+test list submission) so that processing hundreds of test instances needs a
+constant number of lookup queries, while data is never served stale across
+requests or worker processes.  Saving or deleting any of the cached models
+invalidates the active cache (see qa.signals).
+"""
+
+import contextlib
+import functools
+import threading
+
+_local = threading.local()
+
+
+class ReferenceData(object):
+    """Lazily loaded lookup tables for a single scope"""
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self._statuses = None
+        self._rules = None
+        self._choices = {}
+
+    def statuses(self):
+        """return dict mapping status id to :model:`qa.TestInstanceStatus`"""
+        if self._statuses is None:
+            from qatrack.qa import models
+            self._statuses = dict((s.pk, s) for s in models.TestInstanceStatus.objects.all())
+        return self._statuses
+
+    def status(self, pk):
+        """return the status with id `pk` (raises TestInstanceStatus.DoesNotExist if there isn't one)"""
+
+        from qatrack.qa import models
+
+        try:
+            return self.statuses()[int(pk)]
+        except (KeyError, TypeError):
+            raise models.TestInstanceStatus.DoesNotExist("No TestInstanceStatus with pk=%s" % pk)
+
+    def default_status(self):
+        """return the default status (or None)"""
+        for status in self.statuses().values():
+            if status.is_default:
+                return status
+
+    def auto_review_status(self, pass_fail):
+        """return the status auto review assigns to `pass_fail` (or None)"""
+        if self._rules is None:
+            from qatrack.qa import models
+            statuses = self.statuses()
+            rules = models.AutoReviewRule.objects.values_list("pass_fail", "status_id")
+            self._rules = dict((pf, statuses.get(status_id)) for pf, status_id in rules)
+        return self._rules.get(pass_fail)
+
+    def choice_sets(self, tolerance):
+        """return (pass choices, tolerance choices) of `tolerance` as sets of lower cased strings"""
+        key = (tolerance.mc_pass_choices, tolerance.mc_tol_choices)
+        if key not in self._choices:
+            self._choices[key] = tolerance_choice_sets(tolerance)
+        return self._choices[key]
+
+
+def tolerance_choice_sets(tolerance):
+    """return (pass choices, tolerance choices) of `tolerance` as sets of lower cased strings"""
+    return (
+        set(x.lower() for x in tolerance.pass_choices()),
+        set(x.lower() for x in tolerance.tol_choices()),
+    )
+
+
+def current():
+    """return the :class:`ReferenceData` for the active scope (or None)"""
+    return getattr(_local, "data", None)
+
+
+@contextlib.contextmanager
+def scope():
+    """activate a reference data cache for the current thread (nested scopes share the outer cache)"""
+
+    data = current()
+    if data is not None:
+        yield data
+        return
+
+    _local.data = ReferenceData()
+    try:
+        yield _local.data
+    finally:
+        _local.data = None
+
+
+def scoped(func):
+    """decorator to run `func` inside a reference data `scope`"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with scope():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def invalidate():
+    """drop cached data for the active scope"""
+    data = current()
+    if data is not None:
+        data.invalidate()
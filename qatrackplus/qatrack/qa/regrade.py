@@ -0,0 +1,160 @@
+"""
+Bulk re-evaluation of the pass/fail state of existing
+:model:`qa.TestInstance`s.
+
+Used when a :model:`qa.Tolerance` is edited in place, or when historical
+results should be graded against the current references & tolerances of
+their :model:`qa.UnitTestInfo`s.  Pass/fail states are calculated in
+batches with `qa.passfail` and written back with one UPDATE per new
+pass/fail state in each batch, all inside a single transaction.
+
+Review statuses are not modified.
+"""
+
+import collections
+
+from django.db import transaction
+
+from qatrack.qa import history, models, passfail, refdata, utils
+
+
+class RegradeStats(object):
+    """Running totals for a re-grade"""
+
+    def __init__(self):
+        self.test_instances = 0
+        self.changed = 0
+        self.transitions = collections.Counter()
+        self.errors = []
+
+    def __str__(self):
+        return "%d test instances evaluated, %d pass/fail states changed, %d errors" % (
+            self.test_instances, self.changed, len(self.errors),
+        )
+
+    def summary(self):
+        """return a list of (old, new, count) tuples for changed pass/fail states"""
+        display = models.PASS_FAIL_CHOICES_DISPLAY
+        return [
+            (display.get(old, old), display.get(new, new), n)
+            for (old, new), n in sorted(self.transitions.items())
+        ]
+
+
+def affected_instances(tolerances=None, references=None, unit_test_infos=None, units=None, tests=None,
+                       date_from=None, date_to=None):
+    """
+    Return a queryset of the :model:`qa.TestInstance`s which use any of
+    the given tolerances or references, belong to the given unit test infos,
+    units (numbers) or tests (slugs) and were completed between `date_from`
+    and `date_to`.  Criteria which are None are not applied.
+    """
+
+    tis = models.TestInstance.objects.all()
+
+    if tolerances is not None:
+        tis = tis.filter(tolerance__in=tolerances)
+
+    if references is not None:
+        tis = tis.filter(reference__in=references)
+
+    if unit_test_infos is not None:
+        tis = tis.filter(unit_test_info__in=unit_test_infos)
+
+    if units is not None:
+        tis = tis.filter(unit_test_info__unit__number__in=units)
+
+    if tests is not None:
+        tis = tis.filter(unit_test_info__test__slug__in=tests)
+
+    if date_from is not None:
+        tis = tis.filter(work_completed__gte=date_from)
+
+    if date_to is not None:
+        tis = tis.filter(work_completed__lte=date_to)
+
+    return tis
+
+
+def regrade_batch(tis, use_current=False, stats=None):
+    """
+    Recalculate the pass/fail state of a list of TestInstances and return
+    a list of the instances which changed (unsaved).  If `use_current` is
+    True the instances are first assigned the current reference & tolerance
+    of their unit test info.
+    """
+
+    stats = stats or RegradeStats()
+    stats.test_instances += len(tis)
+
+    old = dict((ti.pk, (ti.pass_fail, ti.reference_id, ti.tolerance_id)) for ti in tis)
+
+    if use_current:
+        for ti in tis:
+            ti.reference = ti.unit_test_info.reference
+            ti.tolerance = ti.unit_test_info.tolerance
+            ti.set_differences()
+
+    failed = set()
+    for ti, e in passfail.calculate_pass_fail(tis):
+        stats.errors.append((ti.pk, str(e)))
+        failed.add(ti.pk)
+
+    changed = []
+    for ti in tis:
+        if ti.pk in failed:
+            continue
+
+        pass_fail, reference_id, tolerance_id = old[ti.pk]
+        if (ti.pass_fail, ti.reference_id, ti.tolerance_id) != (pass_fail, reference_id, tolerance_id):
+            changed.append(ti)
+        if ti.pass_fail != pass_fail:
+            stats.transitions[(pass_fail, ti.pass_fail)] += 1
+            stats.changed += 1
+
+    return changed
+
+
+def save_batch(tis, use_current=False):
+    """write the pass/fail states (and references/tolerances/differences) of `tis` to the database"""
+
+    if use_current:
+        utils.bulk_update(tis, ["pass_fail", "reference", "tolerance", "diff", "percent_diff"])
+        return
+
+    by_state = collections.defaultdict(list)
+    for ti in tis:
+        by_state[ti.pass_fail].append(ti.pk)
+
+    for pass_fail, pks in by_state.items():
+        models.TestInstance.objects.filter(pk__in=pks).update(pass_fail=pass_fail)
+
+
+@refdata.scoped
+def regrade(test_instances, use_current=False, batch_size=500, dry_run=False, stats=None):
+    """
+    Re-evaluate the pass/fail state of a queryset of
+    :model:`qa.TestInstance`s in batches of `batch_size` and, unless
+    `dry_run` is True, write changes back in a single transaction.
+    Returns a :class:`RegradeStats`.
+    """
+
+    stats = stats or RegradeStats()
+
+    pks = list(test_instances.order_by("pk").values_list("pk", flat=True))
+
+    related = ["unit_test_info__test", "reference", "tolerance", "test_list_instance"]
+    if use_current:
+        related += ["unit_test_info__reference", "unit_test_info__tolerance"]
+
+    with transaction.atomic():
+        for start in range(0, len(pks), batch_size):
+            tis = list(models.TestInstance.objects.filter(pk__in=pks[start:start + batch_size]).select_related(*related))
+            changed = regrade_batch(tis, use_current=use_current, stats=stats)
+            if changed and not dry_run:
+                save_batch(changed, use_current=use_current)
+
+    if stats.changed and not dry_run:
+        history.invalidate_all()
+
+    return stats
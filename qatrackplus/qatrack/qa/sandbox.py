@@ -0,0 +1,339 @@
+"""
+Runs calculation procedures in a pool of sandboxed worker processes.
+
+User written calculation procedures can take an arbitrarily long time to
+run, or allocate huge amounts of memory.  Executing them in the web
+server process means a single runaway procedure can tie up a web worker
+indefinitely.  Instead procedures are sent to a small pool of pre-forked
+worker processes (which have already imported numpy/scipy/dicom etc) that
+are killed & replaced if a procedure exceeds its wall clock time limit.
+
+Workers are forked from a single threaded fork server rather than from the
+web server process itself. Web workers may be running several request
+threads (e.g. gunicorn's gthread worker) and forking while another thread
+holds a lock (logging, database driver etc) can deadlock the child.
+"""
+
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import multiprocessing
+    fork_context = multiprocessing.get_context("forkserver")
+    fork_context.set_forkserver_preload(["qatrack.qa.calculation"])
+except ValueError:  # pragma: nocover
+    # platform does not support fork (e.g. Windows)
+    fork_context = None
+
+try:
+    import resource
+except ImportError:  # pragma: nocover
+    resource = None
+
+from django.conf import settings
+
+from qatrack.qa import calculation
+
+
+class WorkerFailure(Exception):
+    """Raised when a worker fails to return a result"""
+
+
+def limit_memory(megabytes):
+    """
+    Limit the address space of the current process to its current size
+    plus `megabytes` MB. Allocations beyond the limit raise MemoryError.
+    """
+
+    if not megabytes or resource is None:
+        return
+
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * resource.getpagesize()
+    except (IOError, OSError, ValueError):
+        current = 0
+
+    limit = current + int(megabytes * 1024 * 1024)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, resource.error):  # pragma: nocover
+        pass
+
+
+def reset_signals():
+    """Restore default signal handling inherited from e.g. a gunicorn worker"""
+    for name in ("SIGTERM", "SIGHUP", "SIGQUIT", "SIGUSR1", "SIGUSR2", "SIGCHLD", "SIGWINCH", "SIGTTIN", "SIGTTOU"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def close_pyplot_figures():
+    """close any figures a procedure created with pyplot"""
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close("all")
+
+
+def worker_main(conn, memory_limit):
+    """Main loop of a calculation worker process"""
+
+    reset_signals()
+    limit_memory(memory_limit)
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            # parent went away
+            return
+
+        if job is None:
+            return
+
+        procedures, context, file_path, profile = job
+        try:
+            results = calculation.execute_procedures(procedures, context, file_path, profile, measure_rss=True)
+            for result in results:
+                try:
+                    conn.send(result)
+                except Exception as e:
+                    conn.send(calculation.CalculationResult(
+                        result.slug, error="Unable to return result: %s" % e, test_id=result.test_id, stats=result.stats,
+                    ))
+        except Exception as e:
+            # e.g. unable to open file
+            for slug, test_id, procedure in procedures:
+                conn.send(calculation.CalculationResult(slug, error=str(e), test_id=test_id))
+
+        # procedures still using pyplot can't affect other requests from
+        # within a worker process, so it's safe to reset its global state here
+        close_pyplot_figures()
+
+
+class Worker(object):
+    """Handle for a single calculation worker process"""
+
+    def __init__(self, memory_limit=None):
+        self.conn, child_conn = fork_context.Pipe()
+        self.process = fork_context.Process(target=worker_main, args=(child_conn, memory_limit))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def send(self, procedures, context, file_path=None, profile=()):
+        self.conn.send((procedures, context, file_path, profile))
+
+    def recv(self, timeout=None):
+        """wait at most `timeout` seconds for the next result from the worker"""
+
+        if not self.conn.poll(timeout):
+            raise WorkerFailure("Calculation timed out after %s seconds" % timeout)
+
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerFailure("Calculation process terminated unexpectedly")
+
+    def kill(self):
+        try:
+            os.kill(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.join(1)
+        self.conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+
+class CalculationPool(object):
+    """
+    A pool of pre-forked worker processes for executing calculation procedures.
+
+    Each procedure is given at most `timeout` seconds to complete and each
+    worker may allocate at most `memory_limit` MB beyond its starting size.
+    Workers exceeding their limits are killed and replaced without affecting
+    the calling process.
+    """
+
+    def __init__(self, size, timeout=None, memory_limit=None):
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._idle = None
+        self._pid = None
+
+    def start(self):
+        """fork worker processes (if not already started in this process)"""
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._idle = queue.Queue()
+            for i in range(self.size):
+                self._idle.put(Worker(self.memory_limit))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            while True:
+                try:
+                    self._idle.get_nowait().kill()
+                except queue.Empty:
+                    break
+            self._pid = None
+
+    def run(self, procedures, context, file_path=None, profile=()):
+        """
+        Run (slug, test id, procedure) triples in order in the input
+        context and return a list of :class:`calculation.CalculationResult`.
+        The context is updated with any successfully calculated values.
+        Procedures for test ids in `profile` are run under cProfile.
+        """
+
+        self.start()
+
+        remaining = list(procedures)
+        results = []
+
+        try:
+            # all workers may be busy with other requests; wait no longer
+            # than a single procedure would be allowed to run for
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            error = "Calculation timed out after %s seconds waiting for a calculation process" % self.timeout
+            return [
+                calculation.CalculationResult(slug, error=error, fatal=True, test_id=test_id, stats={"wall": self.timeout})
+                for slug, test_id, procedure in remaining
+            ]
+
+        try:
+            while remaining:
+                if not worker.is_alive():
+                    worker.kill()
+                    worker = Worker(self.memory_limit)
+
+                worker.send(remaining, context, file_path, profile)
+
+                while remaining:
+                    slug, test_id = remaining[0][:2]
+                    start = time.time()
+                    try:
+                        result = worker.recv(self.timeout)
+                    except WorkerFailure as e:
+                        result = calculation.CalculationResult(
+                            slug, error=str(e), fatal=True, test_id=test_id, stats={"wall": time.time() - start},
+                        )
+
+                    remaining.pop(0)
+                    results.append(result)
+
+                    if result.success:
+                        context[slug] = result.value
+
+                    if result.fatal:
+                        # worker is wedged, dead or out of memory. Replace it
+                        # and resubmit the remaining procedures to a new worker
+                        worker.kill()
+                        worker = Worker(self.memory_limit)
+                        break
+        finally:
+            self._idle.put(worker)
+
+        return results
+
+
+class InProcessRunner(object):
+    """
+    Runs calculation procedures in the calling process. Since procedures
+    may still use pyplot's global state, runs are serialized and any pyplot
+    figures are closed after each run (as a pool worker does).
+    """
+
+    _lock = threading.Lock()
+
+    def run(self, procedures, context, file_path=None, profile=()):
+        with self._lock:
+            try:
+                return list(calculation.execute_procedures(procedures, context, file_path, profile))
+            finally:
+                close_pyplot_figures()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_runner():
+    """
+    Return the runner to be used for executing calculation procedures.
+    Set CALCULATION_POOL_SIZE = 0 to execute procedures in process.
+    """
+
+    global _pool
+
+    size = getattr(settings, "CALCULATION_POOL_SIZE", 0)
+    if not size or fork_context is None:
+        return InProcessRunner()
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = CalculationPool(
+                size,
+                timeout=getattr(settings, "CALCULATION_TIMEOUT", None),
+                memory_limit=getattr(settings, "CALCULATION_MEMORY_LIMIT", None),
+            )
+
+    return _pool
+
+
+def get_concurrency():
+    """
+    Return the maximum number of procedures which may be executed
+    concurrently by a single request.
+    """
+
+    if not getattr(settings, "CALCULATION_PARALLEL", False) or fork_context is None:
+        return 1
+    return max(1, getattr(settings, "CALCULATION_POOL_SIZE", 0))
+
+
+def run_layers(layers, context, file_path=None, profile=()):
+    """
+    Run a list of layers of (slug, test id, procedure) triples where each
+    procedure only depends on the results of procedures in earlier layers.
+
+    The procedures within a layer are split between up to
+    `get_concurrency()` pool workers and run concurrently.  Each worker
+    receives its own copy of the context and successful results are
+    copied back into `context` once the whole layer has completed.
+    """
+
+    runner = get_runner()
+    concurrency = get_concurrency()
+    results = []
+
+    if concurrency == 1:
+        procedures = [proc for layer in layers for proc in layer]
+        return runner.run(procedures, context, file_path, profile)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for layer in layers:
+            chunks = [layer[i::concurrency] for i in range(min(concurrency, len(layer)))]
+            futures = [executor.submit(runner.run, chunk, dict(context), file_path, profile) for chunk in chunks]
+            for future in futures:
+                for result in future.result():
+                    if result.success:
+                        context[result.slug] = result.value
+                    results.append(result)
+
+    return results
@@ -0,0 +1,147 @@
+"""
+Bulk calculation of :model:`qa.UnitTestCollection` due dates.
+
+`UnitTestCollection.calc_due_date` looks up the last valid instance of a
+single collection. Here the last valid :model:`qa.TestListInstance` of
+every collection being scheduled is found with an aggregate query (plus
+one query per batch of collections to find the matching instances), due
+dates are calculated in memory and changed due dates & last valid
+instances are written with batched updates (see `utils.bulk_update`).
+"""
+
+import time
+
+from django.db.models import Max
+from django.utils import timezone
+
+from qatrack.qa import models, utils
+
+
+class ScheduleStats(object):
+    """Totals & timing for a scheduling run"""
+
+    def __init__(self):
+        self.unit_test_collections = 0
+        self.changed = 0
+        self.elapsed = 0.
+
+    def __str__(self):
+        return "%d unit test collections scheduled, %d due dates changed in %.2fs" % (
+            self.unit_test_collections, self.changed, self.elapsed,
+        )
+
+
+def schedulable(units=None, frequencies=None):
+    """
+    Return a queryset of the auto scheduled :model:`qa.UnitTestCollection`s
+    with a frequency, optionally limited to the given unit numbers and
+    frequency slugs.
+    """
+
+    utcs = models.UnitTestCollection.objects.filter(auto_schedule=True).exclude(frequency=None)
+
+    if units is not None:
+        utcs = utcs.filter(unit__number__in=units)
+
+    if frequencies is not None:
+        utcs = utcs.filter(frequency__slug__in=frequencies)
+
+    return utcs
+
+
+def last_valid_completed(utc_ids):
+    """
+    Return a dict mapping unit test collection id (`utc_ids` may be a list
+    or a values queryset) to the work completed date of its last complete
+    test list instance with no invalid test instances.
+    """
+
+    last = models.TestListInstance.objects.filter(
+        unit_test_collection_id__in=utc_ids,
+        in_progress=False,
+    ).exclude(
+        testinstance__status__valid=False,
+    ).values(
+        "unit_test_collection_id",
+    ).annotate(
+        last_completed=Max("work_completed"),
+    ).order_by()
+
+    return dict((x["unit_test_collection_id"], x["last_completed"]) for x in last)
+
+
+def last_valid_instances(utc_ids, batch_size=400):
+    """
+    Return a dict mapping unit test collection id to a (test list instance
+    id, work completed) tuple for its last valid instance (see
+    `last_valid_completed` & `UnitTestCollection.find_last_valid_instance`).
+    """
+
+    last = last_valid_completed(utc_ids)
+
+    found = {}
+    ids = sorted(last)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        tlis = models.TestListInstance.objects.filter(
+            unit_test_collection_id__in=batch,
+            work_completed__in=set(last[utc_id] for utc_id in batch),
+            in_progress=False,
+        ).exclude(
+            testinstance__status__valid=False,
+        ).values_list(
+            "pk", "unit_test_collection_id", "work_completed",
+        ).order_by("pk")
+
+        for pk, utc_id, work_completed in tlis:
+            if last[utc_id] == work_completed:
+                found[utc_id] = (pk, work_completed)
+
+    return found
+
+
+def calc_due_date(utc, last_completed, now=None):
+    """
+    Return the due date of `utc` given the completion date of its last valid
+    instance (see `UnitTestCollection.calc_due_date`).
+    """
+
+    if last_completed is not None:
+        return last_completed + utc.frequency.due_delta()
+    elif utc.last_instance_id is not None:
+        # done before but no valid lists
+        return now or timezone.now()
+
+    return utc.due_date
+
+
+def schedule(utcs, batch_size=500):
+    """
+    Set the due dates & last valid instances of the unit test collections
+    in `utcs` (see `schedulable`) and return a `ScheduleStats`.
+    """
+
+    stats = ScheduleStats()
+    start = time.time()
+
+    last = last_valid_instances(utcs.values("pk"))
+
+    utcs = list(utcs.select_related("frequency"))
+    stats.unit_test_collections = len(utcs)
+
+    now = timezone.now()
+    changed = []
+    for utc in utcs:
+        last_valid_id, last_completed = last.get(utc.pk, (None, None))
+        due_date = calc_due_date(utc, last_completed, now)
+        if (due_date, last_valid_id) != (utc.due_date, utc.last_valid_instance_id):
+            utc.due_date = due_date
+            utc.last_valid_instance_id = last_valid_id
+            changed.append(utc)
+
+    utils.bulk_update(changed, ["due_date", "last_valid_instance"], batch_size=batch_size)
+
+    stats.changed = len(changed)
+    stats.elapsed = time.time() - start
+
+    return stats
@@ -1,10 +1,14 @@
+import contextlib
+import threading
+
 from django.dispatch import receiver, Signal
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
 
-from . import models
+from . import calculation, closure, history, models, payload, refdata, telemetry, utils
 
 
 def loaded_from_fixture(kwargs):
@@ -14,62 +18,97 @@ def loaded_from_fixture(kwargs):
 testlist_complete = Signal(providing_args=["instance", "created"])
 
 
-def update_last_instances(test_list_instance):
+def update_last_instances(test_list_instance, created=False, valid=None, deleted=False):
+    """
+    Set the last instance & due date of all unit test collections on the
+    unit of `test_list_instance` which include its test list and the last
+    valid instance of its own unit test collection.
+
+    When a new, complete test list instance is `created` and it is the
+    latest, it is used as the last instance rather than requerying. `valid`
+    may be passed when it is known whether all of its test instances have
+    valid statuses (see `UnitTestCollection.calc_last_valid_instance`).
+    """
+
     try:
-        last_instance = models.TestListInstance.objects.complete().filter(
-            unit_test_collection=test_list_instance.unit_test_collection
-        ).latest("work_completed")
-    except models.TestListInstance.DoesNotExist:
-        last_instance = None
+        utc = test_list_instance.unit_test_collection
     except models.UnitTestCollection.DoesNotExist:
         # this will occur when a UnitTestCollection deletion cascades and
         # deletes all test_list_instances associated with it.
         # in that case it doesn't make sense to try to update anything
         return
 
-    cycle_ids = models.TestListCycle.objects.filter(
-        test_lists=test_list_instance.test_list
-    ).values_list("pk", flat=True)
-    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
+    previous = utc.last_instance if created else None
+    is_latest = (
+        created and
+        not test_list_instance.in_progress and
+        test_list_instance.work_completed is not None and
+        (previous is None or previous.work_completed <= test_list_instance.work_completed)
+    )
 
-    test_list_ids = [test_list_instance.test_list.pk]
+    if is_latest:
+        last_instance = test_list_instance
+    else:
+        try:
+            last_instance = models.TestListInstance.objects.complete().filter(
+                unit_test_collection=utc,
+            ).latest("work_completed")
+        except models.TestListInstance.DoesNotExist:
+            last_instance = None
+
+    last_valid = utc.calc_last_valid_instance(test_list_instance, valid=valid, deleted=deleted)
+
+    cycle_ids = models.TestListCycleMembership.objects.filter(
+        test_list_id=test_list_instance.test_list_id,
+    ).values("cycle_id")
+    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
     list_ct = ContentType.objects.get_for_model(models.TestList)
 
-    to_update = [(cycle_ct, cycle_ids), (list_ct, test_list_ids)]
-
-    for ct, object_ids in to_update:
-
-        utcs = models.UnitTestCollection.objects.filter(
-            content_type=ct,
-            object_id__in=object_ids,
-            unit=test_list_instance.unit_test_collection.unit,
-        )
-
-        for utc in utcs:
+    utcs = models.UnitTestCollection.objects.filter(
+        Q(content_type=cycle_ct, object_id__in=cycle_ids) |
+        Q(content_type=list_ct, object_id=test_list_instance.test_list_id),
+        unit_id=utc.unit_id,
+    ).select_related("frequency", "last_valid_instance")
+
+    to_update = []
+    for other in utcs:
+        other.last_instance = last_instance
+        if other.pk == utc.pk:
+            other.last_valid_instance = last_valid
+        other.due_date = other.calc_due_date()
+        to_update.append(other)
+
+        if other.pk == utc.pk:
             utc.last_instance = last_instance
-            due_date = utc.calc_due_date()
+            utc.last_valid_instance = last_valid
+            utc.due_date = other.due_date
 
-            # Use update here rather than just calling utc.save()
-            # since utc.save kicks off a bunch of other db queries
-            # due to the UnitTestCollection post_save signal
-            models.UnitTestCollection.objects.filter(pk=utc.pk).update(
-                due_date=due_date,
-                last_instance=last_instance,
-            )
+    # Use update here rather than just calling utc.save() since utc.save
+    # kicks off a bunch of other db queries due to the UnitTestCollection
+    # post_save signal. Note all of the values may be null (e.g. no frequency
+    # or the only instance was deleted)
+    utils.bulk_update(to_update, ["due_date", "last_instance", "last_valid_instance"])
 
 
-def get_or_create_unit_test_info(unit, test, assigned_to=None, active=True):
+_deferred = threading.local()
 
-    uti, created = models.UnitTestInfo.objects.get_or_create(
-        unit=unit,
-        test=test,
-    )
 
-    if created:
-        uti.assigned_to = assigned_to
-        uti.active = active
-        uti.save()
-    return uti
+@contextlib.contextmanager
+def last_instance_updates_deferred():
+    """
+    Don't update last instances & due dates when test list instances are
+    saved (e.g. while its test instances are still being created or
+    re-statused). The caller is responsible for calling
+    `update_last_instances`. Note test instance saves never update their
+    collection.
+    """
+
+    previous = getattr(_deferred, "active", False)
+    _deferred.active = True
+    try:
+        yield
+    finally:
+        _deferred.active = previous
 
 
 def find_assigned_unit_test_collections(collection):
@@ -77,56 +116,51 @@ def find_assigned_unit_test_collections(collection):
     the units that it is a part of
     """
 
-    all_parents = {
-        ContentType.objects.get_for_model(collection): [collection],
-    }
-
-    parent_types = [x._meta.model_name + "_set" for x in models.TestCollectionInterface.__subclasses__()]
+    if isinstance(collection, models.TestList):
+        utcs = models.UnitTestCollection.objects.containing(test_list=collection)
+    else:
+        utcs = models.UnitTestCollection.objects.filter(
+            content_type=ContentType.objects.get_for_model(collection),
+            object_id=collection.pk,
+        )
 
-    for parent_type in parent_types:
+    return list(utcs)
 
-        if hasattr(collection, parent_type):
-            parents = getattr(collection, parent_type).all()
-            if parents.count() > 0:
-                ct = ContentType.objects.get_for_model(parents[0])
-                try:
-                    all_parents[ct].extend(list(parents))
-                except KeyError:
-                    all_parents[ct] = list(parents)
 
-    assigned_utcs = []
-    for ct, objects in list(all_parents.items()):
-        utcs = models.UnitTestCollection.objects.filter(
-            object_id__in=[x.pk for x in objects],
-            content_type=ct,
-        ).select_related("unit", "assigned_to")
-        assigned_utcs.extend(utcs)
-    return list(set(assigned_utcs))
+def update_unit_test_infos(collection, utcs=None):
+    """find out which units this test_list is assigned to (or use `utcs`) and
+    make sure there are UnitTestInfo's for each Unit, Test pair"""
 
+    if utcs is None:
+        utcs = find_assigned_unit_test_collections(collection)
 
-def update_unit_test_infos(collection):
-    """find out which units this test_list is assigned to and make
-    sure there are UnitTestInfo's for each Unit, Test pair"""
+    if not utcs:
+        return
 
-    all_tests = collection.all_tests()
+    test_ids = set(closure.for_collection(collection).values_list("test_id", flat=True))
+    unit_ids = set(utc.unit_id for utc in utcs)
 
-    assigned_utcs = find_assigned_unit_test_collections(collection)
+    existing = set(models.UnitTestInfo.objects.filter(
+        unit_id__in=unit_ids,
+        test_id__in=test_ids,
+    ).values_list("unit_id", "test_id"))
 
-    for utc in assigned_utcs:
-        existing_uti_units = models.UnitTestInfo.objects.filter(
-            unit=utc.unit,
-            test__in=all_tests,
-        ).select_related("test")
+    missing = []
+    for utc in utcs:
+        for test_id in sorted(test_ids):
+            if (utc.unit_id, test_id) not in existing:
+                existing.add((utc.unit_id, test_id))
+                missing.append(models.UnitTestInfo(
+                    unit_id=utc.unit_id,
+                    test_id=test_id,
+                    assigned_to_id=utc.assigned_to_id,
+                    active=True,
+                ))
 
-        existing_tests = [x.test for x in existing_uti_units]
-        missing_utis = [x for x in all_tests if x not in existing_tests]
-        for test in missing_utis:
-            get_or_create_unit_test_info(
-                unit=utc.unit,
-                test=test,
-                assigned_to=utc.assigned_to,
-                active=True
-            )
+    if missing:
+        models.UnitTestInfo.objects.bulk_create(missing, batch_size=500)
+        # bulk_create doesn't send post_save
+        payload.invalidate()
 
 
 @receiver(pre_save, sender=models.Test)
@@ -135,14 +169,26 @@ def on_test_save(*args, **kwargs):
     if not loaded_from_fixture(kwargs):
 
         test = kwargs["instance"]
-        if test.type is not models.BOOLEAN:
+        if test.type != models.BOOLEAN or test.pk is None:
             return
 
-        unit_assignments = models.UnitTestInfo.objects.filter(test=test)
+        ua = models.UnitTestInfo.objects.filter(
+            test=test,
+            reference__isnull=False,
+        ).exclude(
+            reference__value__in=(0., 1.),
+        ).select_related("unit").first()
+
+        if ua is not None:
+            raise ValidationError("Can't change test type to %s while this test is still assigned to %s with a non-boolean reference" % (test.type, ua.unit.name))
+
 
-        for ua in unit_assignments:
-            if ua.reference and ua.reference.value not in (0., 1.,):
-                raise ValidationError("Can't change test type to %s while this test is still assigned to %s with a non-boolean reference" % (test.type, ua.unit.name))
+@receiver(post_save, sender=models.Test)
+@receiver(post_delete, sender=models.Test)
+def on_test_changed(*args, **kwargs):
+    """Drop any compiled calculation procedures & cached histories for this test"""
+    calculation.procedure_cache.invalidate(kwargs["instance"].pk)
+    history.invalidate_all()
 
 
 @receiver(post_save, sender=models.TestListInstance)
@@ -150,13 +196,16 @@ def on_test_list_instance_saved(*args, **kwargs):
     """set last instance for UnitTestInfo"""
 
     if not loaded_from_fixture(kwargs):
-        update_last_instances(kwargs["instance"])
+        if not getattr(_deferred, "active", False):
+            update_last_instances(kwargs["instance"], created=kwargs["created"])
+        history.invalidate(kwargs["instance"].unit_test_collection_id)
 
 
 @receiver(post_delete, sender=models.TestListInstance)
 def on_test_list_instance_deleted(*args, **kwargs):
     """update last_instance if available"""
-    update_last_instances(kwargs["instance"])
+    update_last_instances(kwargs["instance"], deleted=True)
+    history.invalidate(kwargs["instance"].unit_test_collection_id)
 
 
 @receiver(post_save, sender=models.UnitTestCollection)
@@ -165,7 +214,7 @@ def list_assigned_to_unit(*args, **kwargs):
     if not loaded_from_fixture(kwargs):
         utc = kwargs["instance"]
         tests_object = utc.content_type.get_object_for_this_type(pk=utc.object_id)
-        update_unit_test_infos(tests_object)
+        update_unit_test_infos(tests_object, utcs=[utc])
 
 
 @receiver(post_save, sender=models.TestListMembership)
@@ -174,22 +223,114 @@ def test_added_to_list(*args, **kwargs):
     Test was added to a list (or sublist). Find all units this list
     is performed on and create UnitTestInfo for the Unit, Test pair.
     """
+    closure.rebuild_for_list(kwargs["instance"].test_list)
     if (not loaded_from_fixture(kwargs)):
         update_unit_test_infos(kwargs["instance"].test_list)
 
 
+@receiver(post_delete, sender=models.TestListMembership)
+def test_removed_from_list(*args, **kwargs):
+    """Test was removed from a list. Remove it from all collections containing the list"""
+    tlm = kwargs["instance"]
+    closure.remove_membership(tlm.test_list_id, tlm.test_id)
+
+
 @receiver(post_save, sender=models.TestList)
 def test_list_saved(*args, **kwargs):
     """TestList was saved. Recreate any UTI's that may have been deleted in past"""
+    closure.rebuild_for_list(kwargs["instance"])
     if not loaded_from_fixture(kwargs):
         update_unit_test_infos(kwargs["instance"])
 
 
+@receiver(m2m_changed, sender=models.TestList.sublists.through)
+def sublists_changed(*args, **kwargs):
+    """Sublists were added to or removed from a list"""
+
+    if not kwargs["action"].startswith("post_"):
+        return
+
+    if not kwargs["reverse"]:
+        closure.rebuild_for_list(kwargs["instance"])
+        if kwargs["action"] == "post_add":
+            update_unit_test_infos(kwargs["instance"])
+    elif kwargs["pk_set"]:
+        for test_list in models.TestList.objects.filter(pk__in=kwargs["pk_set"]):
+            closure.rebuild_for_list(test_list)
+    else:
+        # list was removed from all of its parents
+        closure.rebuild_all()
+
+
+@receiver(post_delete, sender=models.TestList)
+@receiver(post_delete, sender=models.TestListCycle)
+def test_collection_deleted(*args, **kwargs):
+    closure.remove(kwargs["instance"])
+
+
 @receiver(post_save, sender=models.TestListCycleMembership)
 def test_list_added_to_cycle(*args, **kwargs):
     """
     Test List was added to a cycle . Find all units this list
     is performed on and create UnitTestInfo for the Unit, Test pair.
     """
+    closure.rebuild(kwargs["instance"].cycle)
     if (not loaded_from_fixture(kwargs)):
         update_unit_test_infos(kwargs["instance"].test_list)
+
+
+@receiver(post_delete, sender=models.TestListCycleMembership)
+def test_list_removed_from_cycle(*args, **kwargs):
+    tlcm = kwargs["instance"]
+    closure.remove_cycle_membership(tlcm.cycle_id, tlcm.test_list_id)
+
+
+@receiver(post_save, sender=models.ProcedureStats)
+def on_procedure_stats_changed(*args, **kwargs):
+    """pick up changes to which tests are being profiled"""
+    telemetry.reset_profiled_tests()
+
+
+@receiver(post_save, sender=models.TestInstanceStatus)
+@receiver(post_delete, sender=models.TestInstanceStatus)
+@receiver(post_save, sender=models.AutoReviewRule)
+@receiver(post_delete, sender=models.AutoReviewRule)
+@receiver(post_save, sender=models.Tolerance)
+@receiver(post_delete, sender=models.Tolerance)
+def on_reference_data_changed(*args, **kwargs):
+    """drop any cached statuses, auto review rules & tolerance choices"""
+    refdata.invalidate()
+    history.invalidate_all()
+
+
+@receiver(post_save, sender=models.Reference)
+@receiver(post_delete, sender=models.Reference)
+def on_reference_changed(*args, **kwargs):
+    """references are displayed in test histories"""
+    history.invalidate_all()
+
+
+@receiver(post_save, sender=models.Test)
+@receiver(post_delete, sender=models.Test)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.TestList)
+@receiver(post_delete, sender=models.TestList)
+@receiver(post_save, sender=models.TestListMembership)
+@receiver(post_delete, sender=models.TestListMembership)
+@receiver(post_save, sender=models.TestListCycle)
+@receiver(post_delete, sender=models.TestListCycle)
+@receiver(post_save, sender=models.TestListCycleMembership)
+@receiver(post_delete, sender=models.TestListCycleMembership)
+@receiver(post_save, sender=models.UnitTestInfo)
+@receiver(post_delete, sender=models.UnitTestInfo)
+@receiver(post_save, sender=models.UnitTestCollection)
+@receiver(post_delete, sender=models.UnitTestCollection)
+@receiver(post_save, sender=models.Reference)
+@receiver(post_delete, sender=models.Reference)
+@receiver(post_save, sender=models.Tolerance)
+@receiver(post_delete, sender=models.Tolerance)
+@receiver(m2m_changed, sender=models.TestList.sublists.through)
+def on_perform_data_changed(*args, **kwargs):
+    """drop cached perform payloads (see qa.payload)"""
+    payload.invalidate()
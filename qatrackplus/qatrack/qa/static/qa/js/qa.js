@@ -2,6 +2,10 @@
 
 var csrf_token = $("input[name=csrfmiddlewaretoken]").val();
 
+// number of times to check the status of an upload being processed in the
+// background before giving up (~5 minutes with backoff)
+var UPLOAD_POLL_MAX_ATTEMPTS = 15;
+
 function csrfSafeMethod(method) {
     // these HTTP methods do not require CSRF protection
     return (/^(GET|HEAD|OPTIONS|TRACE)$/.test(method));
@@ -389,25 +393,9 @@ function TestInstance(test_info, row){
                     url: QAURLs.UPLOAD_URL,
                     data: $.param(data),
                     dataType:"json",
-                    success: function (result) {
-                        self.status.removeClass("btn-info btn-primary btn-danger btn-success");
-                        if (result.errors.length > 0){
-                            self.set_value(null);
-                            self.status.addClass("btn-danger").text("Failed");
-                            self.status.attr("title",result.errors[0]);
-                        }else{
-                            self.set_value(result);
-                            self.status.addClass("btn-success").text("Success");
-                            self.status.attr("title",result['url']);
-                            $.Topic("valueChanged").publish();
-                        }
-                    },
+                    success: self.upload_complete,
                     traditional:true,
-                    error: function(e,data){
-                        self.set_value(null);
-                        self.status.removeClass("btn-primary btn-danger btn-success");
-                        self.status.addClass("btn-danger").text("Server Error");
-                    }
+                    error: self.upload_error
                 });
             }
 
@@ -521,32 +509,62 @@ function TestInstance(test_info, row){
             });
 
             self.dropzone.on('error', function(file, data) {
-                self.set_value(null);
-                self.status.removeClass("btn-primary btn-danger btn-success");
-                self.status.addClass("btn-danger").text("Server Error");
+                self.upload_error();
             });
 
             self.dropzone.on('success', function(file, data) {
-
-                var response_data = JSON.parse(data);
-                self.status.removeClass("btn-primary btn-info btn-warning btn-danger btn-success");
-                if (response_data.errors.length > 0) {
-                    self.set_value(null);
-                    self.status.addClass("btn-danger").text("Failed");
-                    self.status.attr("title", response_data.errors[0]);
-                } else {
-                    self.set_value(response_data);
-                    self.status.addClass("btn-success").text("Success");
-                    self.status.attr("title", response_data.url);
-
-                    $.Topic("valueChanged").publish();
-                }
+                self.upload_complete(JSON.parse(data));
             });
 
         });
 
     }
 
+    this.upload_complete = function(result, textStatus, jqXHR, attempt){
+
+        self.status.removeClass("btn-primary btn-info btn-warning btn-danger btn-success");
+
+        if (result.pending){
+            // upload is being processed in the background. Poll for results,
+            // backing off from 1s up to 30s between requests
+            attempt = attempt || 0;
+            if (attempt >= UPLOAD_POLL_MAX_ATTEMPTS){
+                self.set_value(null);
+                self.status.addClass("btn-danger").text("Timed Out");
+                self.status.attr("title", "Upload was not processed in time. Please try again.");
+                return;
+            }
+            self.status.addClass("btn-warning").text("Processing");
+            setTimeout(function(){
+                $.ajax({
+                    type: "GET",
+                    url: result.status_url,
+                    dataType: "json",
+                    success: function(data, textStatus, jqXHR){
+                        self.upload_complete(data, textStatus, jqXHR, attempt + 1);
+                    },
+                    error: self.upload_error
+                });
+            }, Math.min(1000*Math.pow(2, attempt), 30000));
+        } else if (result.errors.length > 0) {
+            self.set_value(null);
+            self.status.addClass("btn-danger").text("Failed");
+            self.status.attr("title", result.errors[0]);
+        } else {
+            self.set_value(result);
+            self.status.addClass("btn-success").text("Success");
+            self.status.attr("title", result.url);
+
+            $.Topic("valueChanged").publish();
+        }
+    };
+
+    this.upload_error = function(){
+        self.set_value(null);
+        self.status.removeClass("btn-primary btn-warning btn-danger btn-success");
+        self.status.addClass("btn-danger").text("Server Error");
+    };
+
     // set initial skip state
     this.skip.trigger("change");
 
@@ -613,6 +631,10 @@ function TestListInstance(){
     this.slugs = [];
     this.composites = [];
     this.composite_ids = [];
+    this.composite_slugs = [];
+
+    // data sent with the last composite calculation whose results were applied
+    this.last_composite_data = null;
 
     this.submit = $("#submit-qa");
 
@@ -628,6 +650,7 @@ function TestListInstance(){
         self.tests_by_slug = _.zipObject(self.slugs,self.test_instances);
         self.composites = _.filter(self.test_instances,function(ti){return ti.test_info.test.type === QAUtils.COMPOSITE || ti.test_info.test.type === QAUtils.STRING_COMPOSITE;});
         self.composite_ids = _.map(self.composites,function(ti){return ti.test_info.test.id;});
+        self.composite_slugs = _.map(self.composites,function(ti){return ti.test_info.test.slug;});
         self.attachInput.on("change", function(){
             var fnames = _.map(this.files, "name").join(", ");
             $("#tli-attachment-names").html(fnames);
@@ -658,7 +681,12 @@ function TestListInstance(){
             tols: tols
         };
 
-        var on_success = function(data, status, XHR){
+        var changed = self.changed_slugs(data);
+        if (changed !== null){
+            data.changed = changed;
+        }
+
+        var on_success = function(result_data, status, XHR){
 
             if (latest_composite_call !== XHR){
                 return;
@@ -666,8 +694,9 @@ function TestListInstance(){
 
             self.submit.attr("disabled", false);
 
-            if (data.success){
-                _.each(data.results,function(result, name){
+            if (result_data.success){
+                self.last_composite_data = data;
+                _.each(result_data.results,function(result, name){
                     var ti = self.tests_by_slug[name];
                     if (!ti.skipped){
                         ti.set_value(result.value, result.user_attached);
@@ -696,6 +725,28 @@ function TestListInstance(){
         });
     };
 
+    /* return slugs of non composite tests whose values have changed since
+     * the last successful composite calculation, or null if all composites
+     * need to be recalculated */
+    this.changed_slugs = function(data){
+
+        var last = self.last_composite_data;
+        if (last === null){
+            return null;
+        }
+
+        var context_changed = _.some(["meta", "refs", "tols"], function(key){
+            return JSON.stringify(last[key]) !== JSON.stringify(data[key]);
+        });
+        if (context_changed){
+            return null;
+        }
+
+        return _.filter(self.slugs, function(slug){
+            return !_.includes(self.composite_slugs, slug) && last.qavalues[slug] !== data.qavalues[slug];
+        });
+    };
+
     this.has_failing = function(){
         return _.filter(self.test_instances, function(ti){
                 return ti.test_status === QAUtils.ACTION
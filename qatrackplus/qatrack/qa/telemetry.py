@@ -0,0 +1,138 @@
+"""
+Execution time telemetry for calculation procedures.
+
+Execution statistics returned with each :class:`calculation.CalculationResult`
+are buffered in process and periodically merged into a rolling window of
+samples per test stored in :model:`qa.ProcedureStats`, along with
+percentiles used by the "slowest procedures" admin page.
+"""
+
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from qatrack.qa import models
+
+_lock = threading.Lock()
+_buffer = {}
+_profiles = {}
+_last_flush = time.time()
+
+_profiled = None
+_profiled_loaded = 0
+
+# how long the set of tests to be profiled is cached for (s)
+PROFILED_TESTS_TIMEOUT = 60
+
+
+def enabled():
+    return getattr(settings, "CALCULATION_STATS", True)
+
+
+def percentile(values, pct):
+    """return the pct'th percentile of a list of values (nearest rank)"""
+
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    idx = int(round(pct / 100. * (len(values) - 1)))
+    return values[idx]
+
+
+def record(results):
+    """buffer the execution stats of a list of :class:`calculation.CalculationResult`s"""
+
+    if not enabled():
+        return
+
+    with _lock:
+        for res in results:
+            if res.test_id is None or not res.stats:
+                continue
+            sample = (res.stats.get("wall"), res.stats.get("cpu"), res.stats.get("memory"), not res.success)
+            _buffer.setdefault(res.test_id, []).append(sample)
+            if res.profile:
+                _profiles[res.test_id] = res.profile
+
+        nsamples = sum(len(s) for s in _buffer.values())
+        due = nsamples >= getattr(settings, "CALCULATION_STATS_FLUSH_SIZE", 50)
+        due = due or time.time() - _last_flush >= getattr(settings, "CALCULATION_STATS_FLUSH_INTERVAL", 30)
+
+    if due:
+        flush()
+
+
+def flush():
+    """merge buffered samples into the :model:`qa.ProcedureStats` table"""
+
+    global _buffer, _profiles, _last_flush
+
+    with _lock:
+        buffered, profiles = _buffer, _profiles
+        _buffer, _profiles = {}, {}
+        _last_flush = time.time()
+
+    if not buffered:
+        return
+
+    window = getattr(settings, "CALCULATION_STATS_WINDOW", 200)
+    now = timezone.now()
+
+    with transaction.atomic():
+        existing = models.ProcedureStats.objects.select_for_update().filter(test_id__in=list(buffered.keys()))
+        existing = dict((ps.test_id, ps) for ps in existing)
+        valid_tests = set(models.Test.objects.filter(pk__in=list(buffered.keys())).values_list("pk", flat=True))
+
+        for test_id, new_samples in buffered.items():
+            if test_id not in valid_tests:
+                continue
+
+            ps = existing.get(test_id) or models.ProcedureStats(test_id=test_id)
+
+            samples = json.loads(ps.samples) + [list(s[:3]) for s in new_samples]
+            samples = samples[-window:]
+
+            ps.samples = json.dumps(samples)
+            ps.executions += len(new_samples)
+            ps.errors += sum(1 for s in new_samples if s[3])
+
+            walls = [s[0] for s in samples]
+            cpus = [s[1] for s in samples]
+            mems = [s[2] for s in samples]
+            ps.wall_p50 = percentile(walls, 50)
+            ps.wall_p95 = percentile(walls, 95)
+            ps.wall_max = percentile(walls, 100)
+            ps.cpu_p50 = percentile(cpus, 50)
+            ps.cpu_p95 = percentile(cpus, 95)
+            ps.memory_p95 = percentile(mems, 95)
+            ps.last_executed = now
+
+            if test_id in profiles:
+                ps.profile_report = profiles[test_id]
+                ps.profile_date = now
+
+            ps.save()
+
+
+def profiled_tests():
+    """return set of ids of tests whose procedures should be profiled"""
+
+    global _profiled, _profiled_loaded
+
+    if not enabled():
+        return set()
+
+    if _profiled is None or time.time() - _profiled_loaded > PROFILED_TESTS_TIMEOUT:
+        _profiled = set(models.ProcedureStats.objects.filter(profile=True).values_list("test_id", flat=True))
+        _profiled_loaded = time.time()
+
+    return _profiled
+
+
+def reset_profiled_tests():
+    global _profiled
+    _profiled = None
@@ -2,10 +2,32 @@ from qatrack.qa.tests.test_views import *  # NOQA
 from qatrack.qa.tests.test_models import *  # NOQA
 from qatrack.qa.tests.test_tags import *  # NOQA
 from qatrack.qa.tests.test_utils import *  # NOQA
+from qatrack.qa.tests.test_calculation import *  # NOQA
+from qatrack.qa.tests.test_recalculate import *  # NOQA
+from qatrack.qa.tests.test_telemetry import *  # NOQA
+from qatrack.qa.tests.test_passfail import *  # NOQA
+from qatrack.qa.tests.test_regrade import *  # NOQA
+from qatrack.qa.tests.test_refdata import *  # NOQA
+from qatrack.qa.tests.test_history import *  # NOQA
+from qatrack.qa.tests.test_payload import *  # NOQA
+from qatrack.qa.tests.test_closure import *  # NOQA
+from qatrack.qa.tests.test_ingest import *  # NOQA
+from qatrack.qa.tests.test_scheduling import *  # NOQA
 
 __test__ = {
     "views": ["test_views"],
     "models": ["test_models"],
     "utils": ["test_utils"],
     "tags": ["test_tags"],
+    "calculation": ["test_calculation"],
+    "recalculate": ["test_recalculate"],
+    "telemetry": ["test_telemetry"],
+    "passfail": ["test_passfail"],
+    "regrade": ["test_regrade"],
+    "refdata": ["test_refdata"],
+    "history": ["test_history"],
+    "payload": ["test_payload"],
+    "closure": ["test_closure"],
+    "ingest": ["test_ingest"],
+    "scheduling": ["test_scheduling"],
 }
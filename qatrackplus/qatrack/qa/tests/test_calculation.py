@@ -0,0 +1,297 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from qatrack.qa import calculation, models, sandbox
+from . import utils
+
+
+class TestProcessProcedure(TestCase):
+
+    def test_new_style_division(self):
+        proc = calculation.process_procedure("result = 1/2")
+        self.assertTrue(proc.startswith("from __future__ import division"))
+
+    def test_line_endings(self):
+        self.assertNotIn("\r", calculation.process_procedure("a = 1\r\nresult = a"))
+
+
+class TestProcedureCache(TestCase):
+
+    def setUp(self):
+        self.cache = calculation.ProcedureCache()
+
+    def test_miss_then_hit(self):
+        code1 = self.cache.get(1, "result = 1")
+        code2 = self.cache.get(1, "result = 1")
+        self.assertIs(code1, code2)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_changed_procedure_recompiled(self):
+        code1 = self.cache.get(1, "result = 1")
+        code2 = self.cache.get(1, "result = 2")
+        self.assertIsNot(code1, code2)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_invalidate(self):
+        self.cache.get(1, "result = 1")
+        self.cache.get(2, "result = 1")
+        self.cache.invalidate(1)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_syntax_error_not_cached(self):
+        with self.assertRaises(SyntaxError):
+            self.cache.get(1, "result = (")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_executes(self):
+        context = {"a": 2}
+        exec(self.cache.get(1, "result = a/4"), context)
+        self.assertEqual(context["result"], 0.5)
+
+    def test_invalidated_on_test_save(self):
+        test = utils.create_test(name="testc", test_type=models.COMPOSITE)
+        test.calculation_procedure = "result = 1"
+        test.save()
+        calculation.compile_procedure(test.pk, test.calculation_procedure)
+        self.assertIn(test.pk, [k[0] for k in calculation.procedure_cache._code])
+        test.save()
+        self.assertNotIn(test.pk, [k[0] for k in calculation.procedure_cache._code])
+
+
+class TestExecuteProcedures(TestCase):
+
+    def test_dependent_procedures(self):
+        procs = [("a", 1, "result = 2"), ("b", 2, "b = a*3")]
+        results = list(calculation.execute_procedures(procs, {}))
+        self.assertEqual([r.value for r in results], [2, 6])
+
+    def test_error(self):
+        res = list(calculation.execute_procedures([("a", 1, "result = 1/0")], {}))[0]
+        self.assertFalse(res.success)
+        self.assertFalse(res.fatal)
+
+    def test_write_file(self):
+        res = list(calculation.execute_procedures([("a", 1, "write_file('foo.txt', 'bar'); result = 1")], {}))[0]
+        self.assertEqual(res.files, [("foo.txt", b"bar")])
+
+    def test_write_figure(self):
+        proc = "fig = Figure(); fig.add_subplot(111).plot([0, 1]); write_file('plot.png'); result = 1"
+        res = list(calculation.execute_procedures([("a", 1, proc)], {}))[0]
+        self.assertTrue(res.success)
+        fname, data = res.files[0]
+        self.assertEqual(fname, "plot.png")
+        self.assertTrue(data.startswith(b"\x89PNG"))
+
+    def test_write_file_without_figure(self):
+        res = list(calculation.execute_procedures([("a", 1, "write_file('plot.png')")], {}))[0]
+        self.assertFalse(res.success)
+
+    def test_figures_not_shared(self):
+        procs = [("a", 1, "a = Figure()"), ("b", 2, "b = Figure() is not a")]
+        context = {}
+        results = list(calculation.execute_procedures(procs, context))
+        self.assertTrue(results[1].value)
+        self.assertNotIn("Figure", context)
+
+
+class TestFigureFactory(TestCase):
+
+    def test_pyplot_untouched(self):
+        import matplotlib.pyplot as plt
+        nfigs = len(plt.get_fignums())
+        figures = calculation.FigureFactory()
+        fig = figures(figsize=(2, 2))
+        self.assertIs(figures.current, fig)
+        self.assertEqual(len(plt.get_fignums()), nfigs)
+        figures.close()
+        self.assertIsNone(figures.current)
+
+
+class TestCalculationPool(TestCase):
+
+    def setUp(self):
+        self.pool = sandbox.CalculationPool(1, timeout=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_results(self):
+        procs = [("a", 1, "result = 2"), ("b", 2, "b = a*3")]
+        context = {}
+        results = self.pool.run(procs, context)
+        self.assertEqual([r.value for r in results], [2, 6])
+        self.assertEqual(context["b"], 6)
+
+    def test_timeout(self):
+        procs = [("a", 1, "while True: pass"), ("b", 2, "result = 1")]
+        a, b = self.pool.run(procs, {})
+        self.assertTrue(a.fatal)
+        self.assertIn("timed out", a.error)
+        self.assertEqual(b.value, 1)
+
+    def test_worker_replaced_after_timeout(self):
+        self.pool.run([("a", 1, "while True: pass")], {})
+        res = self.pool.run([("a", 1, "result = 3")], {})[0]
+        self.assertEqual(res.value, 3)
+
+    def test_worker_died(self):
+        res = self.pool.run([("a", 1, "import os; os._exit(1)")], {})[0]
+        self.assertTrue(res.fatal)
+        self.assertEqual(self.pool.run([("a", 1, "result = 3")], {})[0].value, 3)
+
+    def test_no_idle_worker(self):
+        self.pool.start()
+        worker = self.pool._idle.get()
+        try:
+            res = self.pool.run([("a", 1, "result = 3")], {})[0]
+        finally:
+            self.pool._idle.put(worker)
+        self.assertTrue(res.fatal)
+        self.assertIn("timed out", res.error)
+
+
+class TestRunLayers(TestCase):
+
+    layers = [
+        [("a", 1, "result = 1"), ("b", 2, "result = 2"), ("c", 3, "result = 3")],
+        [("d", 4, "result = a + b + c")],
+    ]
+
+    @override_settings(CALCULATION_POOL_SIZE=2, CALCULATION_PARALLEL=True)
+    def test_parallel(self):
+        context = {}
+        results = sandbox.run_layers(self.layers, context)
+        self.assertEqual(sorted((r.slug, r.value) for r in results), [("a", 1), ("b", 2), ("c", 3), ("d", 6)])
+        self.assertEqual(context["d"], 6)
+
+    @override_settings(CALCULATION_POOL_SIZE=0)
+    def test_in_process(self):
+        results = sandbox.run_layers(self.layers, {})
+        self.assertEqual([r.value for r in results], [1, 2, 3, 6])
+
+
+class TestResultCacheKey(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b"data")
+        os.close(fd)
+        self.context = {"META": {"unit_number": 1}, "REFS": {}, "TOLS": {}}
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def key(self, procedure="result = 1"):
+        return calculation.result_cache_key(1, procedure, self.path, self.context)
+
+    def test_stable(self):
+        self.assertEqual(self.key(), self.key())
+
+    def test_procedure_changed(self):
+        self.assertNotEqual(self.key(), self.key("result = 2"))
+
+    def test_file_changed(self):
+        key = self.key()
+        with open(self.path, "wb") as f:
+            f.write(b"other data")
+        self.assertNotEqual(key, self.key())
+
+    def test_meta_changed(self):
+        key = self.key()
+        self.context["META"]["unit_number"] = 2
+        self.assertNotEqual(key, self.key())
+
+    def test_failures_not_cached(self):
+        calculation.cache_result("failed-key", calculation.CalculationResult("a", error="err"))
+        self.assertIsNone(calculation.get_cached_result("failed-key"))
+
+
+class TestUploadedFile(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, bytes(range(16)))
+        os.close(fd)
+        self.upload = calculation.UploadedFile(self.path)
+
+    def tearDown(self):
+        self.upload.close()
+        os.remove(self.path)
+
+    def test_mmap(self):
+        self.assertEqual(self.upload.mmap[:4], bytes(range(4)))
+
+    def test_mmap_read_only(self):
+        with self.assertRaises(TypeError):
+            self.upload.mmap[0] = 1
+
+    def test_memmap(self):
+        data = self.upload.memmap(dtype="uint8", offset=4, shape=(2, 2))
+        self.assertEqual(data[1, 1], 7)
+
+    def test_in_context(self):
+        proc = [("a", 1, "result = len(UPLOAD.mmap) + len(FILE_PATH)")]
+        res = list(calculation.execute_procedures(proc, {}, file_path=self.path))[0]
+        self.assertEqual(res.value, 16 + len(self.path))
+
+    def test_files_lazy(self):
+        self.assertEqual(self.upload._files, {})
+        self.assertEqual(self.upload.bin_file.read(4), bytes(range(4)))
+        handle = self.upload._files["rb"]
+        self.assertNotIn("r", self.upload._files)
+        self.upload.close()
+        self.assertTrue(handle.closed)
+
+    def test_bin_file_in_context(self):
+        proc = [("a", 1, "result = len(BIN_FILE.read())")]
+        context = {}
+        res = list(calculation.execute_procedures(proc, context, file_path=self.path))[0]
+        self.assertEqual(res.value, 16)
+        self.assertEqual(context["UPLOAD"]._files, {})
+
+
+class TestParsedFileCache(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b"0123456789")
+        os.close(fd)
+        self.cache = calculation.ParsedFileCache(max_entries=2, max_size=1, timeout=60)
+        self.calls = 0
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def parser(self, path, n=None):
+        self.calls += 1
+        with open(path, "rb") as f:
+            return f.read(n)
+
+    def test_hit(self):
+        self.cache.get(self.path, self.parser)
+        self.assertEqual(self.cache.get(self.path, self.parser), b"0123456789")
+        self.assertEqual(self.calls, 1)
+
+    def test_args_in_key(self):
+        self.cache.get(self.path, self.parser, 2)
+        self.assertEqual(self.cache.get(self.path, self.parser, 3), b"012")
+        self.assertEqual(self.calls, 2)
+
+    def test_max_entries(self):
+        for n in range(4):
+            self.cache.get(self.path, self.parser, n)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_timeout(self):
+        self.cache.timeout = 0
+        self.cache.get(self.path, self.parser)
+        self.cache.get(self.path, self.parser)
+        self.assertEqual(self.calls, 2)
+
+    def test_file_modified(self):
+        self.cache.get(self.path, self.parser)
+        with open(self.path, "ab") as f:
+            f.write(b"more")
+        self.assertEqual(self.cache.get(self.path, self.parser), b"0123456789more")
@@ -0,0 +1,129 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from qatrack.qa import closure, models
+from . import utils
+
+
+class TestClosure(TestCase):
+
+    def setUp(self):
+        self.tl = utils.create_test_list(name="parent")
+        self.sublist = utils.create_test_list(name="sublist")
+        self.t1 = utils.create_test(name="t1")
+        self.t2 = utils.create_test(name="t2")
+        self.t3 = utils.create_test(name="t3")
+        utils.create_test_list_membership(self.tl, self.t2, order=0)
+        utils.create_test_list_membership(self.tl, self.t1, order=1)
+        utils.create_test_list_membership(self.sublist, self.t3, order=0)
+        self.tl.sublists.add(self.sublist)
+
+    def test_ordered_with_sublist(self):
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1, self.t3])
+
+    def test_ordered_tests_single_query(self):
+        with self.assertNumQueries(1):
+            self.tl.ordered_tests()
+
+    def test_via(self):
+        rows = closure.for_collection(self.tl).order_by("order")
+        self.assertListEqual(
+            [(r.test_list_id, r.test_id) for r in rows],
+            [(self.tl.pk, self.t2.pk), (self.tl.pk, self.t1.pk), (self.sublist.pk, self.t3.pk)],
+        )
+
+    def test_reordered(self):
+        models.TestListMembership.objects.filter(test_list=self.tl, test=self.t1).update(order=-1)
+        closure.rebuild(self.tl)
+        self.assertListEqual(self.tl.ordered_tests(), [self.t1, self.t2, self.t3])
+
+    def test_sublist_membership_added(self):
+        t4 = utils.create_test(name="t4")
+        utils.create_test_list_membership(self.sublist, t4, order=1)
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1, self.t3, t4])
+
+    def test_membership_removed(self):
+        models.TestListMembership.objects.get(test_list=self.tl, test=self.t2).delete()
+        self.assertListEqual(self.tl.ordered_tests(), [self.t1, self.t3])
+
+    def test_sublist_removed(self):
+        self.tl.sublists.remove(self.sublist)
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1])
+
+    def test_sublist_removed_reverse(self):
+        self.sublist.testlist_set.clear()
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1])
+
+    def test_test_deleted(self):
+        self.t3.delete()
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1])
+
+    def test_sublist_deleted(self):
+        self.sublist.delete()
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1])
+
+    def test_list_deleted(self):
+        tl_pk = self.tl.pk
+        self.tl.delete()
+        ct = ContentType.objects.get_for_model(models.TestList)
+        self.assertFalse(models.TestCollectionClosure.objects.filter(content_type=ct, object_id=tl_pk).exists())
+
+    def test_cycle(self):
+        other = utils.create_test_list(name="other")
+        utils.create_test_list_membership(other, self.t1)
+        cycle = utils.create_cycle(test_lists=[self.tl, other])
+        self.assertListEqual(cycle.ordered_tests(), [self.t2, self.t1, self.t3])
+        self.assertSetEqual(set(cycle.all_tests()), set([self.t1, self.t2, self.t3]))
+
+    def test_cycle_membership_removed(self):
+        other = utils.create_test_list(name="other")
+        t4 = utils.create_test(name="t4")
+        utils.create_test_list_membership(other, t4)
+        cycle = utils.create_cycle(test_lists=[self.tl, other])
+        models.TestListCycleMembership.objects.get(cycle=cycle, test_list=self.tl).delete()
+        self.assertListEqual(cycle.ordered_tests(), [t4])
+
+    def test_cycle_updated_with_list(self):
+        cycle = utils.create_cycle(test_lists=[self.tl])
+        t4 = utils.create_test(name="t4")
+        utils.create_test_list_membership(self.sublist, t4, order=1)
+        self.assertListEqual(cycle.ordered_tests(), [self.t2, self.t1, self.t3, t4])
+
+    def test_rebuild_all(self):
+        models.TestCollectionClosure.objects.all().delete()
+        closure.rebuild_all()
+        self.assertListEqual(self.tl.ordered_tests(), [self.t2, self.t1, self.t3])
+        self.assertListEqual(self.sublist.ordered_tests(), [self.t3])
+
+    def test_containing(self):
+        utc = utils.create_unit_test_collection(test_collection=self.tl)
+        cycle = utils.create_cycle(test_lists=[self.sublist])
+        cycle_utc = utils.create_unit_test_collection(test_collection=cycle, unit=utc.unit)
+        other_utc = utils.create_unit_test_collection(test_collection=utils.create_test_list(name="other"), unit=utc.unit)
+
+        containing = models.UnitTestCollection.objects.containing
+        self.assertSetEqual(set(containing(test=self.t3)), set([utc, cycle_utc]))
+        self.assertSetEqual(set(containing(test=self.t1)), set([utc]))
+        self.assertSetEqual(set(containing(test_list=self.sublist)), set([utc, cycle_utc]))
+        self.assertNotIn(other_utc, containing(test_list=self.tl))
+
+    def test_sublist_tests_get_unit_test_infos(self):
+        utc = utils.create_unit_test_collection(test_collection=self.tl)
+        t4 = utils.create_test(name="t4")
+        utils.create_test_list_membership(self.sublist, t4, order=1)
+        self.assertTrue(models.UnitTestInfo.objects.filter(unit=utc.unit, test=t4).exists())
+
+
+class TestGetUTCTestListIds(TestCase):
+
+    def test_lists_and_cycle_members(self):
+        tl = utils.create_test_list(name="tl")
+        cycle_tl = utils.create_test_list(name="cycle tl")
+        utils.create_test_list(name="unassigned")
+        utc = utils.create_unit_test_collection(test_collection=tl)
+        cycle = utils.create_cycle(test_lists=[cycle_tl])
+        utils.create_unit_test_collection(test_collection=cycle, unit=utc.unit, null_frequency=True)
+
+        self.assertSetEqual(set(models.get_utc_tl_ids()), set([tl.pk, cycle_tl.pk]))
+        self.assertSetEqual(set(models.get_utc_tl_ids(frequencies=[None])), set([cycle_tl.pk]))
+        self.assertSetEqual(set(models.get_utc_tl_ids(active=False)), set())
@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from qatrack.qa import history, models
+from qatrack.qa.views.base import history_depth
+from . import utils
+
+import mock
+
+HISTORY_CACHES = dict(settings.CACHES)
+HISTORY_CACHES[settings.HISTORY_CACHE] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+
+@override_settings(CACHES=HISTORY_CACHES)
+class TestHistoryCache(TestCase):
+
+    def setUp(self):
+        history.get_cache().clear()
+
+        self.utc = utils.create_unit_test_collection()
+        self.test = utils.create_test(name="tester")
+        utils.create_test_list_membership(self.utc.tests_object, self.test)
+        self.uti = models.UnitTestInfo.objects.get(test=self.test, unit=self.utc.unit)
+        self.status = utils.create_status()
+
+        self.tlis = []
+        for i in range(3):
+            self.add_instance()
+
+    def add_instance(self):
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc)
+        utils.create_test_instance(tli, unit_test_info=self.uti, status=self.status)
+        self.tlis.append(tli)
+        return tli
+
+    def lookups(self):
+        manager = models.TestInstance.objects
+        return mock.patch.object(manager, "history_lookup", wraps=manager.history_lookup)
+
+    def test_cache_is_used(self):
+        hist, dates = self.utc.history()
+        with self.lookups() as lookup:
+            hist2, dates2 = self.utc.history()
+        self.assertEqual(lookup.call_count, 0)
+        self.assertEqual(dates, dates2)
+        self.assertEqual([ti.pk for ti in hist[0][1]], [ti.pk for ti in hist2[0][1]])
+
+    def test_before_not_cached(self):
+        before = self.tlis[-1].work_completed
+        self.utc.history(before=before)
+        with self.lookups() as lookup:
+            self.utc.history(before=before)
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_invalidated_by_new_instance(self):
+        hist, dates = self.utc.history()
+        self.assertEqual(len(dates), 3)
+        self.add_instance()
+        hist, dates = self.utc.history()
+        self.assertEqual(len(dates), 4)
+
+    def test_invalidated_by_deleted_instance(self):
+        self.utc.history()
+        self.tlis[-1].delete()
+        hist, dates = self.utc.history()
+        self.assertEqual(len(dates), 2)
+
+    def test_invalidated_by_status_change(self):
+        hist, dates = self.utc.history()
+        new_status = utils.create_status(name="new", slug="new", is_default=False)
+        models.TestInstance.objects.update(status=new_status)
+        # queryset updates don't send signals so views invalidate explicitly
+        history.invalidate(self.utc.pk)
+        hist, dates = self.utc.history()
+        self.assertTrue(all(ti.status_id == new_status.pk for ti in hist[0][1]))
+
+    def test_not_invalidated_per_test_instance(self):
+        tli = self.tlis[-1]
+        with mock.patch.object(history, "invalidate") as invalidate:
+            for ti in tli.testinstance_set.all():
+                ti.save()
+            tli.save()
+        invalidate.assert_called_once_with(self.utc.pk)
+
+    def test_invalidate_all(self):
+        self.utc.history()
+        history.invalidate_all()
+        with self.lookups() as lookup:
+            self.utc.history()
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_number(self):
+        hist, dates = self.utc.history(number=2)
+        self.assertEqual(len(dates), 2)
+        hist, dates = self.utc.history(number=3)
+        self.assertEqual(len(dates), 3)
+
+    def test_test_list_instance_history(self):
+        tli = self.tlis[-1]
+        tli_hist, dates = tli.history()
+        self.assertEqual(len(dates), 2)
+        self.add_instance()
+        tli_hist, dates = tli.history()
+        self.assertEqual(len(dates), 2)
+
+
+class TestHistoryDepth(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_default(self):
+        self.assertEqual(history_depth(self.factory.get("/")), settings.NHIST)
+
+    def test_requested(self):
+        self.assertEqual(history_depth(self.factory.get("/", {"history": "10"})), 10)
+
+    def test_clamped(self):
+        self.assertEqual(history_depth(self.factory.get("/", {"history": "100000"})), settings.NHIST_MAX)
+        self.assertEqual(history_depth(self.factory.get("/", {"history": "-1"})), 1)
+
+    def test_invalid(self):
+        self.assertEqual(history_depth(self.factory.get("/", {"history": "abc"})), settings.NHIST)
@@ -0,0 +1,216 @@
+import base64
+import json
+
+from django.contrib.auth.models import Group
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from qatrack.qa import ingest, models, signals
+from . import utils
+
+import mock
+
+
+class TestIngest(TestCase):
+
+    def setUp(self):
+        self.status = utils.create_status()
+        self.user = utils.create_user()
+        self.group = Group.objects.create(name="foo")
+        self.user.groups.add(self.group)
+
+        self.test_list = utils.create_test_list()
+        self.simple = utils.create_test(name="simple")
+        self.boolean = utils.create_test(name="boolean", test_type=models.BOOLEAN)
+        self.string = utils.create_test(name="string", test_type=models.STRING)
+        for idx, test in enumerate([self.simple, self.boolean, self.string]):
+            utils.create_test_list_membership(self.test_list, test, idx)
+
+        self.utc = utils.create_unit_test_collection(test_collection=self.test_list)
+
+        uti = models.UnitTestInfo.objects.get(unit=self.utc.unit, test=self.simple)
+        uti.reference = utils.create_reference(value=1)
+        uti.tolerance = utils.create_tolerance()
+        uti.save()
+
+        self.work_started = timezone.now() - timezone.timedelta(hours=1)
+
+    def instance(self, **kwargs):
+        data = {
+            "unit_test_collection": self.utc.pk,
+            "work_started": self.work_started.isoformat(),
+            "tests": {
+                "simple": 2.5,
+                "boolean": True,
+                "string": {"string_value": "abc", "comment": "a comment"},
+            },
+        }
+        data.update(kwargs)
+        return data
+
+    def add_composite(self, name, test_type, procedure):
+        test = utils.create_test(name=name, test_type=test_type)
+        test.calculation_procedure = procedure
+        test.save()
+        utils.create_test_list_membership(self.test_list, test, models.Test.objects.count())
+        return test
+
+    def test_create(self):
+        results = ingest.ingest([self.instance(), self.instance()], self.user)
+
+        self.assertTrue(results["success"])
+        self.assertEqual(models.TestListInstance.objects.count(), 2)
+        self.assertEqual(models.TestInstance.objects.count(), 6)
+
+        tli = models.TestListInstance.objects.get(pk=results["objects"][0]["id"])
+        self.assertEqual(tli.test_list, self.test_list)
+        self.assertEqual(tli.created_by, self.user)
+
+        simple = tli.testinstance_set.get(unit_test_info__test=self.simple)
+        self.assertEqual(simple.value, 2.5)
+        self.assertEqual(simple.pass_fail, models.TOLERANCE)
+        self.assertAlmostEqual(simple.diff, 1.5)
+
+        string = tli.testinstance_set.get(unit_test_info__test=self.string)
+        self.assertEqual(string.string_value, "abc")
+        self.assertEqual(string.comment, "a comment")
+
+    def test_last_instance_updated(self):
+        older = self.instance(work_completed=(self.work_started + timezone.timedelta(minutes=5)).isoformat())
+        newer = self.instance(work_completed=(self.work_started + timezone.timedelta(minutes=10)).isoformat())
+        results = ingest.ingest([newer, older], self.user)
+
+        utc = models.UnitTestCollection.objects.get(pk=self.utc.pk)
+        self.assertEqual(utc.last_instance_id, results["objects"][0]["id"])
+        self.assertIsNotNone(utc.due_date)
+
+    def test_valid_then_invalid(self):
+        invalid = utils.create_status(name="invalid", slug="invalid", is_default=False)
+        invalid.valid = False
+        invalid.save()
+
+        valid = self.instance(work_completed=(self.work_started + timezone.timedelta(minutes=5)).isoformat())
+        newer = self.instance(
+            work_completed=(self.work_started + timezone.timedelta(minutes=10)).isoformat(),
+            status="invalid",
+        )
+        results = ingest.ingest([valid, newer], self.user)
+
+        utc = models.UnitTestCollection.objects.select_related("frequency", "last_valid_instance").get(pk=self.utc.pk)
+        self.assertEqual(utc.last_instance_id, results["objects"][1]["id"])
+        self.assertEqual(utc.last_valid_instance_id, results["objects"][0]["id"])
+        self.assertEqual(utc.due_date, utc.last_valid_instance.work_completed + utc.frequency.due_delta())
+
+    def test_grading_error(self):
+        uti = models.UnitTestInfo.objects.get(unit=self.utc.unit, test=self.simple)
+        uti.reference = utils.create_reference(name="zero", value=0)
+        uti.tolerance = utils.create_tolerance(tol_type=models.PERCENT)
+        uti.save()
+
+        results = ingest.ingest([self.instance()], self.user)
+
+        self.assertFalse(results["success"])
+        self.assertIn("simple", results["objects"][0]["errors"])
+        self.assertEqual(models.TestListInstance.objects.count(), 0)
+
+    def test_invalid_creates_nothing(self):
+        invalid = self.instance(tests={"simple": "abc", "boolean": 1, "string": "abc"})
+        results = ingest.ingest([self.instance(), invalid], self.user)
+
+        self.assertFalse(results["success"])
+        self.assertTrue(results["objects"][0]["success"])
+        self.assertIsNone(results["objects"][0]["id"])
+        self.assertIn("simple", results["objects"][1]["errors"])
+        self.assertEqual(models.TestListInstance.objects.count(), 0)
+
+    @override_settings(CALCULATION_POOL_SIZE=0)
+    def test_composites_calculated(self):
+        comp = self.add_composite("comp", models.COMPOSITE, "result = simple*2")
+        string_comp = self.add_composite("string_comp", models.STRING_COMPOSITE, "result = string + 'def'")
+
+        results = ingest.ingest([self.instance()], self.user)
+
+        self.assertTrue(results["success"])
+        tli = models.TestListInstance.objects.get(pk=results["objects"][0]["id"])
+        self.assertEqual(tli.testinstance_set.get(unit_test_info__test=comp).value, 5)
+        self.assertEqual(tli.testinstance_set.get(unit_test_info__test=string_comp).string_value, "abcdef")
+
+    @override_settings(CALCULATION_POOL_SIZE=0)
+    def test_failed_composite_skipped(self):
+        comp = self.add_composite("comp", models.COMPOSITE, "result = 1/0")
+
+        results = ingest.ingest([self.instance()], self.user)
+
+        self.assertTrue(results["success"])
+        ti = models.TestInstance.objects.get(unit_test_info__test=comp)
+        self.assertTrue(ti.skipped)
+        self.assertIsNone(ti.value)
+
+    def test_composite_value_rejected(self):
+        self.add_composite("comp", models.COMPOSITE, "result = simple*2")
+        data = self.instance()
+        data["tests"]["comp"] = 5
+        results = ingest.ingest([data], self.user)
+        self.assertIn("comp", results["objects"][0]["errors"])
+
+    def test_unknown_test(self):
+        data = self.instance()
+        data["tests"]["foo"] = 1
+        results = ingest.ingest([data], self.user)
+        self.assertIn("tests", results["objects"][0]["errors"])
+
+    def test_value_required(self):
+        data = self.instance()
+        del data["tests"]["simple"]
+        results = ingest.ingest([data], self.user)
+        self.assertIn("simple", results["objects"][0]["errors"])
+
+    def test_skip_requires_comment(self):
+        self.user.is_superuser = False
+        self.user.save()
+
+        data = self.instance()
+        data["tests"]["simple"] = {"skipped": True}
+        results = ingest.ingest([data], self.user)
+        self.assertFalse(results["success"])
+
+        data["tests"]["simple"] = {"skipped": True, "comment": "broken"}
+        results = ingest.ingest([data], self.user)
+        self.assertTrue(results["success"])
+
+    def test_invisible_utc(self):
+        self.utc.visible_to.clear()
+        results = ingest.ingest([self.instance()], self.user)
+        self.assertIn("unit_test_collection", results["objects"][0]["errors"])
+
+    def test_future_work_started(self):
+        future = timezone.now() + timezone.timedelta(hours=1)
+        results = ingest.ingest([self.instance(work_started=future.isoformat())], self.user)
+        self.assertIn("work_started", results["objects"][0]["errors"])
+
+    def test_unknown_status(self):
+        results = ingest.ingest([self.instance(status="foo")], self.user)
+        self.assertIn("status", results["objects"][0]["errors"])
+
+    def test_not_a_list(self):
+        results = ingest.ingest({"foo": "bar"}, self.user)
+        self.assertFalse(results["success"])
+
+    def test_complete_signal_sent_on_commit(self):
+        with mock.patch.object(ingest.transaction, "on_commit", lambda func: func()):
+            with mock.patch.object(signals.testlist_complete, "send") as send:
+                ingest.ingest([self.instance(), self.instance(in_progress=True)], self.user)
+
+        self.assertEqual(send.call_count, 1)
+
+    def test_api(self):
+        auth = base64.b64encode(b"user:password").decode("ascii")
+        response = self.client.post(
+            "/qa/api/v1/bulk_testlistinstances/",
+            data=json.dumps({"objects": [self.instance()]}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Basic %s" % auth,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(json.loads(response.content.decode("utf-8"))["success"])
+        self.assertEqual(models.TestListInstance.objects.count(), 1)
@@ -1,11 +1,13 @@
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase
 from django.test.utils import setup_test_environment
 from django.utils import timezone
+from django.utils.six import StringIO
 
-from qatrack.qa import models
+from qatrack.qa import closure, models, signals
 
 import mock
 from . import utils
@@ -183,6 +185,12 @@ class TestTest(TestCase):
         test = utils.create_test(name="bool", test_type=models.BOOLEAN)
         self.assertTrue(test.is_boolean())
 
+    def test_dependencies_set_on_save(self):
+        test = utils.create_test(name="comp", test_type=models.COMPOSITE)
+        test.calculation_procedure = "result = test1 + test2"
+        test.save()
+        self.assertSetEqual(models.Test.objects.get(pk=test.pk).get_dependencies(), set(["test1", "test2"]))
+
     def test_is_string(self):
         test = utils.create_test(name="bool", test_type=models.STRING)
         self.assertTrue(test.is_string())
@@ -362,6 +370,16 @@ class TestOnTestSaveSignal(TestCase):
         uti.test.type = models.BOOLEAN
         self.assertRaises(ValidationError, uti.test.save)
 
+    def test_boolean_references_allowed(self):
+        test = utils.create_test()
+        for value, number in ((0, 1), (1, 2)):
+            unit = utils.create_unit(name="unit%d" % number, number=number)
+            utils.create_unit_test_info(unit=unit, test=test, ref=utils.create_reference(value=value))
+
+        test.type = models.BOOLEAN
+        test.save()
+        self.assertEqual(models.Test.objects.get(pk=test.pk).type, models.BOOLEAN)
+
 
 class TestUnitTestInfo(TestCase):
 
@@ -786,6 +804,61 @@ class TestUTCDueDates(TestCase):
         utils.create_test_instance(tli, unit_test_info=uti, work_completed=now, status=status)
         self.assertTrue(utils.datetimes_same(timezone.localtime(utc.due_date), now + daily.due_delta()))
 
+    def create_instance(self, work_completed, status):
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc_hist, work_completed=work_completed)
+        ti = utils.create_test_instance(tli, unit_test_info=self.uti_hist, status=status)
+        return tli, ti
+
+    def last_valid_id(self):
+        return models.UnitTestCollection.objects.get(pk=self.utc_hist.pk).last_valid_instance_id
+
+    def test_last_valid_instance_maintained(self):
+        now = timezone.now()
+        tli1, __ = self.create_instance(now - timezone.timedelta(days=2), self.valid_status)
+        self.assertEqual(self.last_valid_id(), tli1.pk)
+
+        tli2, ti2 = self.create_instance(now - timezone.timedelta(days=1), self.invalid_status)
+        self.assertEqual(self.last_valid_id(), tli1.pk)
+
+        # re-statusing a test instance doesn't update its collection until
+        # its test list instance is saved
+        ti2.status = self.valid_status
+        ti2.save()
+        self.assertEqual(self.last_valid_id(), tli1.pk)
+        tli2.save()
+        self.assertEqual(self.last_valid_id(), tli2.pk)
+
+        ti2.status = self.invalid_status
+        ti2.save()
+        tli2.save()
+        self.assertEqual(self.last_valid_id(), tli1.pk)
+
+    def test_last_valid_instance_deleted(self):
+        now = timezone.now()
+        tli1, __ = self.create_instance(now - timezone.timedelta(days=2), self.valid_status)
+        tli2, __ = self.create_instance(now - timezone.timedelta(days=1), self.valid_status)
+        self.assertEqual(self.last_valid_id(), tli2.pk)
+
+        models.TestListInstance.objects.get(pk=tli2.pk).delete()
+        self.assertEqual(self.last_valid_id(), tli1.pk)
+
+    def test_older_instance_does_not_requery(self):
+        now = timezone.now()
+        tli1, __ = self.create_instance(now, self.valid_status)
+        utc = models.UnitTestCollection.objects.select_related("last_valid_instance").get(pk=self.utc_hist.pk)
+        older = utils.create_test_list_instance(unit_test_collection=self.utc_hist, work_completed=now - timezone.timedelta(days=1))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(utc.calc_last_valid_instance(older), tli1)
+
+    def test_calc_due_date_uses_last_valid_instance(self):
+        now = timezone.now()
+        self.create_instance(now, self.valid_status)
+        utc = models.UnitTestCollection.objects.select_related("frequency", "last_valid_instance").get(pk=self.utc_hist.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(utc.calc_due_date(), now + self.daily.due_delta())
+
 
 class TestUnitTestCollection(TestCase):
 
@@ -878,6 +951,48 @@ class TestUnitTestCollection(TestCase):
             utc = models.UnitTestCollection.objects.get(pk=utc.pk)
             self.assertEqual(utc.due_status(), models.NOT_DUE)
 
+            utc = models.UnitTestCollection.objects.with_due_status().get(pk=utc.pk)
+            self.assertEqual(utc.annotated_due_status, models.NOT_DUE)
+
+    def create_due_utcs(self):
+        now = timezone.now()
+        unit = utils.create_unit()
+        frequencies = [
+            utils.create_frequency(name="daily", slug="daily", nom=1, due=1, overdue=1),
+            utils.create_frequency(name="weekly", slug="weekly", nom=7, due=7, overdue=9),
+            None,
+        ]
+
+        utcs = []
+        for freq in frequencies:
+            for delta in (-10, -8, -7, -2, -1, 0, 1, 6, None):
+                test_list = utils.create_test_list(name="list %s %s" % (freq.slug if freq else "adhoc", delta))
+                utc = utils.create_unit_test_collection(unit=unit, frequency=freq, test_collection=test_list, null_frequency=freq is None)
+                if delta is not None:
+                    utc.set_due_date(now + timezone.timedelta(days=delta))
+                utcs.append(utc)
+        return utcs
+
+    def test_annotated_due_status(self):
+        self.create_due_utcs()
+
+        annotated = dict(models.UnitTestCollection.objects.with_due_status().values_list("pk", "annotated_due_status"))
+        for utc in models.UnitTestCollection.objects.all():
+            self.assertEqual(annotated[utc.pk], utc.due_status())
+
+    def test_due_status_counts(self):
+        self.create_due_utcs()
+
+        expected = dict((status, 0) for status, __ in models.DUE_STATUS_CHOICES)
+        for utc in models.UnitTestCollection.objects.all():
+            expected[utc.due_status()] += 1
+
+        with self.assertNumQueries(2):
+            # frequencies & counts
+            counts = models.UnitTestCollection.objects.due_status_counts()
+
+        self.assertEqual(counts, expected)
+
     def test_set_due_date(self):
 
         due_date = timezone.now() + timezone.timedelta(days=1)
@@ -1188,6 +1303,36 @@ class TestSignals(TestCase):
         self.assertEqual(len(utis), 4)
         self.assertListEqual(tests, [x.test for x in utis])
 
+    def test_unit_test_infos_created_in_bulk(self):
+        test_list = utils.create_test_list()
+        sub_list = utils.create_test_list(name="sublist")
+        test_list.sublists.add(sub_list)
+
+        units = [utils.create_unit(name="unit%d" % i, number=i) for i in range(3)]
+        for unit in units:
+            utils.create_unit_test_collection(unit=unit, test_collection=test_list)
+
+        tests = [utils.create_test(name="test %d" % i) for i in range(10)]
+        for i, test in enumerate(tests[:5]):
+            utils.create_test_list_membership(sub_list, test, order=i)
+
+        self.assertEqual(models.UnitTestInfo.objects.count(), 15)
+
+        models.TestListMembership.objects.bulk_create([
+            models.TestListMembership(test_list=sub_list, test=test, order=i) for i, test in enumerate(tests[5:], 5)
+        ])
+        closure.rebuild_for_list(sub_list)
+
+        with self.assertNumQueries(4):
+            # assigned collections, tests, existing infos & insert
+            signals.update_unit_test_infos(sub_list)
+
+        self.assertEqual(models.UnitTestInfo.objects.count(), 30)
+        self.assertEqual(
+            set(models.UnitTestInfo.objects.values_list("unit_id", "test_id")),
+            set((unit.pk, test.pk) for unit in units for test in tests),
+        )
+
 
 class TestTestInstance(TestCase):
 
@@ -1216,6 +1361,32 @@ class TestTestInstance(TestCase):
         ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=1)
         self.assertIsNone(ti.calculate_diff())
 
+    def test_stored_differences(self):
+        ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=1.1)
+        self.assertIsNone(ti.diff)
+        ti.reference = utils.create_reference(value=1)
+        ti.save()
+        ti = models.TestInstance.objects.get(pk=ti.pk)
+        self.assertAlmostEqual(ti.diff, 0.1)
+        self.assertAlmostEqual(ti.percent_diff, 10)
+        self.assertEqual(list(models.TestInstance.objects.filter(percent_diff__gt=2)), [ti])
+
+    def test_stored_differences_zero_ref(self):
+        ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=1)
+        ti.reference = utils.create_reference(value=0)
+        ti.save()
+        self.assertEqual(ti.diff, 1)
+        self.assertIsNone(ti.percent_diff)
+
+    def test_backfill_differences(self):
+        ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=3)
+        ref = utils.create_reference(value=2)
+        models.TestInstance.objects.filter(pk=ti.pk).update(reference=ref)
+        call_command("backfill_differences", stdout=StringIO())
+        ti = models.TestInstance.objects.get(pk=ti.pk)
+        self.assertEqual(ti.diff, 1)
+        self.assertEqual(ti.percent_diff, 50)
+
     def test_percent_diff(self):
         ref = utils.create_reference(value=1)
         ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=1.1)
@@ -1561,6 +1732,23 @@ class TestTestListInstance(TestCase):
         tli.save()
         return tli
 
+    def test_history(self):
+        now = timezone.now()
+        older = self.create_test_list_instance(work_completed=now - timezone.timedelta(days=2))
+        newer = self.create_test_list_instance(work_completed=now)
+        newer_tis = dict((ti.unit_test_info.test_id, ti) for ti in newer.testinstance_set.all())
+        older_tis = dict((ti.unit_test_info.test_id, ti) for ti in older.testinstance_set.all())
+
+        with self.assertNumQueries(3):
+            history, dates = newer.history()
+
+        self.assertEqual(len(history), len(self.tests))
+        self.assertEqual(dates[0], older.work_completed)
+        for ti, hist in history:
+            test_id = ti.unit_test_info.test_id
+            self.assertEqual(ti, newer_tis[test_id])
+            self.assertEqual(hist[0], older_tis[test_id])
+
     def test_pass_fail(self):
 
         pf_status = self.test_list_instance.pass_fail_status()
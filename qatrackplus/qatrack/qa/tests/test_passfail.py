@@ -0,0 +1,135 @@
+import itertools
+
+import numpy as np
+from django.test import TestCase
+
+from qatrack.qa import models, passfail, utils
+
+
+def make_ti(value, ref=None, tol=None, test_type=models.SIMPLE, string_value=None, skipped=False, in_progress=False):
+    """return an unsaved TestInstance for comparing the scalar & vectorized paths"""
+    test = models.Test(type=test_type)
+    uti = models.UnitTestInfo(test=test)
+    return models.TestInstance(
+        value=value,
+        string_value=string_value,
+        skipped=skipped,
+        unit_test_info=uti,
+        reference=models.Reference(type=models.NUMERICAL, value=ref) if ref is not None else None,
+        tolerance=tol,
+        test_list_instance=models.TestListInstance(in_progress=in_progress),
+    )
+
+
+def make_tol(tol_type, act_low, tol_low, tol_high, act_high):
+    return models.Tolerance(type=tol_type, act_low=act_low, tol_low=tol_low, tol_high=tol_high, act_high=act_high)
+
+
+class TestAlmostEqual(TestCase):
+
+    VALUES = [
+        0., -0., 1., -1., 0.1, 1E-7, 1.0000001, 1.000001, 0.9999999, 10., 100., 1000., 99.99999,
+        -2., 2.0000001, 1E-300, 5E-324, 1E99, -1E99, 1E308, float("inf"), float("-inf"), float("nan"),
+        3.14159, 3.1415926, 1E-10, 2E-10,
+    ]
+
+    def test_parity(self):
+        pairs = list(itertools.product(self.VALUES, repeat=2))
+        a = np.array([p[0] for p in pairs])
+        b = np.array([p[1] for p in pairs])
+        for significant in (3, 7):
+            vectorized = passfail.almost_equal(a, b, significant=significant)
+            scalar = [utils.almost_equal(x, y, significant=significant) for x, y in pairs]
+            self.assertEqual(list(vectorized), scalar)
+
+    def test_missing(self):
+        self.assertFalse(passfail.almost_equal(passfail.as_array([None]), [1.])[0])
+
+
+class TestFloatPassFail(TestCase):
+
+    def setUp(self):
+        self.tols = [
+            make_tol(models.ABSOLUTE, -2, -1, 1, 2),
+            make_tol(models.ABSOLUTE, None, None, 1, 2),
+            make_tol(models.ABSOLUTE, -2, -1, None, None),
+            make_tol(models.ABSOLUTE, None, None, None, None),
+            make_tol(models.ABSOLUTE, -0.3, -0.1, 0.1, 0.3),
+            make_tol(models.PERCENT, -2, -1, 1, 2),
+            make_tol(models.PERCENT, -5, None, None, 5),
+            make_tol(models.PERCENT, -0.1, -0.05, 0.05, 0.1),
+        ]
+
+    def assert_parity(self, tis):
+        expected = []
+        for ti in tis:
+            ti.calculate_pass_fail()
+            expected.append(ti.pass_fail)
+            ti.pass_fail = None
+
+        errors = passfail.calculate_pass_fail(tis)
+        self.assertEqual(errors, [])
+        self.assertEqual([ti.pass_fail for ti in tis], expected)
+
+    def test_borders(self):
+        values = [-2, -1.0000000001, -1, -0.9999999, 0, 0.9, 1, 1.0000001, 1.5, 2, 2.00000001, 2.1, 0.1, 0.3, 0.30000001]
+        refs = [0, 1, 10, 100, -50]
+        tis = []
+        for tol, ref, diff in itertools.product(self.tols, refs, values):
+            if tol.type == models.PERCENT:
+                value = ref + ref * diff / 100.
+            else:
+                value = ref + diff
+            tis.append(make_ti(value, ref, tol))
+        tis = [ti for ti in tis if not (ti.tolerance.type == models.PERCENT and ti.reference.value == 0)]
+        self.assert_parity(tis)
+
+    def test_random(self):
+        rng = np.random.RandomState(1234)
+        tis = []
+        for i in range(5000):
+            tol = self.tols[i % len(self.tols)]
+            ref = float(rng.choice([1, 10, 0.5, 123.456, -7]))
+            value = ref + rng.normal(scale=abs(ref) * 0.02 + 1)
+            tis.append(make_ti(value, ref, tol))
+        self.assert_parity(tis)
+
+    def test_array_api(self):
+        codes = passfail.float_pass_fail(
+            [0., 1.5, 3., 101.5], [0., 0., 0., 100.], [False, False, False, True],
+            [-2, -2, -2, -2], [-1, -1, -1, -1], [1, 1, 1, 1], [2, 2, 2, 2],
+        )
+        self.assertEqual(list(codes), [models.OK, models.TOLERANCE, models.ACTION, models.TOLERANCE])
+
+
+class TestCalculatePassFail(TestCase):
+
+    def test_mixed(self):
+        tol = make_tol(models.ABSOLUTE, -2, -1, 1, 2)
+        mc_tol = models.Tolerance(type=models.MULTIPLE_CHOICE, mc_pass_choices="a", mc_tol_choices="b")
+        tis = [
+            make_ti(1, 1, tol),
+            make_ti(1, 0, None, test_type=models.BOOLEAN),
+            make_ti(1, 1, None, test_type=models.BOOLEAN),
+            make_ti(None, None, mc_tol, test_type=models.MULTIPLE_CHOICE, string_value="B"),
+            make_ti(1, None, None),
+            make_ti(None, 1, tol, skipped=True),
+            make_ti(None, 1, tol, in_progress=True),
+        ]
+        self.assertEqual(passfail.calculate_pass_fail(tis), [])
+        self.assertEqual(
+            [ti.pass_fail for ti in tis],
+            [models.OK, models.ACTION, models.OK, models.TOLERANCE, models.NO_TOL, models.NOT_DONE, models.NOT_DONE],
+        )
+
+    def test_errors_match_scalar(self):
+        ok = make_ti(1, 1, make_tol(models.ABSOLUTE, -2, -1, 1, 2))
+        zero_ref = make_ti(1, 0, make_tol(models.PERCENT, -2, -1, 1, 2))
+        no_value = make_ti(None, 1, make_tol(models.ABSOLUTE, -2, -1, 1, 2))
+
+        errors = passfail.calculate_pass_fail([ok, zero_ref, no_value])
+
+        self.assertEqual(ok.pass_fail, models.OK)
+        self.assertEqual([ti for ti, e in errors], [zero_ref, no_value])
+        self.assertIsInstance(errors[0][1], ZeroDivisionError)
+        self.assertIsInstance(errors[1][1], TypeError)
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from qatrack.qa import models, payload
+from . import utils
+
+import mock
+
+PAYLOAD_CACHES = dict(settings.CACHES)
+PAYLOAD_CACHES[settings.PERFORM_PAYLOAD_CACHE] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+
+@override_settings(CACHES=PAYLOAD_CACHES)
+class TestPerformPayload(TestCase):
+
+    def setUp(self):
+        payload.get_cache().clear()
+
+        self.test_list = utils.create_test_list()
+        self.tests = [utils.create_test(name="test%d" % i) for i in range(3)]
+        for idx, test in enumerate(reversed(self.tests)):
+            utils.create_test_list_membership(self.test_list, test, idx)
+
+        self.utc = utils.create_unit_test_collection(test_collection=self.test_list)
+
+    def get_payload(self, day=None):
+        utc = models.UnitTestCollection.objects.select_related("last_instance").get(pk=self.utc.pk)
+        return payload.get_payload(utc, day)
+
+    def builds(self):
+        return mock.patch.object(payload, "build", wraps=payload.build)
+
+    def test_ordered(self):
+        data = self.get_payload()
+        self.assertEqual(data["all_tests"], list(reversed(self.tests)))
+        self.assertEqual([uti.test for uti in data["unit_test_infos"]], list(reversed(self.tests)))
+        self.assertEqual(data["actual_day"], 0)
+        self.assertEqual(data["test_list"], self.test_list)
+        self.assertEqual(data["missing_tests"], [])
+
+    def test_cached(self):
+        self.get_payload()
+        with self.builds() as build:
+            self.get_payload()
+        self.assertEqual(build.call_count, 0)
+
+    def test_missing_uti(self):
+        models.UnitTestInfo.objects.filter(test=self.tests[0]).delete()
+        data = self.get_payload()
+        self.assertEqual(data["missing_tests"], [(self.tests[0].pk, self.tests[0].name)])
+        self.assertEqual(len(data["unit_test_infos"]), 2)
+
+    def test_invalidated_by_reference(self):
+        self.get_payload()
+        uti = models.UnitTestInfo.objects.get(test=self.tests[0], unit=self.utc.unit)
+        uti.reference = utils.create_reference(value=3)
+        uti.save()
+        data = self.get_payload()
+        uti = [u for u in data["unit_test_infos"] if u.test_id == self.tests[0].pk][0]
+        self.assertEqual(uti.reference.value, 3)
+
+    def test_invalidated_by_membership(self):
+        self.get_payload()
+        new_test = utils.create_test(name="new test")
+        utils.create_test_list_membership(self.test_list, new_test, 10)
+        data = self.get_payload()
+        self.assertEqual(data["all_tests"][-1], new_test)
+
+    def test_invalidated_by_sublist(self):
+        self.get_payload()
+        sublist = utils.create_test_list(name="sublist")
+        sub_test = utils.create_test(name="sub test")
+        utils.create_test_list_membership(sublist, sub_test)
+        self.test_list.sublists.add(sublist)
+        data = self.get_payload()
+        self.assertIn(sub_test, data["all_tests"])
+
+    def test_invalidated_by_reassigned_test_list(self):
+        new_list = utils.create_test_list(name="new list")
+        new_test = utils.create_test(name="new test")
+        utils.create_test_list_membership(new_list, new_test)
+        # create the unit test info up front so reassigning doesn't create any
+        models.UnitTestInfo.objects.create(unit=self.utc.unit, test=new_test, assigned_to=self.utc.assigned_to)
+
+        self.get_payload()
+        self.utc.tests_object = new_list
+        self.utc.save()
+
+        data = self.get_payload()
+        self.assertEqual(data["test_list"], new_list)
+        self.assertEqual(data["all_tests"], [new_test])
+
+    def test_invalidated_by_category_deleted(self):
+        self.get_payload()
+        category = utils.create_category(name="other", slug="other", description="other")
+        with self.builds() as build:
+            category.delete()
+            self.get_payload()
+        self.assertEqual(build.call_count, 1)
+
+    def test_cycle_days(self):
+        tl1 = utils.create_test_list(name="tl1")
+        tl2 = utils.create_test_list(name="tl2")
+        cycle = utils.create_cycle(test_lists=[tl1, tl2])
+        utc = utils.create_unit_test_collection(test_collection=cycle, unit=self.utc.unit)
+
+        data = payload.get_payload(utc, None)
+        self.assertEqual(data["days"], [(1, "Day 1"), (2, "Day 2")])
+        self.assertEqual(data["test_list"], tl1)
+
+        data = payload.get_payload(utc, 1)
+        self.assertEqual(data["actual_day"], 1)
+        self.assertEqual(data["test_list"], tl2)
+
+    def test_invalid_day(self):
+        cycle = utils.create_cycle(test_lists=[utils.create_test_list(name="tl1")])
+        utc = utils.create_unit_test_collection(test_collection=cycle, unit=self.utc.unit)
+        self.assertIsNone(payload.get_payload(utc, 22))
@@ -0,0 +1,129 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from qatrack.qa import models, recalculate
+from qatrack.qa import utils as qautils
+from . import utils
+
+
+@override_settings(CALCULATION_POOL_SIZE=0)
+class TestRecalculate(TestCase):
+
+    def setUp(self):
+
+        self.tl = utils.create_test_list()
+        self.t1 = utils.create_test(name="test1")
+        self.tc = utils.create_test(name="testc", test_type=models.COMPOSITE)
+        self.tc.calculation_procedure = "result = test1*2"
+        self.tc.save()
+        self.tc2 = utils.create_test(name="testc2", test_type=models.COMPOSITE)
+        self.tc2.calculation_procedure = "result = testc + 1"
+        self.tc2.save()
+
+        for order, t in enumerate([self.t1, self.tc, self.tc2]):
+            utils.create_test_list_membership(self.tl, t, order=order)
+
+        self.utc = utils.create_unit_test_collection(test_collection=self.tl)
+        self.tli = utils.create_test_list_instance(unit_test_collection=self.utc)
+
+        self.tis = {}
+        for t, val in [(self.t1, 3), (self.tc, 6), (self.tc2, 7)]:
+            uti = models.UnitTestInfo.objects.get(test=t, unit=self.utc.unit)
+            self.tis[t.slug] = utils.create_test_instance(self.tli, unit_test_info=uti, value=val)
+
+    def fix_procedure(self):
+        self.tc.calculation_procedure = "result = test1*3"
+        self.tc.save()
+
+    def test_nothing_changed(self):
+        stats = recalculate.recalculate(models.TestListInstance.objects.all())
+        self.assertEqual(stats.changed, 0)
+        self.assertEqual(stats.calculated, 2)
+
+    def test_dependent_recalculated(self):
+        self.fix_procedure()
+        stats = recalculate.recalculate(models.TestListInstance.objects.all(), tests=[self.tc.pk])
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc"].pk).value, 9)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc2"].pk).value, 10)
+
+    def test_non_composite_selected(self):
+        self.fix_procedure()
+        stats = recalculate.recalculate(models.TestListInstance.objects.all(), tests=[self.t1.pk])
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc"].pk).value, 9)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc2"].pk).value, 10)
+
+    def test_dry_run(self):
+        self.fix_procedure()
+        stats = recalculate.recalculate(models.TestListInstance.objects.all(), dry_run=True)
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc"].pk).value, 6)
+
+    def test_error(self):
+        self.tc.calculation_procedure = "result = 1/0"
+        self.tc.save()
+        stats = recalculate.recalculate(models.TestListInstance.objects.all())
+        self.assertEqual(len(stats.errors), 2)
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc"].pk).value, 6)
+
+    def test_command(self):
+        self.fix_procedure()
+        out = StringIO()
+        call_command("recalculate_composites", "--test", "testc", stdout=out)
+        self.assertIn("2 changed", out.getvalue())
+        self.assertEqual(models.TestInstance.objects.get(pk=self.tis["testc2"].pk).value, 10)
+
+
+class TestBulkUpdate(TestCase):
+
+    def test_bulk_update(self):
+        tests = [utils.create_test(name="test%d" % i) for i in range(3)]
+        for i, t in enumerate(tests):
+            t.description = "new %d" % i
+        self.assertEqual(qautils.bulk_update(tests, ["description"], batch_size=2), 3)
+        self.assertEqual(models.Test.objects.get(pk=tests[2].pk).description, "new 2")
+
+    def test_foreign_key(self):
+        tl = utils.create_test_list()
+        for i in range(2):
+            utils.create_test_list_membership(tl, utils.create_test(name="test%d" % i), order=i)
+        utc = utils.create_unit_test_collection(test_collection=tl)
+        tli = utils.create_test_list_instance(unit_test_collection=utc)
+        status = utils.create_status()
+        new_status = utils.create_status(name="new status", slug="new_status", is_default=False)
+        ref = utils.create_reference()
+        tis = []
+        for uti in models.UnitTestInfo.objects.filter(unit=utc.unit):
+            ti = utils.create_test_instance(tli, unit_test_info=uti, status=status)
+            ti.status = new_status
+            ti.reference = ref
+            tis.append(ti)
+
+        self.assertEqual(qautils.bulk_update(tis, ["status", "reference"]), 2)
+        for ti in models.TestInstance.objects.filter(pk__in=[ti.pk for ti in tis]):
+            self.assertEqual(ti.status_id, new_status.pk)
+            self.assertEqual(ti.reference_id, ref.pk)
+
+    def test_all_null(self):
+        tl = utils.create_test_list()
+        for i in range(2):
+            utils.create_test_list_membership(tl, utils.create_test(name="test%d" % i), order=i)
+        utc = utils.create_unit_test_collection(test_collection=tl)
+        tli = utils.create_test_list_instance(unit_test_collection=utc)
+        status = utils.create_status()
+        ref = utils.create_reference()
+        tis = []
+        for uti in models.UnitTestInfo.objects.filter(unit=utc.unit):
+            ti = utils.create_test_instance(tli, unit_test_info=uti, status=status)
+            ti.reference = ref
+            ti.save()
+            ti.value = ti.diff = ti.reference = None
+            tis.append(ti)
+
+        # PostgreSQL types a CASE with only NULL results as text
+        self.assertEqual(qautils.bulk_update(tis, ["value", "diff", "reference"]), 2)
+        for ti in models.TestInstance.objects.filter(pk__in=[ti.pk for ti in tis]):
+            self.assertIsNone(ti.value)
+            self.assertIsNone(ti.reference_id)
@@ -0,0 +1,61 @@
+from django.test import TestCase
+
+from qatrack.qa import models, refdata
+from . import utils
+
+
+class TestReferenceData(TestCase):
+
+    def setUp(self):
+        self.default = utils.create_status(name="default", slug="default", is_default=True)
+        self.approved = utils.create_status(name="approved", slug="approved", is_default=False, requires_review=False)
+        models.AutoReviewRule.objects.create(pass_fail=models.OK, status=self.approved)
+
+        self.test = utils.create_test(name="test1")
+        self.test.auto_review = True
+        self.test.save()
+        self.uti = utils.create_unit_test_info(test=self.test)
+
+    def make_ti(self, pass_fail):
+        return models.TestInstance(
+            unit_test_info=self.uti, pass_fail=pass_fail, status=self.default,
+            test_list_instance=models.TestListInstance(),
+        )
+
+    def test_constant_queries(self):
+        tis = [self.make_ti(models.OK if i % 2 else models.ACTION) for i in range(50)]
+        with refdata.scope():
+            with self.assertNumQueries(2):
+                for ti in tis:
+                    ti.auto_review()
+                models.TestInstanceStatus.objects.default()
+
+        self.assertEqual(set(ti.status for ti in tis[1::2]), {self.approved})
+        self.assertEqual(set(ti.status for ti in tis[::2]), {self.default})
+
+    def test_default_status(self):
+        with refdata.scope() as data:
+            self.assertEqual(data.default_status(), self.default)
+            self.assertEqual(models.TestInstanceStatus.objects.default(), self.default)
+
+    def test_status_does_not_exist(self):
+        with refdata.scope() as data:
+            with self.assertRaises(models.TestInstanceStatus.DoesNotExist):
+                data.status(self.approved.pk + 100)
+
+    def test_invalidated_on_save(self):
+        with refdata.scope() as data:
+            self.assertEqual(data.auto_review_status(models.TOLERANCE), None)
+            models.AutoReviewRule.objects.create(pass_fail=models.TOLERANCE, status=self.approved)
+            self.assertEqual(data.auto_review_status(models.TOLERANCE), self.approved)
+
+    def test_nested_scope(self):
+        with refdata.scope() as outer:
+            with refdata.scope() as inner:
+                self.assertIs(outer, inner)
+        self.assertIsNone(refdata.current())
+
+    def test_choice_sets(self):
+        tol = utils.create_tolerance(tol_type=models.MULTIPLE_CHOICE, mc_pass_choices="A,b", mc_tol_choices="C")
+        with refdata.scope() as data:
+            self.assertEqual(data.choice_sets(tol), ({"a", "b"}, {"c"}))
@@ -0,0 +1,92 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from qatrack.qa import admin, models, regrade
+from . import utils
+
+
+class TestRegrade(TestCase):
+
+    def setUp(self):
+        self.tol = utils.create_tolerance(act_low=-2, tol_low=-1, tol_high=1, act_high=2)
+        self.ref = utils.create_reference(value=10)
+        self.test = utils.create_test(name="test1")
+        self.tl = utils.create_test_list()
+        utils.create_test_list_membership(self.tl, self.test)
+        self.utc = utils.create_unit_test_collection(test_collection=self.tl)
+        self.uti = models.UnitTestInfo.objects.get(test=self.test, unit=self.utc.unit)
+        self.tli = utils.create_test_list_instance(unit_test_collection=self.utc)
+
+        self.tis = []
+        for val in (10, 11.5, 13):
+            ti = utils.create_test_instance(self.tli, unit_test_info=self.uti, value=val)
+            ti.reference = self.ref
+            ti.tolerance = self.tol
+            ti.save()
+            self.tis.append(ti)
+
+    def pass_fails(self):
+        return list(models.TestInstance.objects.filter(pk__in=[ti.pk for ti in self.tis]).order_by("pk").values_list("pass_fail", flat=True))
+
+    def widen_tolerance(self):
+        models.Tolerance.objects.filter(pk=self.tol.pk).update(act_low=-5, tol_low=-2, tol_high=2, act_high=5)
+
+    def test_initial_states(self):
+        self.assertEqual(self.pass_fails(), [models.OK, models.TOLERANCE, models.ACTION])
+
+    def test_tolerance_edited(self):
+        self.widen_tolerance()
+        stats = regrade.regrade(regrade.affected_instances(tolerances=[self.tol]))
+        self.assertEqual(stats.test_instances, 3)
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(self.pass_fails(), [models.OK, models.OK, models.TOLERANCE])
+
+    def test_dry_run(self):
+        self.widen_tolerance()
+        stats = regrade.regrade(regrade.affected_instances(tolerances=[self.tol]), dry_run=True)
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(
+            sorted(stats.summary()),
+            sorted([(models.TOL_DISP, models.OK_DISP, 1), (models.ACT_DISP, models.TOL_DISP, 1)]),
+        )
+        self.assertEqual(self.pass_fails(), [models.OK, models.TOLERANCE, models.ACTION])
+
+    def test_use_current(self):
+        new_ref = utils.create_reference(name="new ref", value=13)
+        self.uti.reference = new_ref
+        self.uti.tolerance = self.tol
+        self.uti.save()
+
+        stats = regrade.regrade(regrade.affected_instances(unit_test_infos=[self.uti]), use_current=True)
+        self.assertEqual(stats.changed, 2)
+        self.assertEqual(self.pass_fails(), [models.ACTION, models.TOLERANCE, models.OK])
+        self.assertEqual(set(models.TestInstance.objects.values_list("reference_id", flat=True)), {new_ref.pk})
+
+    def test_current_requires_from(self):
+        with self.assertRaises(CommandError):
+            call_command("regrade_test_instances", "--unit", str(self.uti.unit.number), "--current", stdout=StringIO())
+
+    def test_admin_keeps_references_by_default(self):
+        form = admin.RegradeForm({"_selected_action": [self.uti.pk]}, allow_current=True)
+        self.assertTrue(form.is_valid())
+        self.assertFalse(form.cleaned_data["use_current"])
+
+    def test_admin_current_requires_from(self):
+        form = admin.RegradeForm({"_selected_action": [self.uti.pk], "use_current": "on"}, allow_current=True)
+        self.assertIn("date_from", form.errors)
+
+    def test_date_range(self):
+        self.widen_tolerance()
+        tis = regrade.affected_instances(tolerances=[self.tol], date_to=self.tis[0].work_completed - timezone.timedelta(days=1))
+        stats = regrade.regrade(tis)
+        self.assertEqual(stats.test_instances, 0)
+
+    def test_command(self):
+        self.widen_tolerance()
+        out = StringIO()
+        call_command("regrade_test_instances", "--tolerance", str(self.tol.pk), "--dry-run", stdout=out)
+        self.assertIn("Dry run: 3 test instances evaluated, 2 pass/fail states changed", out.getvalue())
+        self.assertEqual(self.pass_fails(), [models.OK, models.TOLERANCE, models.ACTION])
@@ -0,0 +1,128 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from qatrack.qa import models, scheduling
+from . import utils
+
+
+class TestScheduling(TestCase):
+
+    def setUp(self):
+        self.valid = utils.create_status(name="valid", slug="valid")
+        self.invalid = utils.create_status(name="invalid", slug="invalid", is_default=False)
+        self.invalid.valid = False
+        self.invalid.save()
+
+        self.test = utils.create_test(name="test1")
+        self.tl = utils.create_test_list()
+        utils.create_test_list_membership(self.tl, self.test)
+        self.utc = utils.create_unit_test_collection(test_collection=self.tl)
+        self.uti = models.UnitTestInfo.objects.get(test=self.test, unit=self.utc.unit)
+
+        self.now = timezone.now()
+
+    def create_instance(self, days_ago, status):
+        work_completed = self.now - timezone.timedelta(days=days_ago)
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc, work_completed=work_completed)
+        utils.create_test_instance(tli, unit_test_info=self.uti, work_completed=work_completed, status=status)
+        return tli
+
+    def clear_due_dates(self):
+        models.UnitTestCollection.objects.update(due_date=None)
+
+    def get_utc(self):
+        return models.UnitTestCollection.objects.get(pk=self.utc.pk)
+
+    def test_last_valid_completed(self):
+        valid = self.create_instance(3, self.valid)
+        self.create_instance(1, self.invalid)
+
+        last = scheduling.last_valid_completed([self.utc.pk])
+        self.assertEqual(last, {self.utc.pk: valid.work_completed})
+
+    def test_matches_calc_due_date(self):
+        self.create_instance(3, self.valid)
+        self.create_instance(1, self.invalid)
+        expected = self.get_utc().calc_due_date()
+        self.clear_due_dates()
+
+        stats = scheduling.schedule(scheduling.schedulable())
+
+        self.assertEqual(self.get_utc().due_date, expected)
+        self.assertEqual(stats.unit_test_collections, 1)
+        self.assertEqual(stats.changed, 1)
+
+    def test_last_valid_instances(self):
+        valid = self.create_instance(3, self.valid)
+        self.create_instance(1, self.invalid)
+
+        last = scheduling.last_valid_instances([self.utc.pk])
+        self.assertEqual(last, {self.utc.pk: (valid.pk, valid.work_completed)})
+
+    def test_sets_last_valid_instance(self):
+        valid = self.create_instance(3, self.valid)
+        self.create_instance(1, self.invalid)
+        expected = self.get_utc().calc_due_date()
+        models.UnitTestCollection.objects.update(due_date=None, last_valid_instance=None)
+
+        stats = scheduling.schedule(scheduling.schedulable())
+
+        utc = self.get_utc()
+        self.assertEqual(utc.due_date, expected)
+        self.assertEqual(utc.last_valid_instance_id, valid.pk)
+        self.assertEqual(stats.changed, 1)
+
+    def test_stale_last_valid_instance(self):
+        self.create_instance(3, self.valid)
+        invalid = self.create_instance(1, self.invalid)
+        models.UnitTestCollection.objects.update(last_valid_instance=invalid)
+        models.TestInstance.objects.update(status=self.invalid)
+        self.clear_due_dates()
+
+        scheduling.schedule(scheduling.schedulable())
+
+        utc = self.get_utc()
+        self.assertIsNone(utc.last_valid_instance_id)
+        self.assertTrue(utils.datetimes_same(utc.due_date, timezone.now()))
+
+    def test_no_valid_instances(self):
+        self.create_instance(1, self.invalid)
+        self.clear_due_dates()
+
+        scheduling.schedule(scheduling.schedulable())
+
+        self.assertTrue(utils.datetimes_same(self.get_utc().due_date, timezone.now()))
+
+    def test_never_performed(self):
+        self.clear_due_dates()
+        stats = scheduling.schedule(scheduling.schedulable())
+        self.assertIsNone(self.get_utc().due_date)
+        self.assertEqual(stats.changed, 0)
+
+    def test_not_auto_scheduled(self):
+        self.create_instance(1, self.valid)
+        self.clear_due_dates()
+        models.UnitTestCollection.objects.update(auto_schedule=False)
+
+        stats = scheduling.schedule(scheduling.schedulable())
+
+        self.assertIsNone(self.get_utc().due_date)
+        self.assertEqual(stats.unit_test_collections, 0)
+
+    def test_scope(self):
+        self.assertEqual(scheduling.schedulable(units=[self.utc.unit.number]).count(), 1)
+        self.assertEqual(scheduling.schedulable(units=[self.utc.unit.number + 1]).count(), 0)
+        self.assertEqual(scheduling.schedulable(frequencies=[self.utc.frequency.slug]).count(), 1)
+        self.assertEqual(scheduling.schedulable(frequencies=["foo"]).count(), 0)
+
+    def test_command(self):
+        self.create_instance(1, self.valid)
+        self.clear_due_dates()
+
+        out = StringIO()
+        call_command("auto_schedule", "schedule-all", "--unit", str(self.utc.unit.number), stdout=out)
+
+        self.assertIsNotNone(self.get_utc().due_date)
+        self.assertIn("1 unit test collections scheduled", out.getvalue())
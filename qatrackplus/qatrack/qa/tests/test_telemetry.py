@@ -0,0 +1,86 @@
+import json
+
+from django.test import TestCase, override_settings
+
+from qatrack.qa import calculation, models, telemetry
+from . import utils
+
+import mock
+
+
+@override_settings(CALCULATION_STATS_FLUSH_SIZE=1000, CALCULATION_STATS_FLUSH_INTERVAL=1000, CALCULATION_STATS_WINDOW=3)
+class TestTelemetry(TestCase):
+
+    def setUp(self):
+        self.test = utils.create_test(name="testc", test_type=models.COMPOSITE)
+        telemetry.flush()
+
+    def result(self, wall, error=None):
+        return calculation.CalculationResult(
+            "testc", value=1, error=error, test_id=self.test.pk, stats={"wall": wall, "cpu": wall, "memory": 10},
+        )
+
+    def test_percentile(self):
+        self.assertEqual(telemetry.percentile(list(range(101)), 95), 95)
+        self.assertIsNone(telemetry.percentile([None], 50))
+
+    def test_record_and_flush(self):
+        telemetry.record([self.result(1), self.result(3), self.result(2, error="err")])
+        self.assertFalse(models.ProcedureStats.objects.exists())
+        telemetry.flush()
+        ps = models.ProcedureStats.objects.get(test=self.test)
+        self.assertEqual(ps.executions, 3)
+        self.assertEqual(ps.errors, 1)
+        self.assertEqual(ps.wall_p50, 2)
+        self.assertEqual(ps.wall_max, 3)
+
+    def test_window(self):
+        telemetry.record([self.result(w) for w in range(5)])
+        telemetry.flush()
+        ps = models.ProcedureStats.objects.get(test=self.test)
+        self.assertEqual(len(json.loads(ps.samples)), 3)
+        self.assertEqual(ps.executions, 5)
+
+    def test_profile(self):
+        res = list(calculation.execute_procedures([("a", self.test.pk, "result = 1")], {}, profile={self.test.pk}))[0]
+        self.assertIn("function calls", res.profile)
+        telemetry.record([res])
+        telemetry.flush()
+        self.assertIn("function calls", models.ProcedureStats.objects.get(test=self.test).profile_report)
+
+    def test_profiled_tests(self):
+        ps = models.ProcedureStats.objects.create(test=self.test, profile=True)
+        self.assertEqual(telemetry.profiled_tests(), {self.test.pk})
+        ps.profile = False
+        ps.save()
+        self.assertEqual(telemetry.profiled_tests(), set())
+
+    def test_profile_admin_action(self):
+        from django.contrib.admin.sites import site
+        from qatrack.qa.admin import TestAdmin
+
+        self.test.calculation_procedure = "result = 1"
+        self.test.save()
+
+        admin = TestAdmin(models.Test, site)
+        with mock.patch.object(admin, "message_user"):
+            admin.profile_calculation_procedures(None, models.Test.objects.all())
+
+        self.assertEqual(telemetry.profiled_tests(), {self.test.pk})
+
+    @override_settings(CALCULATION_TRACE_MEMORY=True)
+    def test_traced_memory(self):
+        with calculation.ExecutionMonitor() as monitor:
+            data = bytearray(5 * 1024 * 1024)
+        del data
+        self.assertGreaterEqual(monitor.stats["memory"], 5)
+
+    def test_rss_memory(self):
+        with calculation.ExecutionMonitor(rss=True) as monitor:
+            pass
+        self.assertGreaterEqual(monitor.stats["memory"], 0)
+
+    def test_memory_not_recorded_in_process(self):
+        with calculation.ExecutionMonitor() as monitor:
+            pass
+        self.assertIsNone(monitor.stats["memory"])
@@ -27,6 +27,18 @@ class TestUtils(TestCase):
         proc = "result = a + 2"
         self.assertListEqual(proc.split(), qautils.tokenize_composite_calc(proc))
 
+    def test_calculation_dependencies(self):
+        proc = "x = numpy.mean(test1)  # test2\nresult = x + foo.test3 + len('test4')"
+        self.assertListEqual(["foo", "len", "numpy", "test1", "x"], qautils.calculation_dependencies(proc))
+
+    def test_calculation_dependencies_invalid(self):
+        self.assertListEqual(["a", "result"], qautils.calculation_dependencies("result = a +"))
+
+    def test_parse_date(self):
+        self.assertIsNone(qautils.parse_date(None))
+        self.assertIsNotNone(qautils.parse_date("2016-01-02").tzinfo)
+        self.assertRaises(ValueError, qautils.parse_date, "not a date")
+
     def test_set_encoder_set(self):
         self.assertIsInstance(json.dumps(set([1, 2]), cls=qautils.SetEncoder), str)
 
@@ -3,7 +3,7 @@ from urllib.parse import urlencode
 from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
 from django.test.utils import setup_test_environment
 from django.utils import timezone
@@ -11,6 +11,8 @@ from qatrack.qa import models, views
 from qatrack.qa.views import forms
 
 import calendar
+import qatrack.qa.calculation
+import qatrack.qa.uploads
 import qatrack.qa.views.perform
 import qatrack.qa.views.charts
 import qatrack.qa.views.review
@@ -22,6 +24,7 @@ import os
 import glob
 import random
 import io
+import mock
 from . import utils
 
 
@@ -573,6 +576,30 @@ class TestComposite(TestCase):
         }
         self.assertDictEqual(values, expected)
 
+    def test_changed_slugs(self):
+
+        tc2 = utils.create_test(name="testc2", test_type=models.COMPOSITE)
+        tc2.calculation_procedure = "result = testc*2"
+        tc2.save()
+        tc3 = utils.create_test(name="testc3", test_type=models.COMPOSITE)
+        tc3.calculation_procedure = "result = test2*2"
+        tc3.save()
+
+        data = {
+            'qavalues': {"testc": 2, "testc2": 4, "testc3": 4, "test1": 3, "test2": 2},
+            'composite_ids': ['%d' % t.pk for t in (self.tc, tc2, tc3)],
+            'meta': {},
+            'changed': ["test1"],
+        }
+
+        request = self.factory.post(self.url, content_type="application/json", data=json.dumps(data))
+        response = self.view(request)
+        values = json.loads(response.content.decode("UTF-8"))
+
+        self.assertEqual(sorted(values["results"].keys()), ["testc", "testc2"])
+        self.assertEqual(values["results"]["testc"]["value"], 5)
+        self.assertEqual(values["results"]["testc2"]["value"], 10)
+
     def test_invalid_composite(self):
 
         data = {
@@ -1123,6 +1150,146 @@ class TestPerformQA(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class TestPerformQASubmission(TestCase):
+
+    def setUp(self):
+        self.status = utils.create_status()
+        self.group = Group.objects.create(name="foo")
+        self.client.login(username="user", password="password")
+        self.user = User.objects.get(username="user")
+        self.user.groups.add(self.group)
+
+    def create_utc(self, ntests):
+        test_list = utils.create_test_list(name="list %d" % ntests)
+        for idx in range(ntests):
+            test = utils.create_test(name="test %d-%d" % (ntests, idx))
+            utils.create_test_list_membership(test_list, test, idx)
+        return utils.create_unit_test_collection(test_collection=test_list)
+
+    def post(self, utc, work_completed="11-07-2012 00:10"):
+        utis = models.UnitTestInfo.objects.filter(unit=utc.unit).order_by("test__testlistmembership__order")
+        data = {
+            "work_started": "11-07-2012 00:09",
+            "work_completed": work_completed,
+            "status": self.status.pk,
+            "form-TOTAL_FORMS": len(utis),
+            "form-INITIAL_FORMS": len(utis),
+            "form-MAX_NUM_FORMS": "",
+        }
+        for idx, uti in enumerate(utis):
+            data["form-%d-value" % idx] = idx
+            data["form-%d-comment" % idx] = ""
+
+        return self.client.post(reverse("perform_qa", kwargs={"pk": utc.pk}), data=data)
+
+    def count_queries(self, utc):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post(utc)
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_query_budget_independent_of_test_count(self):
+        small = self.create_utc(2)
+        large = self.create_utc(20)
+
+        # first submissions to warm up any lazily loaded/cached data
+        self.post(small, "10-07-2012 00:10")
+        self.post(large, "10-07-2012 00:10")
+
+        self.assertEqual(self.count_queries(small), self.count_queries(large))
+
+    def test_last_instance_and_due_date(self):
+        utc = self.create_utc(3)
+        self.post(utc)
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        tli = models.TestListInstance.objects.get()
+        self.assertEqual(utc.last_instance, tli)
+        self.assertEqual(utc.due_date, tli.work_completed + utc.frequency.due_delta())
+        self.assertEqual(tli.testinstance_set.count(), 3)
+        self.assertFalse(tli.all_reviewed)
+
+    def test_invalid_status_due_date(self):
+        self.status.valid = False
+        self.status.save()
+        utc = self.create_utc(3)
+        self.post(utc)
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        self.assertEqual(utc.last_instance, models.TestListInstance.objects.get())
+        # performed but no valid instances so due immediately
+        self.assertTrue(utc.due_date <= timezone.now())
+
+    def test_older_instance_keeps_last_instance(self):
+        utc = self.create_utc(3)
+        self.post(utc, "11-07-2012 00:10")
+        newer = models.TestListInstance.objects.get()
+        self.post(utc, "10-07-2012 00:10")
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        self.assertEqual(utc.last_instance, newer)
+        self.assertEqual(utc.due_date, newer.work_completed + utc.frequency.due_delta())
+
+    def test_no_frequency(self):
+        # due date stays null (see utils.bulk_update)
+        utc = self.create_utc(2)
+        models.UnitTestCollection.objects.filter(pk=utc.pk).update(frequency=None, due_date=None)
+        response = self.post(utc)
+        self.assertEqual(response.status_code, 302)
+
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        tli = models.TestListInstance.objects.get()
+        self.assertEqual(utc.last_instance, tli)
+        self.assertEqual(utc.last_valid_instance, tli)
+        self.assertIsNone(utc.due_date)
+
+    def test_delete_only_instance(self):
+        utc = self.create_utc(2)
+        models.UnitTestCollection.objects.filter(pk=utc.pk).update(frequency=None, due_date=None)
+        self.post(utc)
+
+        models.TestListInstance.objects.get().delete()
+
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        self.assertIsNone(utc.last_instance)
+        self.assertIsNone(utc.last_valid_instance)
+        self.assertIsNone(utc.due_date)
+
+    def test_set_attachment_owners(self):
+        from qatrack.attachments.models import Attachment
+
+        utc = self.create_utc(2)
+        self.post(utc)
+        tis = list(models.TestInstance.objects.all())
+        attachment = Attachment.objects.create(attachment="uploads/test.txt", created_by=self.user)
+
+        tis_no_pk = [models.TestInstance(unit_test_info_id=ti.unit_test_info_id) for ti in tis]
+        attachment_ids = [(tis[1].unit_test_info_id, str(attachment.pk))]
+        qatrack.qa.views.perform.set_attachment_owners(tis[0].test_list_instance, tis_no_pk, attachment_ids)
+
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.testinstance, tis[1])
+
+    def test_attachments_moved_on_commit(self):
+        from qatrack.attachments.models import Attachment
+
+        utc = self.create_utc(2)
+        self.post(utc)
+        tis = list(models.TestInstance.objects.all())
+        attachment = Attachment.objects.create(attachment="uploads/test.txt", created_by=self.user)
+        attachment_ids = [(tis[0].unit_test_info_id, str(attachment.pk))]
+
+        on_commit = []
+        with mock.patch.object(qatrack.qa.views.perform.transaction, "on_commit", on_commit.append), \
+                mock.patch.object(Attachment, "can_finalize", True), \
+                mock.patch.object(Attachment, "move_tmp_file") as move_tmp_file:
+            qatrack.qa.views.perform.set_attachment_owners(tis[0].test_list_instance, tis, attachment_ids)
+            self.assertEqual(move_tmp_file.call_count, 0)
+
+            on_commit[0]()
+            self.assertEqual(move_tmp_file.call_count, 1)
+
+
 class TestAJAXUpload(TestCase):
 
     def setUp(self):
@@ -1168,6 +1335,88 @@ result = json.load(FILE)
         data = json.loads(response.content.decode("UTF-8"))
         self.assertEqual(data["result"]["baz"]["baz1"], "test")
 
+    def test_reprocess_cached(self):
+        response = self.client.post(self.url, {"test_id": self.test.pk, "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content.decode("UTF-8"))
+
+        with mock.patch("qatrack.qa.sandbox.get_runner") as get_runner:
+            response = self.client.post(self.url, {"test_id": self.test.pk, "attachment_id": data["attachment_id"], "meta": "{}"})
+
+        self.assertFalse(get_runner.called)
+        data = json.loads(response.content.decode("UTF-8"))
+        self.assertEqual(data["result"]["baz"]["baz1"], "test")
+
+
+class TestUploadBatch(TestCase):
+
+    def setUp(self):
+        self.url = reverse("upload_batch")
+        self.tests = []
+        for i, proc in enumerate(["import json\nresult = json.load(FILE)", "result = UPLOAD.parse(len)"]):
+            test = utils.create_test('test upload %d' % i, test_type=models.UPLOAD)
+            test.calculation_procedure = proc
+            test.save()
+            self.tests.append(test)
+
+        fname = os.path.join(os.path.dirname(__file__), "TESTRUNNER_test_file.json")
+        self.test_file = open(fname, "r")
+        self.client.login(username="user", password="password")
+
+    def tearDown(self):
+        self.test_file.close()
+
+    def test_batch(self):
+        test_ids = json.dumps([t.pk for t in self.tests])
+        response = self.client.post(self.url, {"test_ids": test_ids, "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content.decode("UTF-8"))
+        self.assertTrue(data["success"])
+        self.assertEqual(data["results"][str(self.tests[0].pk)]["result"]["baz"]["baz1"], "test")
+        self.assertTrue(data["results"][str(self.tests[1].pk)]["success"])
+
+    def test_no_tests(self):
+        response = self.client.post(self.url, {"test_ids": "[]", "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content.decode("UTF-8"))
+        self.assertFalse(data["success"])
+
+
+class TestAsyncUpload(TestCase):
+
+    def setUp(self):
+        self.url = reverse("upload")
+        self.test = utils.create_test('test upload')
+        self.test.type = models.UPLOAD
+        self.test.calculation_procedure = "import json\nresult = json.load(FILE)"
+        self.test.save()
+
+        fname = os.path.join(os.path.dirname(__file__), "TESTRUNNER_test_file.json")
+        self.test_file = open(fname, "r")
+        self.client.login(username="user", password="password")
+        qatrack.qa.calculation.get_result_cache().clear()
+
+    def tearDown(self):
+        self.test_file.close()
+
+    @override_settings(UPLOAD_ASYNC=True)
+    def test_queued(self):
+        response = self.client.post(self.url, {"test_id": self.test.pk, "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content.decode("UTF-8"))
+        self.assertTrue(data["pending"])
+        self.assertEqual(models.UploadJob.objects.get(pk=data["job_id"]).status, models.UploadJob.PENDING)
+
+    @override_settings(UPLOAD_ASYNC=True)
+    def test_status_complete(self):
+        response = self.client.post(self.url, {"test_id": self.test.pk, "upload": self.test_file, "meta": "{}"})
+        status_url = json.loads(response.content.decode("UTF-8"))["status_url"]
+
+        job = qatrack.qa.uploads.claim_job()
+        self.assertIsNone(qatrack.qa.uploads.claim_job())
+        qatrack.qa.uploads.run_job(job)
+
+        data = json.loads(self.client.get(status_url).content.decode("UTF-8"))
+        self.assertTrue(data["success"])
+        self.assertEqual(data["result"]["baz"]["baz1"], "test")
+        self.assertEqual(data["user_attached"], [])
+
 
 class TestBaseEditTestListInstance(TestCase):
 
@@ -0,0 +1,218 @@
+"""
+Processing of upload test files, either synchronously during the
+:view:`qa.perform.Upload` request, or asynchronously via
+:model:`qa.UploadJob`s run by the run_upload_jobs management command.
+"""
+
+import json
+import os
+
+import dateutil.parser
+from django.core.files.base import ContentFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from qatrack.attachments.models import Attachment
+from qatrack.qa import calculation, models, sandbox, telemetry
+
+
+def attachment_info(attachment):
+    return {
+        'attachment_id': attachment.id,
+        'name': os.path.basename(attachment.attachment.name),
+        'size': filesizeformat(attachment.attachment.size),
+        'url': attachment.attachment.url,
+        'is_image': attachment.is_image,
+    }
+
+
+def save_user_files(files, user):
+    """create attachments for (file name, data) pairs written by a calculation"""
+
+    user_attached = []
+    for fname, data in files:
+        attachment = Attachment(
+            attachment=ContentFile(data, fname),
+            comment=_("Composite created file"),
+            created_by=user,
+        )
+        attachment.save()
+        user_attached.append(attachment_info(attachment))
+
+    return user_attached
+
+
+def calculation_context(meta, refs, tols):
+    """return META/REFS/TOLS context for data posted by the perform page"""
+
+    for d in ("work_completed", "work_started",):
+        try:
+            meta[d] = dateutil.parser.parse(meta[d])
+        except (KeyError, AttributeError, TypeError, ValueError):
+            pass
+
+    return {
+        "META": meta,
+        "REFS": refs,
+        "TOLS": tols,
+    }
+
+
+def result_data(res, user):
+    """return response data for a :class:`calculation.CalculationResult`"""
+
+    if res.success:
+        return {
+            "success": True,
+            "errors": [],
+            "result": res.value,
+            "user_attached": save_user_files(res.files, user),
+        }
+
+    return {
+        "success": False,
+        "errors": ["Invalid Test Procedure: %s" % res.error],
+        "result": None,
+        "user_attached": [],
+    }
+
+
+def run_uploads(tests, attachment, context, user):
+    """
+    Run the calculation procedures of `tests` on `attachment` and return
+    a dict mapping test id to dicts of `success`, `errors`, `result` &
+    `user_attached`.  Procedures without a cached result are run together
+    in a single worker so that parsed file data can be shared between
+    them (see `UPLOAD.parse`).
+    """
+
+    file_path = attachment.attachment.path
+    digest = calculation.file_hash(file_path)
+
+    cached = {}
+    to_run = []
+    for test in tests:
+        key = calculation.result_cache_key(test.pk, test.calculation_procedure, file_path, context, file_digest=digest)
+        res = calculation.get_cached_result(key)
+        if res is None:
+            to_run.append((test, key))
+        else:
+            cached[test.pk] = res
+
+    if to_run:
+        procedures = [(test.slug, test.pk, test.calculation_procedure) for test, key in to_run]
+        run_results = sandbox.get_runner().run(
+            procedures, context, file_path=file_path, profile=telemetry.profiled_tests(),
+        )
+        telemetry.record(run_results)
+        for (test, key), res in zip(to_run, run_results):
+            calculation.cache_result(key, res)
+            cached[test.pk] = res
+
+    return dict((test.pk, result_data(cached[test.pk], user)) for test in tests)
+
+
+def run_upload(test, attachment, context, user):
+    """
+    Run the calculation procedure of `test` on `attachment` and return
+    dict of `success`, `errors`, `result` & `user_attached`.
+    """
+
+    return run_uploads([test], attachment, context, user)[test.pk]
+
+
+def queue_upload(test, attachment, meta, refs, tols, user):
+    """create an :model:`qa.UploadJob` for processing `attachment`"""
+
+    return models.UploadJob.objects.create(
+        test=test,
+        attachment=attachment,
+        context=json.dumps({"meta": meta, "refs": refs, "tols": tols}),
+        created_by=user,
+    )
+
+
+def job_results(job):
+    """return the JSON response data for an :model:`qa.UploadJob`"""
+
+    if job.status == models.UploadJob.COMPLETE:
+        return json.loads(job.results)
+
+    return {
+        'attachment_id': job.attachment_id,
+        'attachment': attachment_info(job.attachment),
+        'success': False,
+        'errors': [],
+        'result': None,
+        'user_attached': [],
+        'pending': True,
+        'job_id': job.pk,
+        'status': job.status,
+        'status_url': reverse("upload_status", kwargs={"pk": job.pk}),
+    }
+
+
+def claim_job():
+    """
+    Mark the oldest pending :model:`qa.UploadJob` as running and return
+    it. Returns None if there are no pending jobs.  Safe to use with
+    multiple runner processes since a job is only claimed by the process
+    whose update changes its status.
+    """
+
+    pending = models.UploadJob.objects.filter(status=models.UploadJob.PENDING)
+    for pk in pending.values_list("pk", flat=True)[:10]:
+        claimed = models.UploadJob.objects.filter(
+            pk=pk,
+            status=models.UploadJob.PENDING,
+        ).update(status=models.UploadJob.RUNNING, started=timezone.now())
+        if claimed:
+            return models.UploadJob.objects.select_related("test", "attachment", "created_by").get(pk=pk)
+
+
+def run_job(job):
+    """
+    run a claimed :model:`qa.UploadJob` and store its results. Hashing
+    the file & looking up cached results is done here rather than in the
+    upload request so that large files don't block the request.
+    """
+
+    data = json.loads(job.context)
+    context = calculation_context(data["meta"], data["refs"], data["tols"])
+
+    results = {
+        'attachment_id': job.attachment_id,
+        'attachment': attachment_info(job.attachment),
+    }
+
+    try:
+        results.update(run_upload(job.test, job.attachment, context, job.created_by))
+        job.results = json.dumps(results, cls=DjangoJSONEncoder)
+    except Exception as e:
+        results.update({
+            "success": False,
+            "errors": ["Unable to process upload: %s" % e],
+            "result": None,
+            "user_attached": [],
+        })
+        job.results = json.dumps(results, cls=DjangoJSONEncoder)
+
+    job.status = models.UploadJob.COMPLETE
+    job.completed = timezone.now()
+    job.save()
+
+    return job
+
+
+def requeue_running():
+    """return jobs left running (e.g. by a killed runner) to the queue"""
+    return models.UploadJob.objects.filter(status=models.UploadJob.RUNNING).update(status=models.UploadJob.PENDING)
+
+
+def purge_jobs(max_age):
+    """delete complete jobs older than `max_age` seconds"""
+    cutoff = timezone.now() - timezone.timedelta(seconds=max_age)
+    models.UploadJob.objects.filter(status=models.UploadJob.COMPLETE, completed__lt=cutoff).delete()
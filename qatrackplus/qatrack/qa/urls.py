@@ -11,6 +11,7 @@ resources = [
     api.TestResource(),
     api.TestInstanceResource(),
     api.TestListInstanceResource(),
+    api.BulkTestListInstanceResource(),
     api.ValueResource(),
     api.FrequencyResource(),
     api.StatusResource(),
@@ -43,6 +44,8 @@ urlpatterns = [
 
     # view for uploads via ajax
     url(r"^upload/$", perform.Upload.as_view(), name="upload"),
+    url(r"^upload/batch/$", perform.UploadBatch.as_view(), name="upload_batch"),
+    url(r"^upload/status/(?P<pk>\d+)/$", perform.UploadStatus.as_view(), name="upload_status"),
 
     # api urls
     url(r"^api/", include(v1_api.urls)),
@@ -1,11 +1,16 @@
+import ast
 import json
 import math
 import io
 import tokenize
 import token
 
+import dateutil.parser
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
 
 
 class SetEncoder(json.JSONEncoder):
@@ -103,6 +108,87 @@ def tokenize_composite_calc(calc_procedure):
     return [t[token.NAME] for t in tokens if t[token.NAME]]
 
 
+def calculation_dependencies(calc_procedure):
+    """
+    Return the sorted list of variable names read by a calculation
+    procedure.  Names are found by walking the procedure's syntax tree so
+    that e.g. names appearing only in strings, comments or as attribute
+    names are not included.  Procedures which can not be parsed fall back
+    to a token scan.
+    """
+
+    if not calc_procedure:
+        return []
+
+    try:
+        tree = ast.parse(calc_procedure.replace("\r\n", "\n"))
+    except (SyntaxError, ValueError, TypeError):
+        try:
+            return sorted(set(t for t in tokenize_composite_calc(calc_procedure) if t.isidentifier()))
+        except tokenize.TokenError:
+            return []
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+
+    return sorted(names)
+
+
+def bulk_update(objs, fields, batch_size=500):
+    """
+    Update `fields` of model instances `objs` using a single
+    UPDATE ... SET field = CAST(CASE WHEN pk = ... END AS type) query per
+    batch. All objects must be instances of the same model.
+
+    The CASE is cast to the field's type since e.g. PostgreSQL types a CASE
+    whose results are all NULL as text. Foreign keys are written from their
+    attname (e.g. `reference_id`) so they may be updated too.
+    """
+
+    objs = list(objs)
+    if not objs:
+        return 0
+
+    model = type(objs[0])
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {}
+        for field in fields:
+            output_field = model._meta.get_field(field)
+            whens = [
+                When(pk=obj.pk, then=Value(getattr(obj, output_field.attname), output_field=output_field))
+                for obj in batch
+            ]
+            updates[output_field.attname] = Cast(Case(*whens, output_field=output_field), output_field)
+        updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+
+    return updated
+
+
+def parse_date(date):
+    """
+    Parse a user supplied date string (e.g. a command line option) and
+    return an aware datetime (naive dates are taken to be in the current
+    time zone). Empty values return None. Raises ValueError for invalid
+    dates.
+    """
+
+    if not date:
+        return None
+
+    try:
+        dt = dateutil.parser.parse(date)
+    except (ValueError, OverflowError):
+        raise ValueError("Invalid date: %s" % date)
+
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone.get_current_timezone())
+    return dt
+
+
 def unique(seq, idfun=None):
     """f5 from http://www.peterbe.com/plog/uniqifiers-benchmark"""
     # order preserving
@@ -120,6 +206,21 @@ def unique(seq, idfun=None):
     return result
 
 
+def differences(value, reference):
+    """
+    return (difference, percent difference) of value from reference.
+    Either is None when it can't be calculated (no value or reference, or
+    a zero reference for the percent difference).
+    """
+
+    if value is None or reference is None:
+        return None, None
+
+    diff = value - reference
+    percent_diff = 100. * diff / float(reference) if reference != 0 else None
+    return diff, percent_diff
+
+
 def almost_equal(a, b, significant=7):
     """determine if two numbers are nearly equal to significant figures
     copied from numpy.testing.assert_approx_equal
@@ -23,6 +23,17 @@ from listable.views import (
 logger = logging.getLogger('qatrack.console')
 
 
+def history_depth(request):
+    """return the number of historical results requested (e.g. ?history=20)"""
+
+    try:
+        number = int(request.GET.get("history", settings.NHIST))
+    except (TypeError, ValueError):
+        number = settings.NHIST
+
+    return max(1, min(number, settings.NHIST_MAX))
+
+
 def generate_review_status_context(test_list_instance):
 
     if not test_list_instance:
@@ -77,12 +88,12 @@ class BaseEditTestListInstance(TestListInstanceMixin, UpdateView):
     def add_histories(self, forms):
         """paste historical values onto forms"""
 
-        history, history_dates = self.object.history()
+        test_histories, history_dates = self.object.history(number=history_depth(self.request))
         self.history_dates = history_dates
+        by_instance = dict((instance.pk, test_history) for instance, test_history in test_histories)
         for f in forms:
-            for instance, test_history in history:
-                if f.instance == instance:
-                    f.history = test_history
+            if f.instance.pk in by_instance:
+                f.history = by_instance[f.instance.pk]
 
     def get_context_data(self, **kwargs):
 
@@ -140,6 +151,7 @@ class UTCList(BaseListableView):
         "actions",
         "utc_name",
         "due_date",
+        "annotated_due_status",
         "unit__name",
         "frequency__name",
         "assigned_to__name",
@@ -158,6 +170,7 @@ class UTCList(BaseListableView):
 
     order_fields = {
         "actions": False,
+        "annotated_due_status": "due_date",
         "frequency__name": "frequency__due_interval",
         "unit__name": "unit__number",
         "last_instance_pass_fail": False,
@@ -169,7 +182,8 @@ class UTCList(BaseListableView):
         "frequency__name": SELECT_MULTI,
         "assigned_to__name": SELECT_MULTI,
         "last_instance__work_completed": DATE_RANGE,
-        "due_date": DATE_RANGE
+        "due_date": DATE_RANGE,
+        "annotated_due_status": SELECT_MULTI,
     }
 
     date_ranges = {
@@ -187,6 +201,7 @@ class UTCList(BaseListableView):
 
     headers = {
         "utc_name": _("Test List/Cycle"),
+        "annotated_due_status": _("Due Status"),
         "unit__name": _("Unit"),
         "frequency__name": _("Frequency"),
         "assigned_to__name": _("Assigned To"),
@@ -252,10 +267,13 @@ class UTCList(BaseListableView):
         if self.inactive_only:
             qs = qs.filter(active=False)
 
-        return qs
+        return qs.annotate(annotated_due_status=models.due_status_case())
 
     def get_filters(self, field, queryset=None):
 
+        if field == 'annotated_due_status':
+            return list(models.DUE_STATUS_CHOICES)
+
         filters = super(UTCList, self).get_filters(field, queryset=queryset)
 
         if field == 'frequency__name':
@@ -279,6 +297,9 @@ class UTCList(BaseListableView):
         c = Context({"unit_test_collection": utc, "show_icons": settings.ICON_SETTINGS["SHOW_DUE_ICONS"]})
         return template.render(c)
 
+    def annotated_due_status(self, utc):
+        return dict(models.DUE_STATUS_CHOICES)[utc.annotated_due_status]
+
     def last_instance__work_completed(self, utc):
         template = self.templates['work_completed']
         c = Context({"instance": utc.last_instance})
@@ -4,6 +4,7 @@ import json
 import textwrap
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Count
 from django.http import HttpResponse
 from django.template import Context
@@ -16,7 +17,7 @@ from matplotlib.figure import Figure
 import numpy
 numpy.seterr(all='raise')
 
-from .. import models
+from .. import models, utils
 from qatrack.qa.control_chart import control_chart
 from qatrack.units.models import Unit
 from qatrack.qa.utils import SetEncoder
@@ -56,10 +57,19 @@ def get_tests_for_test_lists(request):
 
     test_lists = request.GET.getlist("test_lists[]") or models.TestList.objects.values_list("pk", flat=True)
 
+    rows = models.TestCollectionClosure.objects.filter(
+        content_type=ContentType.objects.get_for_model(models.TestList),
+        object_id__in=test_lists,
+        test__chart_visibility=True,
+    ).order_by("order").values_list("object_id", "test_id")
+
+    list_tests = collections.defaultdict(list)
+    for tl_id, test_id in rows:
+        list_tests[tl_id].append(test_id)
+
     tests = []
     for pk in test_lists:
-        tl = models.TestList.objects.get(pk=pk)
-        tests.extend([t.pk for t in tl.ordered_tests() if t.chart_visibility])
+        tests.extend(list_tests[int(pk)])
 
     json_context = json.dumps({"tests": tests})
     return HttpResponse(json_context, content_type=JSON_CONTENT_TYPE)
@@ -234,12 +244,16 @@ class BaseChartView(View):
 
             use_percent = has_percent_tol or (has_no_tol and ref_is_not_zero)
 
-            if use_percent:
+            diff, percent_diff = ti.diff, ti.percent_diff
+            if diff is None and ti.value is not None:
+                # instance created before differences were stored & not yet backfilled
+                diff, percent_diff = utils.differences(ti.value, ti.reference.value)
 
-                value = 100 * (ti.value - ti.reference.value) / ti.reference.value
+            if use_percent:
+                value = percent_diff
                 ref_value = 0.
             else:
-                value = ti.value - ti.reference.value
+                value = diff
                 ref_value = 0
         else:
             value = ti.value
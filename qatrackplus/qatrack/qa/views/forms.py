@@ -126,12 +126,15 @@ class TestInstanceWidgetsMixin(object):
         #    import ipdb; ipdb.set_trace()
         #    to_process.append((uti_pk, Attachment.objects.get(pk=sv)))
 
-        user_attached = [x for x in self.cleaned_data.get("user_attached", "").split(",") if x]
-        for aid in user_attached:
+        for aid in self.attachment_ids():
             to_process.append((uti_pk, Attachment.objects.get(pk=aid)))
 
         return to_process
 
+    def attachment_ids(self):
+        """return ids of attachments the user attached to this test"""
+        return [x for x in self.cleaned_data.get("user_attached", "").split(",") if x]
+
 class CreateTestInstanceForm(TestInstanceWidgetsMixin, forms.Form):
 
     value = forms.FloatField(required=False, widget=forms.widgets.TextInput(attrs={"class": "qa-input"}))
@@ -1,122 +1,85 @@
 import collections
+import functools
 import json
-import math
-import os
 
 import dateutil
-import dicom
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy
-import scipy
 
 from django.conf import settings
 from django.contrib import messages
-from django.core.files.base import ContentFile
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.db.models import Q
 from django.forms.models import model_to_dict
 from django.http import HttpResponseRedirect, Http404
 from django.shortcuts import get_object_or_404
-from django.template.defaultfilters import filesizeformat
 from django.views.generic import View, CreateView, TemplateView
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from . import forms
-from .. import models, utils, signals
-from .base import BaseEditTestListInstance, TestListInstances, UTCList, logger
+from .. import calculation, models, passfail, payload, refdata, sandbox, signals, telemetry, uploads, utils
+from .base import BaseEditTestListInstance, TestListInstances, UTCList, history_depth, logger
 from qatrack.attachments.models import Attachment
-from qatrack.attachments.utils import to_bytes, imsave
 from qatrack.contacts.models import Contact
 from qatrack.units.models import Unit
 
 from braces.views import JSONResponseMixin, PermissionRequiredMixin
-from functools import reduce
 
-DEFAULT_CALCULATION_CONTEXT = {
-    "dicom": dicom,
-    "math": math,
-    "numpy": numpy,
-    "matplotlib": matplotlib,
-    "scipy": scipy,
-}
 
-
-def process_procedure(procedure):
+def set_attachment_owners(test_list_instance, test_instances, attachment_ids):
     """
-    Cleans and sets new style division for calculations procedures. Used by
-    both the :view:`qa.perform.Upload` &
-    :view:`qa.perform.CompositeCalculation` views.
-
+    Set the :model:`qa.TestInstance` owning each of the (unit test info id,
+    attachment id) pairs in `attachment_ids`. The attachments are moved to
+    their permanent location once the current transaction commits, so no
+    files are moved if the test list instance is rolled back.
     """
 
-    return "\n".join(["from __future__ import division", procedure, "\n"]).replace('\r', '\n')
+    if not attachment_ids:
+        return
 
+    if any(ti.pk is None for ti in test_instances):
+        # pks aren't set by bulk_create on all databases
+        pks = dict(test_list_instance.testinstance_set.values_list("unit_test_info_id", "pk"))
+        for ti in test_instances:
+            ti.pk = pks.get(ti.unit_test_info_id)
 
-def set_attachment_owners(test_list_instance, attachments):
+    by_uti = dict((ti.unit_test_info_id, ti) for ti in test_instances)
+    attachments = Attachment.objects.in_bulk([aid for uti_id, aid in attachment_ids])
 
-    tis = test_list_instance.testinstance_set.select_related("unit_test_info")
-    for uti_id, attachment in attachments:
-        for ti in tis:
-            if ti.unit_test_info.pk == uti_id:
-                attachment.testinstance = ti
-                attachment.save()
+    to_update = []
+    for uti_id, aid in attachment_ids:
+        attachment = attachments.get(int(aid))
+        if attachment is None or uti_id not in by_uti:
+            continue
+        attachment.testinstance = by_uti[uti_id]
+        to_update.append(attachment)
 
+    utils.bulk_update(to_update, ["testinstance"])
 
-class AttachmentMixin(object):
+    transaction.on_commit(functools.partial(finalize_attachments, to_update))
 
-    def get_write_file_func(self):
 
-        self.user_attached = []
+def finalize_attachments(attachments):
+    """move owned attachments from the temporary upload area to their permanent location"""
 
-        def write(fname, obj):
-            fname = os.path.basename(fname)
-            data = imsave(obj, fname)
-            if data is None:
-                data = to_bytes(obj, fname)
+    to_move = [a for a in attachments if a.can_finalize]
+    for attachment in to_move:
+        attachment.move_tmp_file(save=False)
 
-            f = ContentFile(data, fname)
+    utils.bulk_update(to_move, ["attachment"])
 
-            attachment = Attachment(
-                attachment=f,
-                comment=_("Composite created file"),
-                created_by=self.request.user,
-            )
-            attachment.save()
 
-            self.user_attached.append(self.attachment_info(attachment))
+class AttachmentMixin(object):
 
-        return write
+    def save_user_files(self, files):
+        """create attachments for (file name, data) pairs written by a calculation"""
+        return uploads.save_user_files(files, self.request.user)
 
     def attachment_info(self, attachment):
-        return {
-            'attachment_id': attachment.id,
-            'name': os.path.basename(attachment.attachment.name),
-            'size': filesizeformat(attachment.attachment.size),
-            'url': attachment.attachment.url,
-            'is_image': attachment.is_image,
-        }
+        return uploads.attachment_info(attachment)
 
     def set_calculation_context(self):
-
-        return {
-            "write_file": self.get_write_file_func(),
-        }
-
-    def post(self, *args, **kwargs):
-        """
-        At the end of any view which may use mpl.pyplot to generate a plot
-        we need to clean the figure, to attempt to  prevent any crosstalk
-        between plots.
-
-        Generally people should use the OO interface to MPL rather than
-        pyplot, because pyplot is not threadsafe.
-        """
-        resp = super(AttachmentMixin, self).post(*args, **kwargs)
-        plt.clf()
-        return resp
-
+        return {}
 
 
 class Upload(JSONResponseMixin, AttachmentMixin, View):
@@ -160,17 +123,20 @@ class Upload(JSONResponseMixin, AttachmentMixin, View):
 
         try:
             test = models.Test.objects.get(pk=self.request.POST.get("test_id"))
-            code = compile(process_procedure(test.calculation_procedure), "<string>", "exec")
-            exec(code, self.calculation_context)
-            key = "result" if "result" in self.calculation_context else test.slug
-            results["result"] = self.calculation_context[key]
-            results["success"] = True
-            results["user_attached"] = self.user_attached
         except models.Test.DoesNotExist:
             results["errors"].append("Test with that ID does not exist")
-        except Exception as e:
-            results["errors"].append("Invalid Test Procedure: %s" % e)
+            return self.render_json_response(results)
 
+        if settings.UPLOAD_ASYNC:
+            # queue for processing by run_upload_jobs (which also checks for
+            # cached results) so the file isn't read during this request
+            job = uploads.queue_upload(
+                test, self.attachment, self.get_json_data("meta"), self.get_json_data("refs"),
+                self.get_json_data("tols"), self.request.user,
+            )
+            return self.render_json_response(uploads.job_results(job))
+
+        results.update(uploads.run_upload(test, self.attachment, self.calculation_context, self.request.user))
         return self.render_json_response(results)
 
     def handle_upload(self):
@@ -189,26 +155,11 @@ class Upload(JSONResponseMixin, AttachmentMixin, View):
         """set up the environment that the composite test will be calculated in"""
 
         self.calculation_context = super(Upload, self).set_calculation_context()
-
-        meta_data = self.get_json_data("meta")
-
-        for d in ("work_completed", "work_started",):
-            try:
-                meta_data[d] = dateutil.parser.parse(meta_data[d])
-            except (KeyError, AttributeError):
-                pass
-
-        refs = self.get_json_data("refs")
-        tols = self.get_json_data("tols")
-
-        self.calculation_context.update({
-            "FILE": open(self.attachment.attachment.path, "r"),
-            "BIN_FILE": self.attachment.attachment,
-            "META": meta_data,
-            "REFS": refs,
-            "TOLS": tols,
-        })
-        self.calculation_context.update(DEFAULT_CALCULATION_CONTEXT)
+        self.calculation_context.update(uploads.calculation_context(
+            self.get_json_data("meta"),
+            self.get_json_data("refs"),
+            self.get_json_data("tols"),
+        ))
 
     def get_json_data(self, name):
         """return python data from GET json data"""
@@ -224,6 +175,49 @@ class Upload(JSONResponseMixin, AttachmentMixin, View):
             return
 
 
+class UploadBatch(Upload):
+    """
+    View for running several upload tests against a single uploaded (or
+    previously uploaded) file in one request. Results are returned
+    together keyed on test id.  Batches are always processed synchronously.
+    """
+
+    def run_calc(self):
+
+        results = {
+            'success': False,
+            'errors': [],
+            'results': {},
+        }
+
+        if self.attachment is None:
+            results["errors"] = ["Original file not found. Please re-upload."]
+            return self.render_json_response(results)
+
+        results['attachment_id'] = self.attachment.id
+        results['attachment'] = self.attachment_info(self.attachment)
+
+        test_ids = self.get_json_data("test_ids") or []
+        tests = list(models.Test.objects.filter(pk__in=test_ids, type=models.UPLOAD))
+        if not tests:
+            results["errors"].append("No valid upload test ID's")
+            return self.render_json_response(results)
+
+        self.set_calculation_context()
+        results["results"] = uploads.run_uploads(tests, self.attachment, self.calculation_context, self.request.user)
+        results["success"] = True
+
+        return self.render_json_response(results)
+
+
+class UploadStatus(JSONResponseMixin, View):
+    """Return the status (and results once complete) of a queued upload calculation"""
+
+    def get(self, *args, **kwargs):
+        job = get_object_or_404(models.UploadJob, pk=kwargs["pk"], created_by=self.request.user)
+        return self.render_json_response(uploads.job_results(job))
+
+
 class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
     """validate all qa tests in the request for the :model:`TestList` with id test_list_id"""
 
@@ -247,39 +241,42 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
             return self.render_json_response({"success": False, "errors": ["No Valid Composite ID's"]})
 
         self.set_calculation_context()
-        if not self.calculation_context or list(self.calculation_context.keys()) == ["write_file"]:
+        if not self.calculation_context:
             return self.render_json_response({"success": False, "errors": ["Invalid QA Values"]})
 
         self.set_dependencies()
         self.resolve_dependency_order()
+        self.set_affected_composites()
 
         results = {}
 
         for slug in self.cyclic_tests:
-            results[slug] = {'value': None, 'error': "Cyclic test dependency"}
-
-        for slug in self.calculation_order:
-            raw_procedure = self.composite_tests[slug]
-            procedure = process_procedure(raw_procedure)
-            try:
-                code = compile(procedure, "<string>", "exec")
-                exec(code, self.calculation_context)
-                key = "result" if "result" in self.calculation_context else slug
-                result = self.calculation_context[key]
-
-                results[slug] = {
-                    'value': result,
+            if slug in self.affected:
+                results[slug] = {'value': None, 'error': "Cyclic test dependency"}
+
+        layers = []
+        for layer in self.calculation_layers:
+            procedures = [
+                (slug, self.composite_pks[slug], self.composite_tests[slug])
+                for slug in layer if slug in self.affected
+            ]
+            if procedures:
+                layers.append(procedures)
+
+        calc_results = sandbox.run_layers(layers, self.calculation_context, profile=telemetry.profiled_tests())
+        telemetry.record(calc_results)
+
+        for res in calc_results:
+            if res.success:
+                results[res.slug] = {
+                    'value': res.value,
                     'error': None,
-                    'user_attached': list(self.user_attached),
+                    'user_attached': self.save_user_files(res.files),
                 }
-                self.calculation_context[slug] = result
-            except Exception:
-                results[slug] = {'value': None, 'error': "Invalid Test", 'user_attached': []}
-            finally:
-                # clean up calculation context for next test
-                if "result" in self.calculation_context:
-                    del self.calculation_context["result"]
-                del self.user_attached[:]
+            else:
+                # time/memory limit errors are reported to the user
+                error = res.error if res.fatal else "Invalid Test"
+                results[res.slug] = {'value': None, 'error': error, 'user_attached': []}
 
         return self.render_json_response({"success": True, "errors": [], "results": results})
 
@@ -290,13 +287,17 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
 
         if composite_ids is None:
             self.composite_tests = {}
+            self.composite_pks = {}
+            self.composite_deps = {}
             return
 
         composite_tests = models.Test.objects.filter(
             pk__in=composite_ids
-        ).values_list("slug", "calculation_procedure")
+        ).values_list("pk", "slug", "calculation_procedure", "calculation_dependencies")
 
-        self.composite_tests = dict(composite_tests)
+        self.composite_tests = dict((slug, proc) for pk, slug, proc, deps in composite_tests)
+        self.composite_pks = dict((slug, pk) for pk, slug, proc, deps in composite_tests)
+        self.composite_deps = dict((slug, set(deps.split())) for pk, slug, proc, deps in composite_tests)
 
     def set_calculation_context(self):
         """set up the environment that the composite test will be calculated in"""
@@ -304,6 +305,7 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
         self.calculation_context = super(CompositeCalculation, self).set_calculation_context()
 
         values = self.get_json_data("qavalues")
+        self.qa_values = values or {}
         meta_data = self.get_json_data("meta")
 
         for d in ("work_completed", "work_started",):
@@ -324,8 +326,6 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
             "TOLS": tols,
         })
 
-        self.calculation_context.update(DEFAULT_CALCULATION_CONTEXT)
-
         for slug, val in values.items():
             if slug not in self.composite_tests:
                 self.calculation_context[slug] = val
@@ -334,11 +334,29 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
         """figure out composite dependencies of composite tests"""
 
         self.dependencies = {}
-        slugs = list(self.composite_tests.keys())
+        slugs = set(self.composite_tests.keys())
         for slug in slugs:
-            tokens = utils.tokenize_composite_calc(self.composite_tests[slug])
-            dependencies = [s for s in slugs if s in tokens and s != slug]
-            self.dependencies[slug] = set(dependencies)
+            self.dependencies[slug] = (self.composite_deps[slug] & slugs) - set([slug])
+
+    def set_affected_composites(self):
+        """
+        Determine which composites need to be recalculated.  If the request
+        includes a list of `changed` test slugs, only composites which
+        depend (directly or indirectly) on those tests are recalculated and
+        the submitted values of all other composites are used as is.
+        Otherwise all composites are recalculated.
+        """
+
+        changed = self.get_json_data("changed")
+        if changed is None:
+            self.affected = set(self.composite_tests.keys())
+            return
+
+        self.affected = calculation.affected_slugs(self.composite_deps, changed)
+
+        for slug in self.composite_tests:
+            if slug not in self.affected and slug in self.qa_values:
+                self.calculation_context[slug] = self.qa_values[slug]
 
     def resolve_dependency_order(self):
         """
@@ -353,22 +371,10 @@ class CompositeCalculation(JSONResponseMixin, AttachmentMixin, View):
         See http://code.activestate.com/recipes/577413-topological-sort/
         """
 
-        #
-        data = dict(self.dependencies)
-        for k, v in list(data.items()):
-            v.discard(k)  # Ignore self dependencies
-        extra_items_in_deps = reduce(set.union, list(data.values())) - set(data.keys())
-        data.update(dict((item, set()) for item in extra_items_in_deps))
-        deps = []
-        while True:
-            ordered = set(item for item, dep in list(data.items()) if not dep)
-            if not ordered:
-                break
-            deps.extend(list(sorted(ordered)))
-            data = dict((item, (dep - ordered)) for item, dep in list(data.items()) if item not in ordered)
-
-        self.calculation_order = deps
-        self.cyclic_tests = list(data.keys())
+        layers, self.cyclic_tests = calculation.dependency_layers(self.dependencies)
+        self.calculation_order = [slug for layer in layers for slug in layer]
+        # calculation_order split into groups of tests which only depend on earlier groups
+        self.calculation_layers = layers
 
 
 class ChooseUnit(TemplateView):
@@ -421,35 +427,39 @@ class PerformQA(PermissionRequiredMixin, CreateView):
     form_class = forms.CreateTestListInstanceForm
     model = models.TestListInstance
 
-    def set_test_lists(self):
+    def set_payload(self):
         """
-        Set the :model:`qa.TestList` and the day that are to be performed.
+        Set the :model:`qa.TestList` and the day that are to be performed,
+        all tests to be performed (including tests from sublists) and their
+        ordered :model:`qa.UnitTestInfo`s from the cached perform payload.
         The day is 0 for :model:`qa.TestList` or 0 - N-1 for
         :model:`qa.TestListCycle`'s (where N is number of lists in the cycle).
         """
 
         requested_day = self.get_requested_day_to_perform()
-        self.actual_day, self.test_list = self.unit_test_col.get_list(requested_day)
+        self.payload = payload.get_payload(self.unit_test_col, requested_day)
 
-        if self.test_list is None:
+        if self.payload is None:
             raise Http404
 
-        self.all_lists = [self.test_list] + list(self.test_list.sublists.order_by("name"))
-
-    def set_all_tests(self):
-        """Find all tests to be performed, including tests from sublists"""
+        self.actual_day = self.payload["actual_day"]
+        self.test_list = self.payload["test_list"]
+        self.all_lists = self.payload["all_lists"]
+        self.all_tests = self.payload["all_tests"]
+        self.unit_test_infos = self.payload["unit_test_infos"]
 
-        self.all_tests = []
-        for test_list in self.all_lists:
-            tests = test_list.tests.all().order_by("testlistmembership__order")
-            self.all_tests.extend(tests)
+        for test_pk, test_name in self.payload["missing_tests"]:
+            # if this happens it usually indicates a bug somewhere. Please report.
+            msg = "Do not treat! Please call physics.  Test '%s' is missing information for this unit " % test_name
+            logger.error(msg + " Test=%d" % test_pk)
+            messages.error(self.request, _(msg))
 
     def set_unit_test_collection(self):
         """Set the requested :model:`qa.UnitTestCollection` to be performed."""
 
         self.unit_test_col = get_object_or_404(
             models.UnitTestCollection.objects.select_related(
-                "unit", "frequency", "last_instance"
+                "unit", "frequency", "last_instance", "last_valid_instance"
             ).filter(
                 active=True,
                 visible_to__in=self.request.user.groups.all(),
@@ -465,69 +475,29 @@ class PerformQA(PermissionRequiredMixin, CreateView):
         if self.unit_test_col.last_instance:
             self.last_day = self.unit_test_col.last_instance.day + 1
 
-    def template_unit_test_infos(self):
-        """Convert :model:`qa.UnitTestInfo` into dicts for rendering in template"""
-
-        template_utis = []
-        for uti in self.unit_test_infos:
-            template_utis.append({
-                "id": uti.pk,
-                "test": model_to_dict(uti.test),
-                "reference": model_to_dict(uti.reference) if uti.reference else None,
-                "tolerance": model_to_dict(uti.tolerance) if uti.tolerance else None,
-            })
-
-        return template_utis
-
-    def set_unit_test_infos(self):
-        """Find and order all :model:`qa.UniTestInfo` objects for tests to be performed"""
-
-        utis = models.UnitTestInfo.objects.filter(
-            unit=self.unit_test_col.unit,
-            test__in=self.all_tests,
-            active=True,
-        ).select_related(
-            "reference",
-            "test__category",
-            # "test__pk",
-            "tolerance",
-            "unit",
-        )
-
-        # make sure utis are correctly ordered
-        uti_tests = [x.test for x in utis]
-        self.unit_test_infos = []
-        for test in self.all_tests:
-            try:
-                self.unit_test_infos.append(utis[uti_tests.index(test)])
-            except ValueError:
-                # if this happens it usually indicates a bug somewhere. Please report.
-                msg = "Do not treat! Please call physics.  Test '%s' is missing information for this unit " % test.name
-                logger.error(msg + " Test=%d" % test.pk)
-                messages.error(self.request, _(msg))
-
     def add_histories(self, forms):
         """paste historical values onto unit test infos (ugly)"""
 
-        history, history_dates = self.unit_test_col.history()
+        test_histories, history_dates = self.unit_test_col.history(number=history_depth(self.request))
         self.history_dates = history_dates
+        by_test = dict((test.pk, hist) for test, hist in test_histories)
         for form in forms:
-            for test, hist in history:
-                if test == form.unit_test_info.test:
-                    form.history = hist
-                    break
+            if form.unit_test_info.test_id in by_test:
+                form.history = by_test[form.unit_test_info.test_id]
 
     def get_test_status(self, form):
         """return default or user requested :model:`qa.TestInstanceStatus`"""
 
-        try:
-            status = models.TestInstanceStatus.objects.get(pk=form["status"].value())
-            self.user_set_status = True
-            return status
-        except (KeyError, ValueError, models.TestInstanceStatus.DoesNotExist):
-            self.user_set_status = False
-            return models.TestInstanceStatus.objects.default()
-
+        with refdata.scope() as data:
+            try:
+                status = data.status(form["status"].value())
+                self.user_set_status = True
+                return status
+            except (KeyError, ValueError, models.TestInstanceStatus.DoesNotExist):
+                self.user_set_status = False
+                return data.default_status()
+
+    @refdata.scoped
     def form_valid(self, form):
         """
         TestListInstance form has validated, now check for validity of
@@ -544,6 +514,27 @@ class PerformQA(PermissionRequiredMixin, CreateView):
 
         status = self.get_test_status(form)
 
+        with transaction.atomic():
+            self.create_test_list_instance(form, formset, status)
+
+        if not self.object.in_progress:
+            # TestListInstance & TestInstances have been successfully create, fire signal
+            # to inform any listeners (e.g notifications.handlers.email_no_testlist_save)
+            signals.testlist_complete.send(sender=self, instance=self.object, created=False)
+
+        # let user know request succeeded and return to unit list
+        messages.success(self.request, _("Successfully submitted %s " % self.object.test_list.name))
+
+        return HttpResponseRedirect(self.get_success_url())
+
+    def create_test_list_instance(self, form, formset, status):
+        """
+        Create the :model:`qa.TestListInstance`, its :model:`qa.TestInstance`s
+        and attachments and update the last instance & due date of the unit
+        test collection using a number of queries which does not depend on
+        the number of tests being performed.
+        """
+
         self.object = form.save(commit=False)
         self.object.test_list = self.test_list
         self.object.unit_test_collection = self.unit_test_col
@@ -558,21 +549,12 @@ class PerformQA(PermissionRequiredMixin, CreateView):
 
         self.object.day = self.actual_day
 
-        # save here so pk is set when saving test instances
-        # and save below to get due deate set ocrrectly
-        self.object.save()
-
-        self.create_tli_attachments()
-
         to_save = []
+        attachment_ids = []
 
-        attachments = []
-
-        for delta, ti_form in enumerate(formset):
+        for ti_form in formset:
 
-            now = self.object.created + timezone.timedelta(milliseconds=delta)
-
-            attachments.extend(ti_form.attachments_to_process)
+            attachment_ids.extend((ti_form.unit_test_info.pk, aid) for aid in ti_form.attachment_ids())
 
             ti = models.TestInstance(
                 value=ti_form.cleaned_data.get("value", None),
@@ -583,37 +565,50 @@ class PerformQA(PermissionRequiredMixin, CreateView):
                 reference=ti_form.unit_test_info.reference,
                 tolerance=ti_form.unit_test_info.tolerance,
                 status=status,
-                created=now,
                 created_by=self.request.user,
                 modified_by=self.request.user,
                 test_list_instance=self.object,
                 work_started=self.object.work_started,
                 work_completed=self.object.work_completed,
             )
-            ti.calculate_pass_fail()
-            if not self.user_set_status:
-                ti.auto_review()
-
             to_save.append(ti)
 
-        models.TestInstance.objects.bulk_create(to_save)
+        # grade & review test instances before the test list instance is saved
+        # so that its review status is known up front
+        errors = passfail.calculate_pass_fail(to_save)
+        if errors:
+            raise errors[0][1]
 
-        set_attachment_owners(self.object, attachments)
+        for ti in to_save:
+            ti.set_differences()
 
-        # set due date to account for any non default statuses
-        self.object.unit_test_collection.set_due_date()
+        if not self.user_set_status:
+            for ti in to_save:
+                ti.auto_review()
 
-        self.object.update_all_reviewed()
+        self.object.all_reviewed = not any(ti.status.requires_review for ti in to_save)
 
-        if not self.object.in_progress:
-            # TestListInstance & TestInstances have been successfully create, fire signal
-            # to inform any listeners (e.g notifications.handlers.email_no_testlist_save)
-            signals.testlist_complete.send(sender=self, instance=self.object, created=False)
+        # last instance & due date are updated below once the statuses of all
+        # test instances have been saved
+        with signals.last_instance_updates_deferred():
+            self.object.save()
 
-        # let user know request succeeded and return to unit list
-        messages.success(self.request, _("Successfully submitted %s " % self.object.test_list.name))
+        self.create_tli_attachments()
 
-        return HttpResponseRedirect(self.get_success_url())
+        for delta, ti in enumerate(to_save):
+            # reassign now that test list instance has a pk
+            ti.test_list_instance = self.object
+            ti.created = self.object.created + timezone.timedelta(milliseconds=delta)
+
+        models.TestInstance.objects.bulk_create(to_save)
+
+        set_attachment_owners(self.object, to_save, attachment_ids)
+
+        signals.update_last_instances(
+            self.object,
+            created=True,
+            valid=all(ti.status.valid for ti in to_save),
+        )
 
     def create_tli_attachments(self):
         for idx, f in enumerate(self.request.FILES.getlist('tli-attachments')):
@@ -640,10 +635,8 @@ class PerformQA(PermissionRequiredMixin, CreateView):
 
         # setup our test list, tests, current day etc
         self.set_unit_test_collection()
-        self.set_test_lists()
+        self.set_payload()
         self.set_last_day()
-        self.set_all_tests()
-        self.set_unit_test_infos()
 
         if self.request.method == "POST":
             formset = forms.CreateTestInstanceFormSet(self.request.POST, self.request.FILES, unit_test_infos=self.unit_test_infos, user=self.request.user)
@@ -654,17 +647,16 @@ class PerformQA(PermissionRequiredMixin, CreateView):
 
         context["formset"] = formset
         context["history_dates"] = self.history_dates
-        context['categories'] = set([x.test.category for x in self.unit_test_infos])
+        context['categories'] = self.payload["categories"]
         context['current_day'] = self.actual_day + 1
         context["last_instance"] = self.unit_test_col.last_instance
         context['last_day'] = self.last_day
 
-        ndays = len(self.unit_test_col.tests_object)
-        if ndays > 1:
-            context['days'] = self.unit_test_col.tests_object.days_display()
+        if self.payload["days"]:
+            context['days'] = self.payload["days"]
 
         context["test_list"] = self.test_list
-        context["unit_test_infos"] = json.dumps(self.template_unit_test_infos())
+        context["unit_test_infos"] = self.payload["template_unit_test_infos"]
         context["unit_test_collection"] = self.unit_test_col
         context["contacts"] = list(Contact.objects.all().order_by("name"))
 
@@ -709,6 +701,7 @@ class EditTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
     form_class = forms.UpdateTestListInstanceForm
     formset_class = forms.UpdateTestInstanceFormSet
 
+    @refdata.scoped
     def form_valid(self, form):
 
         self.form = form
@@ -724,21 +717,24 @@ class EditTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
                 status_pk = form["status"].value()
             self.set_status_object(status_pk)
 
-            self.update_test_list_instance()
+            # last instance & due date are updated once all test instances
+            # have been saved
+            with signals.last_instance_updates_deferred():
+                self.update_test_list_instance()
 
-            for ti_form in formset:
+                for ti_form in formset:
 
-                ti = ti_form.save(commit=False)
+                    ti = ti_form.save(commit=False)
 
-                self.update_test_instance(ti)
+                    self.update_test_instance(ti)
 
-                ti.attachment_set.clear()
+                    ti.attachment_set.clear()
 
-                for uti_pk, attachment in ti_form.attachments_to_process:
-                    attachment.testinstance = ti
-                    attachment.save()
+                    for uti_pk, attachment in ti_form.attachments_to_process:
+                        attachment.testinstance = ti
+                        attachment.save()
 
-            self.object.unit_test_collection.set_due_date()
+            signals.update_last_instances(self.object)
 
             self.object.update_all_reviewed()
 
@@ -777,12 +773,13 @@ class EditTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
 
     def set_status_object(self, status_pk):
 
-        try:
-            self.status = models.TestInstanceStatus.objects.get(pk=status_pk)
-            self.user_set_status = True
-        except (models.TestInstanceStatus.DoesNotExist, ValueError):
-            self.status = models.TestInstanceStatus.objects.default()
-            self.user_set_status = False
+        with refdata.scope() as data:
+            try:
+                self.status = data.status(status_pk)
+                self.user_set_status = True
+            except (models.TestInstanceStatus.DoesNotExist, ValueError):
+                self.status = data.default_status()
+                self.user_set_status = False
 
     def update_test_instance(self, test_instance):
         """do bookkeeping for :model:`qa.TestInstance`"""
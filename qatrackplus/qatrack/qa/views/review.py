@@ -10,7 +10,7 @@ from django.utils import timezone
 from django.utils.translation import ugettext as _
 from django.views.generic import ListView, TemplateView, DetailView, View
 
-from .. import models, utils
+from .. import history, models, signals, utils
 from . import forms
 from .base import TestListInstanceMixin, BaseEditTestListInstance, TestListInstances, UTCList
 from .perform import ChooseUnit
@@ -59,34 +59,40 @@ class ReviewTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
         test_list_instance.reviewed = review_time
         test_list_instance.reviewed_by = review_user
         test_list_instance.all_reviewed = True
-        test_list_instance.save()
-
-        # note we are not calling if formset.is_valid() here since we assume
-        # validity given we are only changing the status of the test_instances.
-        # Also, we are not cleaning the data since a 500 will be raised if
-        # something other than a valid int is passed for the status.
-        #
-        # If you add something here be very careful to check that the data
-        # is clean before updating the db
-
-        # for efficiency update statuses in bulk rather than test by test basis
-        status_groups = collections.defaultdict(list)
-        for ti_form in formset:
-            status_pk = int(ti_form["status"].value())
-            status_groups[status_pk].append(ti_form.instance.pk)
-
-        still_requires_review = False
-        for status_pk, test_instance_pks in list(status_groups.items()):
-            status = models.TestInstanceStatus.objects.get(pk=status_pk)
-            if status.requires_review:
-                still_requires_review = True
-            models.TestInstance.objects.filter(pk__in=test_instance_pks).update(status=status)
-
-        if still_requires_review:
-            test_list_instance.all_reviewed = False
+
+        # last instance, last valid instance & due date are updated once all
+        # statuses have been changed
+        with signals.last_instance_updates_deferred():
             test_list_instance.save()
 
-        test_list_instance.unit_test_collection.set_due_date()
+            # note we are not calling if formset.is_valid() here since we assume
+            # validity given we are only changing the status of the test_instances.
+            # Also, we are not cleaning the data since a 500 will be raised if
+            # something other than a valid int is passed for the status.
+            #
+            # If you add something here be very careful to check that the data
+            # is clean before updating the db
+
+            # for efficiency update statuses in bulk rather than test by test basis
+            status_groups = collections.defaultdict(list)
+            for ti_form in formset:
+                status_pk = int(ti_form["status"].value())
+                status_groups[status_pk].append(ti_form.instance.pk)
+
+            still_requires_review = False
+            for status_pk, test_instance_pks in list(status_groups.items()):
+                status = models.TestInstanceStatus.objects.get(pk=status_pk)
+                if status.requires_review:
+                    still_requires_review = True
+                models.TestInstance.objects.filter(pk__in=test_instance_pks).update(status=status)
+
+            if still_requires_review:
+                test_list_instance.all_reviewed = False
+                test_list_instance.save()
+
+        history.invalidate(test_list_instance.unit_test_collection_id)
+
+        signals.update_last_instances(test_list_instance)
 
         # let user know request succeeded and return to unit list
         messages.success(self.request, _("Successfully updated %s " % self.object.test_list.name))
@@ -318,6 +324,13 @@ class DueDateOverview(PermissionRequiredMixin, TemplateView):
         next_month_start = month_end + timezone.timedelta(days=1)
         next_month_end = timezone.datetime(next_month_start.year, next_month_start.month, calendar.mdays[next_month_start.month]).date()
 
+        # only fetch collections that fall into one of the due categories
+        next_month_end_dt = timezone.make_aware(
+            timezone.datetime(next_month_end.year, next_month_end.month, next_month_end.day) + timezone.timedelta(days=1),
+            timezone.get_current_timezone(),
+        )
+        qs = qs.filter(due_date__lt=next_month_end_dt).annotate(annotated_due_status=models.due_status_case(now))
+
         due = collections.defaultdict(list)
 
         for utc in qs:
@@ -374,6 +387,8 @@ class OverviewObjects(JSONResponseMixin, View):
             "last_instance__modified_by",
         ).extra(
             **utils.qs_extra_for_utc_name()
+        ).annotate(
+            annotated_due_status=models.due_status_case(),
         ).order_by("frequency__nominal_interval", "unit__number", "utc_name", )
 
         return qs.distinct()
@@ -386,7 +401,13 @@ class OverviewObjects(JSONResponseMixin, View):
         frequencies = list(models.Frequency.objects.order_by("nominal_interval")) + [None]
 
         unit_lists = collections.OrderedDict()
-        due_counts = {'ok': 0, 'tolerance': 0, 'action': 0, 'no_tol': 0}
+        due_counts = models.UnitTestCollection.objects.due_status_counts(
+            models.UnitTestCollection.objects.filter(active=True),
+        )
+
+        by_unit_freq = collections.defaultdict(list)
+        for utc in qs:
+            by_unit_freq[(utc.unit_id, utc.frequency_id)].append(utc)
 
         for unit in units:
             unit_freqs = collections.OrderedDict()
@@ -394,26 +415,23 @@ class OverviewObjects(JSONResponseMixin, View):
                 freq_name = freq.name if freq else 'Ad Hoc'
                 if freq_name not in unit_freqs:
                     unit_freqs[freq_name] = collections.OrderedDict()
-                for utc in qs:
-                    if utc.frequency == freq and utc.unit == unit:
-
-                        if utc.last_instance:
-                            last_instance_pfs = {}
-                            for lipfs in utc.last_instance.pass_fail_status():
-                                last_instance_pfs[lipfs[0]] = len(lipfs[2])
-                        else:
-                            last_instance_pfs = 'New List'
-
-                        ds = utc.due_status()
-                        unit_freqs[freq_name][utc.utc_name] = {
-                            'id': utc.pk,
-                            'url': reverse('review_utc', args=(utc.pk,)),
-                            'last_instance_status': last_instance_pfs,
-                            'last_instance_work_completed': utc.last_instance.work_completed if utc.last_instance else None,
-                            'due_date': utc.due_date,
-                            'due_status': ds
-                        }
-                        due_counts[ds] += 1
+                for utc in by_unit_freq[(unit.pk, freq.pk if freq else None)]:
+                    if utc.last_instance:
+                        last_instance_pfs = {}
+                        for lipfs in utc.last_instance.pass_fail_status():
+                            last_instance_pfs[lipfs[0]] = len(lipfs[2])
+                    else:
+                        last_instance_pfs = 'New List'
+
+                    ds = utc.due_status()
+                    unit_freqs[freq_name][utc.utc_name] = {
+                        'id': utc.pk,
+                        'url': reverse('review_utc', args=(utc.pk,)),
+                        'last_instance_status': last_instance_pfs,
+                        'last_instance_work_completed': utc.last_instance.work_completed if utc.last_instance else None,
+                        'due_date': utc.due_date,
+                        'due_status': ds
+                    }
             # print unit_freqs
             unit_lists[unit.name] = unit_freqs
 
@@ -249,12 +249,46 @@ CACHE_LOCATION = os.path.join(PROJECT_ROOT, "cache", "cache_data")
 if not os.path.isdir(CACHE_LOCATION):
     os.mkdir(CACHE_LOCATION)
 
+# cache for results of upload test calculation procedures. Entries are keyed
+# on file contents, procedure & meta/reference/tolerance data so never go
+# stale, but the number of entries is capped.
+CALCULATION_RESULT_CACHE = 'calculations'
+CALCULATION_CACHE_LOCATION = os.path.join(PROJECT_ROOT, "cache", "calculation_results")
+if not os.path.isdir(CALCULATION_CACHE_LOCATION):
+    os.mkdir(CALCULATION_CACHE_LOCATION)
+
+# cache for test history tables shown when performing/reviewing QA (see qa.history)
+HISTORY_CACHE = 'history'
+HISTORY_CACHE_LOCATION = os.path.join(PROJECT_ROOT, "cache", "history")
+if not os.path.isdir(HISTORY_CACHE_LOCATION):
+    os.mkdir(HISTORY_CACHE_LOCATION)
+
+# cache for the tests, unit test infos etc required to perform a test list (see qa.payload)
+PERFORM_PAYLOAD_CACHE = HISTORY_CACHE
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': CACHE_LOCATION,
         'TIMEOUT': MAX_CACHE_TIMEOUT,
-    }
+    },
+    HISTORY_CACHE: {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': HISTORY_CACHE_LOCATION,
+        'TIMEOUT': MAX_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    CALCULATION_RESULT_CACHE: {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CALCULATION_CACHE_LOCATION,
+        'TIMEOUT': 7 * MAX_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+            'CULL_FREQUENCY': 4,
+        },
+    },
 }
 
 # -----------------------------------------------------------------------------
@@ -372,6 +406,7 @@ FORCE_SCRIPT_NAME = None
 PAGINATE_DEFAULT = 50  # remember to change iDisplayLength in unittestcollection.js and testlistinstance.js if you change this
 
 NHIST = 5  # number of historical test results to show when reviewing/performing qa
+NHIST_MAX = 50  # maximum number of historical results which can be requested (e.g. ?history=20)
 
 ICON_SETTINGS = {
     'SHOW_STATUS_ICONS_PERFORM': True,
@@ -411,6 +446,48 @@ TEST_STATUS_DISPLAY_SHORT = {
     'no_tol': "NO TOL",
 }
 
+# ------------------------------------------------------------------------------
+# Calculation procedure settings
+
+# Number of worker processes (per web server process) used to execute
+# composite & upload calculation procedures. Set to 0 to execute
+# calculation procedures in the web server process itself (procedures are
+# then run one at a time per web server process).
+CALCULATION_POOL_SIZE = 2
+
+# Run independent composite calculations concurrently on the worker pool
+CALCULATION_PARALLEL = True
+
+# Maximum number of seconds a single calculation procedure may run for
+CALCULATION_TIMEOUT = 30
+
+# Maximum memory (in MB) a calculation worker may allocate
+CALCULATION_MEMORY_LIMIT = 1024
+
+# Limits for the per worker cache of parsed upload files (see UPLOAD.parse)
+CALCULATION_FILE_CACHE_ENTRIES = 8
+CALCULATION_FILE_CACHE_SIZE = 512  # MB of source files
+CALCULATION_FILE_CACHE_TIMEOUT = 5 * 60
+
+# Record execution time & memory statistics for calculation procedures
+# (see the "Slowest procedures" admin page)
+CALCULATION_STATS = True
+CALCULATION_STATS_WINDOW = 200  # number of recent executions kept per test
+CALCULATION_STATS_FLUSH_SIZE = 50  # samples buffered before writing to the database
+CALCULATION_STATS_FLUSH_INTERVAL = 30  # max seconds between writes
+# Peak memory is recorded as the growth of a pool worker's peak RSS. Set to
+# True to trace the peak Python allocation of each execution with tracemalloc
+# instead (slow, and includes other threads when running in process)
+CALCULATION_TRACE_MEMORY = False
+
+# Set to True to process upload tests asynchronously. Uploads are queued
+# and processed by the `run_upload_jobs` management command which must be
+# running alongside the web server.
+UPLOAD_ASYNC = False
+
+# Number of seconds completed upload jobs are kept for
+UPLOAD_JOB_MAX_AGE = 24 * 60 * 60
+
 # ------------------------------------------------------------------------------
 # local_settings contains anything that should be overridden
 # based on site specific requirements (e.g. deployment, development etc)
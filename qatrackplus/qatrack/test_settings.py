@@ -2,12 +2,18 @@
 import os
 
 from selenium import webdriver
-from .settings import PROJECT_ROOT, INSTALLED_APPS
+from .settings import PROJECT_ROOT, INSTALLED_APPS, CACHES, HISTORY_CACHE
 
 NOTIFICATIONS_ON = False
 DEBUG = False
 
 SELENIUM_DRIVER = webdriver.Firefox
+
+# history cache versions outlive the test database so don't cache histories
+# unless a test explicitly enables it
+CACHES = dict(CACHES)
+CACHES[HISTORY_CACHE] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
 os.environ['DJANGO_LIVE_TEST_SERVER_ADDRESS'] = 'localhost:8000'
 
 try: